@@ -1,65 +1,214 @@
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+if __name__ == '__main__' and '--profile-startup' in sys.argv:
+    # before the imports below, which are what it measures
+    from app.startup import profile_imports
+    sys.exit(profile_imports())
+
 import asyncio
+import hashlib
+import json
 import logging
-from json import JSONEncoder
+import signal
+from contextlib import suppress
 
-import sentry_sdk
 from aiogram import types
 
-from app import dialogs, config
+from app import dialogs, config, metrics
 from app.bot_loader import bot
+from app.connections import redis
 from app.dialogs.main.states import Main
+from app.extensions.rendering import RenderingManagerFactory
 from app.handlers import errors
-from app.loader import dp, DEFAULT_USER_COMMANDS
+from app.loader import dp, storage, DEFAULT_USER_COMMANDS
+from app.middlewares.album import AlbumMiddleware
+from app.middlewares.batching import StorageBatchMiddleware
+from app.middlewares.debounce import DebounceMiddleware
+from app.middlewares.draining import InFlightMiddleware
+from app.middlewares.throttling import ThrottlingMiddleware
+from app.polling import poller
+from app.retention import RetentionSweeper
+from app.sanitizer import sanitizer
+from app.sender import scheduler, send_queue
+from app.sharding import setup_ingress, consume_updates
+from app.webhook import start_webhook
 from aiogram_dialog import DialogRegistry
 
 if config.SENTRY_DSN:
-    sentry_sdk.init(config.SENTRY_DSN, traces_sample_rate=0.5)
+    # imported only when used, it is a tenth of the start-up imports
+    import sentry_sdk
+    sentry_sdk.init(config.SENTRY_DSN, traces_sample_rate=config.SENTRY_TRACES_SAMPLE_RATE)
+
+IMPORTED = time.perf_counter()
+COMMANDS_KEY = 'anon:commands'
+# commands are set again at least this often, in case they were changed elsewhere
+COMMANDS_TTL = 24 * 60 * 60
 
 logger = logging.getLogger(__name__)
+in_flight = InFlightMiddleware()
+stopping = asyncio.Event()
 
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=config.LOG_LEVEL,
     format="%(asctime)s - %(levelname)s - %(funcName)s - %(name)s - %(message)s",
 )
 
 
-def _default(self, obj):
-    return getattr(obj.__class__, "to_json", _default.default)(obj)
-
-
-_default.default = JSONEncoder().default
-JSONEncoder.default = _default
-
-
 async def main():
     logger.info("Starting bot")
+    setup_started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # not available on Windows
+    with suppress(NotImplementedError):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, request_stop, sig, asyncio.current_task())
 
     await setup_commands()
 
-    dp.include_router(dialogs.main.router)
-    dp.include_router(errors.router)
-    await register_registry()
-
+    registry = await setup_dispatcher()
+    if config.PROCESS_ROLE == 'ingress':
+        setup_ingress(dp)
+    else:
+        await send_queue.start(registry)
+        scheduler.start()
+
+    sweeper = None
+    if config.SWEEP_INTERVAL and config.PROCESS_ROLE != 'ingress' and config.SHARD_INDEX == 0:
+        sweeper = RetentionSweeper(storage, config.SWEEP_INTERVAL, config.SWEEP_BATCH)
+        sweeper.start()
+
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT,
+                                                    collectors=[send_queue.collect_metrics,
+                                                                scheduler.collect_metrics,
+                                                                redis.connection_pool.collect_metrics])
+
+    logger.info("Started in %.2f s: imports %.2f s, setup %.2f s", time.perf_counter() - STARTED,
+                IMPORTED - STARTED, time.perf_counter() - setup_started)
     try:
-        await dp.start_polling(bot)
+        await serve()
+        await drain(config.DRAIN_TIMEOUT)
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if sweeper:
+            await sweeper.stop()
+        await scheduler.stop()
+        await send_queue.stop()
+        await sanitizer.close()
         await dp.storage.close()
+        await redis.connection_pool.disconnect()
         await bot.session.close()
 
 
+def request_stop(sig: signal.Signals, main_task: asyncio.Task):
+    if stopping.is_set():
+        logger.warning("Got %s again, stopping without draining", sig.name)
+        main_task.cancel()
+        return
+    logger.info("Got %s, stopping", sig.name)
+    stopping.set()
+
+
+async def serve():
+    """
+    Receives updates until stopped. A crash restarts only this:
+    the session, storage, dispatcher and dialogs are set up once per process
+    """
+    while not stopping.is_set():
+        receiving = asyncio.create_task(receive_updates())
+        stop = asyncio.create_task(stopping.wait())
+        await asyncio.wait((receiving, stop), return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        if not receiving.done():
+            # no new updates, those being handled are left to drain()
+            receiving.cancel()
+            with suppress(asyncio.CancelledError):
+                await receiving
+            return
+        try:
+            receiving.result()
+            return
+        except Exception:
+            logger.exception("Receiving updates failed, restarting in %s s", config.RESTART_DELAY)
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stopping.wait(), config.RESTART_DELAY)
+        logger.info("Restarting")
+
+
+async def drain(timeout: float):
+    """Waits up to `timeout` seconds for updates being handled and posts being sent"""
+    deadline = time.monotonic() + timeout
+    drained = await in_flight.wait(timeout)
+    await send_queue.stop(max(deadline - time.monotonic(), 0))
+    # sent posts are reported to their authors by dialog background updates
+    drained = await in_flight.wait(max(deadline - time.monotonic(), 0)) and drained
+    if not drained:
+        logger.warning("Stopped with %s updates still being handled", in_flight.count)
+    await poller.flush()
+
+
+async def receive_updates():
+    if config.PROCESS_ROLE == 'worker':
+        await consume_updates(dp, bot, send_queue.show_report)
+    elif config.UPDATES_MODE == 'webhook':
+        await start_webhook()
+    else:
+        await bot.delete_webhook()
+        await poller.run()
+
+
+async def setup_dispatcher():
+    # outermost, so that draining waits for the whole update
+    dp.update.outer_middleware(in_flight)
+    if config.METRICS_PORT:
+        metrics.setup(dp)
+    # workers handle a chat's updates one by one, they never see a burst
+    if config.RENDER_DEBOUNCE and config.PROCESS_ROLE == 'single':
+        # waits before the storage batch reads what the update needs
+        dp.update.outer_middleware(DebounceMiddleware(config.RENDER_DEBOUNCE))
+    if config.STORAGE_BATCH and config.PROCESS_ROLE != 'ingress':
+        StorageBatchMiddleware.setup(dp)
+    dp.include_router(dialogs.main.router)
+    dp.include_router(errors.router)
+    dp.message.outer_middleware(AlbumMiddleware(config.ALBUM_LATENCY))
+    dp.message.middleware(ThrottlingMiddleware(dp.storage.redis))
+    registry = await register_registry()
+    if config.METRICS_PORT:
+        metrics.setup_handlers(dp)
+    return registry
+
+
 async def setup_commands():
-    await bot.set_my_commands(DEFAULT_USER_COMMANDS, scope=types.BotCommandScopeAllPrivateChats())
+    scope = types.BotCommandScopeAllPrivateChats()
+    commands = json.dumps([scope.dict(), [command.dict() for command in DEFAULT_USER_COMMANDS]], sort_keys=True)
+    digest = hashlib.sha1(commands.encode()).hexdigest()
+    key = f'{COMMANDS_KEY}:{bot.id}'
+    # every restart of every process would set the same commands otherwise
+    if await storage.redis.get(key) == digest.encode():
+        logger.info("Bot commands are up to date")
+        return
+
+    await bot.set_my_commands(DEFAULT_USER_COMMANDS, scope=scope)
+    await storage.redis.set(key, digest, ex=COMMANDS_TTL)
 
 
 async def register_registry():
-    registry = DialogRegistry(dp)
+    factory = RenderingManagerFactory()
+    registry = DialogRegistry(dp, message_manager=factory.message_manager, media_id_storage=factory.media_id_storage,
+                              dialog_manager_factory=factory)
+    factory.registry = registry
     registry.register(dialogs.main.dialog)
+    return registry
 
 
 if __name__ == '__main__':
-    while True:
-        try:
-            asyncio.run(main())
-        except (KeyboardInterrupt, SystemExit):
-            logger.info("Bot stopped!")
-            exit(0)
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
+        pass
+    logger.info("Bot stopped!")
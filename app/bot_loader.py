@@ -1,35 +1,29 @@
-import re
-from pathlib import Path
-
 from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from app import config
+from app.__version__ import __version__
+from app.metrics import BotAPIMetrics
 
 __all__ = ['bot']
 
 
-def _get_version():
-    here = Path(__file__).absolute().parent
-    entry = (here / '__version__.py').read_text('utf-8')
-
-    try:
-        version = re.findall(r"^__version__ = \"([^']+)\"\r?$", entry, re.M)[0]
-    except IndexError:
-        raise RuntimeError('Unable to determine version.')
-
-    return version
-
-
 class AnonBot(Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._version = None
+        if config.METRICS_PORT:
+            self.session.middleware(BotAPIMetrics())
 
     @property
     def version(self):
-        if self._version is None:
-            self._version = _get_version()
-        return self._version
+        return __version__
+
+
+def _get_session():
+    if not config.TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(config.TELEGRAM_API_URL))
 
 
-bot = AnonBot(config.BOT_TOKEN)
+bot = AnonBot(config.BOT_TOKEN, session=_get_session())
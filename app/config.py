@@ -6,7 +6,109 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 SENTRY_DSN = os.getenv('SENTRY_DSN')
+# Share of updates traced by Sentry performance monitoring, 0 disables tracing
+SENTRY_TRACES_SAMPLE_RATE = float(os.getenv('SENTRY_TRACES_SAMPLE_RATE', 0.05))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 REDIS_URL = os.getenv('REDIS_URL')
+# One pool of Redis connections per process, REDIS_URL may also be unix:///path/to/redis.sock?db=0.
+# Past REDIS_MAX_CONNECTIONS a command waits up to REDIS_POOL_TIMEOUT seconds for a free connection,
+# one idle for REDIS_HEALTH_CHECK_INTERVAL seconds is checked with a PING before it is used
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 64))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
 CHAT_ID = os.getenv('CHAT_ID')
 CHAT_NAME = os.getenv('CHAT_NAME')
 BOT_NAME = os.getenv('BOT_NAME')
+# Local Bot API server or a stand-in, e.g. http://localhost:8081
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Read the FSM and dialog keys of an update in one round trip and write them in one more
+STORAGE_BATCH = os.getenv('STORAGE_BATCH', '1') != '0'
+# Format FSM data is written in: "msgpack" or "json", both are always readable
+STORAGE_SERIALIZER = os.getenv('STORAGE_SERIALIZER', 'msgpack')
+# msgpack values longer than this many bytes are zlib-compressed, 0 disables compression
+STORAGE_COMPRESS_THRESHOLD = int(os.getenv('STORAGE_COMPRESS_THRESHOLD', 1024))
+
+# Retention of FSM keys, in seconds. Dialogs that reached Main.sent are finished
+STATE_TTL = int(os.getenv('STATE_TTL', 7 * 24 * 3600))
+DATA_TTL = int(os.getenv('DATA_TTL', 7 * 24 * 3600))
+DIALOG_TTL = int(os.getenv('DIALOG_TTL', 7 * 24 * 3600))
+FINISHED_DIALOG_TTL = int(os.getenv('FINISHED_DIALOG_TTL', 2 * 24 * 3600))
+# Seconds between sweeps over the keyspace that report its size and clamp TTLs, 0 disables them
+SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', 3600))
+SWEEP_BATCH = int(os.getenv('SWEEP_BATCH', 500))
+
+# Updates ingestion: "polling" (default) or "webhook"
+UPDATES_MODE = os.getenv('UPDATES_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', 5000))
+
+# Outbound send queue. Telegram allows about 20 messages per minute into a group
+SEND_CONCURRENCY = int(os.getenv('SEND_CONCURRENCY', 4))
+SEND_RATE_PER_MINUTE = int(os.getenv('SEND_RATE_PER_MINUTE', 20))
+SEND_BURST = int(os.getenv('SEND_BURST', 3))
+SEND_ATTEMPTS = int(os.getenv('SEND_ATTEMPTS', 5))
+# A process that hasn't renewed its heartbeat for SEND_HEARTBEAT_TTL seconds is taken for dead,
+# the posts it was sending are put back on the queue
+SEND_HEARTBEAT_TTL = int(os.getenv('SEND_HEARTBEAT_TTL', 30))
+# Scheduled posts are moved to the send queue SCHEDULE_BATCH at a time once due,
+# those scheduled by other processes are looked for every SCHEDULE_INTERVAL seconds
+SCHEDULE_BATCH = int(os.getenv('SCHEDULE_BATCH', 100))
+SCHEDULE_INTERVAL = float(os.getenv('SCHEDULE_INTERVAL', 1))
+
+# Process role: "single" receives and handles updates, "ingress" only receives them
+# and pushes them to Redis streams sharded by chat id, "worker" handles one shard
+PROCESS_ROLE = os.getenv('PROCESS_ROLE', 'single')
+SHARDS = int(os.getenv('SHARDS', 1))
+_DYNO_NUMBER = os.getenv('DYNO', '').rpartition('.')[2]
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', int(_DYNO_NUMBER) - 1 if _DYNO_NUMBER.isdigit() else 0))
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 64))
+UPDATES_STREAM_MAXLEN = int(os.getenv('UPDATES_STREAM_MAXLEN', 100000))
+
+# Seconds to wait for the rest of an album after its last received part
+ALBUM_LATENCY = float(os.getenv('ALBUM_LATENCY', 0.6))
+# Messages of a chat coming less than RENDER_DEBOUNCE seconds apart are answered with one redraw
+# of the dialog, for the last of them; every message waits that long. 0, the default, disables it
+RENDER_DEBOUNCE = float(os.getenv('RENDER_DEBOUNCE', 0))
+
+# Media downloads: size cap (the Bot API serves up to 20 MB), parallel downloads
+# and bytes kept in memory before a download spills to a temporary file
+MEDIA_MAX_SIZE = int(os.getenv('MEDIA_MAX_SIZE', 20 * 1024 * 1024))
+MEDIA_DOWNLOAD_CONCURRENCY = int(os.getenv('MEDIA_DOWNLOAD_CONCURRENCY', 4))
+MEDIA_SPOOL_SIZE = int(os.getenv('MEDIA_SPOOL_SIZE', 1024 * 1024))
+
+# JPEG and PNG documents are re-uploaded without metadata (EXIF, GPS, text chunks)
+# by SANITIZE_WORKERS processes; cleaned files are reused for SANITIZE_CACHE_TTL seconds
+SANITIZE_DOCUMENTS = os.getenv('SANITIZE_DOCUMENTS', '1') != '0'
+SANITIZE_WORKERS = int(os.getenv('SANITIZE_WORKERS', 2))
+SANITIZE_CACHE_TTL = int(os.getenv('SANITIZE_CACHE_TTL', 30 * 24 * 60 * 60))
+
+# A post repeating one sent during the last DEDUP_WINDOW seconds is not sent again, 0 disables the check
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 600))
+
+# Drafts: parts, media and characters a post may have (a media group holds up to 10,
+# text past a caption or a message is sent in messages of up to 4096 characters before the media);
+# a draft is kept for DRAFT_TTL seconds after it was last added to
+DRAFT_MAX_PARTS = int(os.getenv('DRAFT_MAX_PARTS', 20))
+DRAFT_MAX_MEDIA = int(os.getenv('DRAFT_MAX_MEDIA', 10))
+DRAFT_MAX_CHARS = int(os.getenv('DRAFT_MAX_CHARS', 4 * 4096))
+DRAFT_TTL = int(os.getenv('DRAFT_TTL', DIALOG_TTL))
+
+# Posts containing a phrase from the Redis set anon:moderation:patterns are not accepted, the set is
+# reloaded when anon:moderation:version changes, which is looked up every MODERATION_RELOAD_INTERVAL seconds
+MODERATION_RELOAD_INTERVAL = float(os.getenv('MODERATION_RELOAD_INTERVAL', 10))
+
+# Seconds between a crash of the updates loop (polling, webhook or worker) and its restart
+RESTART_DELAY = float(os.getenv('RESTART_DELAY', 5))
+# Seconds a getUpdates long poll waits for updates
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', 10))
+# On SIGTERM or SIGINT, seconds to finish updates being handled and posts being sent,
+# keep it below the platform's stop timeout (10 s for docker stop, 30 s on Heroku)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 8))
+
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables them
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
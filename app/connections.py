@@ -0,0 +1,52 @@
+import time
+from typing import Optional
+
+from redis.asyncio import Redis
+from redis.asyncio.connection import BlockingConnectionPool, Connection
+
+from app import config
+from app.metrics import REDIS_CONNECTIONS, REDIS_POOL_WAIT
+
+
+class SharedConnectionPool(BlockingConnectionPool):
+    """
+    Connections of the one Redis client of the process. Past `max_connections` a command
+    waits for a free connection up to `timeout` seconds instead of failing, the wait is measured
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_use = set()
+
+    async def get_connection(self, command_name, *keys, **options) -> Connection:
+        started = time.perf_counter()
+        # connecting a new connection counts as waiting too
+        connection = await super().get_connection(command_name, *keys, **options)
+        REDIS_POOL_WAIT.observe(time.perf_counter() - started)
+        self.in_use.add(connection)
+        return connection
+
+    async def release(self, connection: Connection):
+        # also called for a connection that failed to connect, before it was handed out
+        self.in_use.discard(connection)
+        await super().release(connection)
+
+    async def collect_metrics(self):
+        REDIS_CONNECTIONS.labels('open').set(len(self._connections))
+        REDIS_CONNECTIONS.labels('in_use').set(len(self.in_use))
+
+
+def create_redis(url: str, max_connections: int, pool_timeout: Optional[float],
+                 health_check_interval: int) -> Redis:
+    """A client on `url`, redis:// and rediss:// or unix:///path/to/redis.sock?db=0"""
+    kwargs = {}
+    if not url.startswith('unix://'):
+        # Unix socket connections don't take TCP options
+        kwargs['socket_keepalive'] = True
+    pool = SharedConnectionPool.from_url(url, max_connections=max_connections, timeout=pool_timeout,
+                                         health_check_interval=health_check_interval, **kwargs)
+    return Redis(connection_pool=pool)
+
+
+redis = create_redis(config.REDIS_URL, config.REDIS_MAX_CONNECTIONS, config.REDIS_POOL_TIMEOUT,
+                     config.REDIS_HEALTH_CHECK_INTERVAL)
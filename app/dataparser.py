@@ -1,26 +1,51 @@
 import typing
-from contextlib import suppress
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
 
 from aiogram_dialog import DialogManager
 
+PARSERS_KEY = 'anon_data_parsers'
 
-@dataclass
+
+@lru_cache(maxsize=None)
+def _field_names(cls) -> typing.FrozenSet[str]:
+    return frozenset(f.name for f in fields(cls) if f.name != 'dialog_manager')
+
+
+@dataclass(slots=True)
 class DataParser:
-    dialog_error = ''
-    dialog_manager: DialogManager = None
+    """
+    Typed view of dialog_data.
+
+    Fields are read from dialog_data once per update (see `register`),
+    every assignment writes only the changed key back to dialog_data,
+    which aiogram_dialog persists once when the update is processed.
+    """
+    dialog_error: str = ''
+    dialog_manager: typing.Optional[DialogManager] = field(default=None, repr=False, compare=False)
 
     @classmethod
     def register(cls, dialog_manager: DialogManager):
-        inst = cls()
+        # one instance per dialog context and update, reused by getters and handlers
+        cache = dialog_manager.middleware_data.setdefault(PARSERS_KEY, {})
+        dialog_data = dialog_manager.dialog_data
+
+        cached = cache.get(cls)
+        if cached is not None and cached[0] is dialog_data:
+            return cached[1]
+
+        inst = cls.parse(dialog_data)
         inst.dialog_manager = dialog_manager
-        inst._fetch()
+        cache[cls] = (dialog_data, inst)
         return inst
 
     @classmethod
     def parse(cls, data: typing.Dict):
         inst = cls()
-        inst._fetch(data)
+        names = _field_names(cls)
+        for key, value in (data or {}).items():
+            if key in names:
+                object.__setattr__(inst, key, value)
         return inst
 
     def clean(self):
@@ -28,6 +53,9 @@ class DataParser:
         self.update((inst,))
 
     def update(self, data: typing.Tuple):
+        names = _field_names(type(self))
+        dialog_data = self.dialog_manager.dialog_data if self.dialog_manager else None
+
         for data_dict in data:
             if data_dict is None:
                 continue
@@ -36,47 +64,32 @@ class DataParser:
                 data_dict = data_dict.force_dict()
 
             for key, value in data_dict.items():
-                with suppress(Exception):
-                    super().__setattr__(key, value)
-
-                if self.dialog_manager:
-                    self.dialog_manager.dialog_data[key] = value
-
-    def _fetch(self, data=None):
-        dialog_data = None
-
-        if not self.dialog_manager:
-            if data:
-                dialog_data = data
-        else:
-            dialog_data = self.dialog_manager.dialog_data
+                if key in names:
+                    object.__setattr__(self, key, value)
 
-        if dialog_data is not None:
-            for key, value in dialog_data.items():
-                with suppress(Exception):
-                    super().__setattr__(key, value)
+                if dialog_data is not None:
+                    dialog_data[key] = value
 
     def __getattr__(self, item):
-        self._fetch()
-        try:
-            return super().__getattribute__(item)
-        except AttributeError:
-            return None
+        # unknown or not yet initialized attributes read as None
+        return None
 
     def __setattr__(self, key, value):
-        if key != 'dialog_manager':
-            self._fetch()
+        object.__setattr__(self, key, value)
 
-            if self.dialog_manager:
-                self.dialog_manager.dialog_data[key] = value
-        super().__setattr__(key, value)
+        if key != 'dialog_manager' and self.dialog_manager:
+            self.dialog_manager.dialog_data[key] = value
 
     def pop(self, item):
         self.__setattr__(item, None)
 
     def force_dict(self) -> typing.Dict:
-        return {key: jsonify(value) for key, value in self.__dict__.items()
-                if value is not None and key != 'dialog_manager'}
+        result = {}
+        for key in _field_names(type(self)):
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = jsonify(value)
+        return result
 
 
 def jsonify(value):
@@ -0,0 +1,117 @@
+import hashlib
+import unicodedata
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from app import config
+from app.loader import storage
+
+PREFIX = 'anon:dedup:'
+PENDING = b'pending'
+SENT = b'sent:'
+
+# KEYS: post key, its waiters; ARGV: waiter, window.
+# The first post claims the key and gets nothing back, the same post sent while
+# the first one is queued joins its waiters, afterwards it gets 'sent:<url>'
+CLAIM_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if not value then
+    redis.call('SET', KEYS[1], 'pending', 'EX', ARGV[2])
+    return false
+end
+if value == 'pending' then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return value
+"""
+
+# KEYS: post key, its waiters; ARGV: 'sent:<url>' or '' to forget the post, window.
+# Returns the waiters to be told the outcome
+RESOLVE_SCRIPT = """
+if ARGV[1] == '' then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+end
+local waiters = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return waiters
+"""
+
+# soft hyphen, zero width space and joiners, word joiner, BOM
+INVISIBLE = '\u00ad\u200b\u200c\u200d\u2060\ufeff'
+
+
+class Claim(NamedTuple):
+    new: bool
+    sent: bool = False
+    sent_url: Optional[str] = None
+
+
+def normalize(text: str) -> str:
+    """Text as a reader sees it: compatibility forms, case, invisible characters and spacing don't count"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    # str.translate and regular expressions are slow on non-ASCII text, a substring search is not
+    for char in INVISIBLE:
+        if char in text:
+            text = text.replace(char, '')
+    return ' '.join(text.split())
+
+
+def fingerprint(text: Optional[str], unique_ids: Iterable[str]) -> Optional[str]:
+    """Hash of a post's normalized text and media, None for an empty post"""
+    text = normalize(text or '')
+    unique_ids = sorted(unique_ids)
+    if not text and not unique_ids:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(text.encode('utf-8'))
+    for unique_id in unique_ids:
+        digest.update(b'\x00' + unique_id.encode())
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    """
+    Posts sent to the chat during the last `window` seconds, by fingerprint.
+
+    A repeated post isn't sent again: its author gets the link to the first one,
+    right away or once the first one is out
+    """
+
+    def __init__(self, redis, window: int):
+        self.redis = redis
+        self.window = window
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+        self._resolve = redis.register_script(RESOLVE_SCRIPT)
+
+    def _keys(self, post: str) -> List[str]:
+        return [PREFIX + post, f'{PREFIX}{post}:waiters']
+
+    async def claim(self, post: str, user_id: int, user_chat_id: int) -> Claim:
+        """
+        A new post is for the caller to send and resolve. When the same post is still queued,
+        the user is told about it once it is out; when it is sent, `sent_url` links to it
+        """
+        value = await self._claim(keys=self._keys(post), args=[f'{user_id}:{user_chat_id}', self.window],
+                                  client=self.redis)
+        if value is None:
+            return Claim(new=True)
+        if value == PENDING:
+            return Claim(new=False)
+        return Claim(new=False, sent=True, sent_url=value[len(SENT):].decode() or None)
+
+    async def resolve(self, post: str, sent_url: Optional[str]) -> List[Tuple[int, int]]:
+        """Marks the post as sent, returns (user_id, user_chat_id) of those waiting for it"""
+        return await self._finish(post, SENT + (sent_url or '').encode())
+
+    async def release(self, post: str) -> List[Tuple[int, int]]:
+        """Forgets a post that couldn't be sent, returns those waiting for it"""
+        return await self._finish(post, b'')
+
+    async def _finish(self, post: str, value: bytes) -> List[Tuple[int, int]]:
+        waiters = await self._resolve(keys=self._keys(post), args=[value, self.window], client=self.redis)
+        return [tuple(map(int, waiter.split(b':'))) for waiter in waiters]
+
+
+dedup = DedupIndex(storage.redis, config.DEDUP_WINDOW)
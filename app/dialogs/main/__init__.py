@@ -6,7 +6,7 @@ from aiogram.types import Message, ContentType
 from aiogram.filters import Command
 from aiogram_dialog import Dialog, DialogManager, Window, StartMode
 from aiogram_dialog.widgets.input import MessageInput
-from aiogram_dialog.widgets.kbd import Radio
+from aiogram_dialog.widgets.kbd import Column, Radio, Select
 
 import app.extensions.widgets as w
 from app.extensions.emojis import Emojis
@@ -32,7 +32,7 @@ MineOrNot = (
 )
 
 
-@router.message(Command(commands=['start', 'help', 'menu']))
+@router.message(Command(commands=['start', 'help', 'menu']), flags={"throttling_key": "default"})
 async def start(message: Message, dialog_manager: DialogManager):
     await dialog_manager.start(Main.menu, mode=StartMode.RESET_STACK)
 
@@ -43,19 +43,66 @@ dialog = Dialog(
                  "Я {bot_name} [{bot_version}] для отправки анонимных сообщений в чатик {chat_name}!\n"
                  "Пиши, что хочешь отправить. Могу отправить также 📊опрос или медиа (спрячу под спойлер).",
                  err_prefix=True),
+        w.Format("\nВ черновике уже частей: {draft_parts}, новые добавятся после них.", when="draft_parts"),
         MessageInput(get.postcard_data, content_types=ContentType.ANY),
+        w.SwitchTo("Части поста", state=Main.parts, emoji=Emojis.parts, when="draft_parts"),
         state=Main.menu,
         getter=get.getter,
     ),
     Window(
-        w.Format("Все готово! Отправляем в чатик?", err_prefix=True),
+        w.Format("Все готово! Отправляем в чатик?\n"
+                 "В посте частей: {draft_parts}, из них медиа: {draft_media}. "
+                 "Пришлите ещё, чтобы добавить к посту.", err_prefix=True),
         MessageInput(get.postcard_data, content_types=ContentType.ANY),
         *MineOrNot,
         w.Button("Отправляем!", on_click=do.postcard_send, emoji=Emojis.mail),
+        w.SwitchTo("Отправить позже", state=Main.schedule, emoji=Emojis.clock),
+        w.SwitchTo("Части поста", state=Main.parts, emoji=Emojis.parts),
+        w.Button("Очистить", on_click=do.clear_draft, emoji=Emojis.remove),
         w.MainMenu(),
         state=Main.click_send,
         getter=get.getter,
     ),
+    Window(
+        w.Format("Части поста в том порядке, в каком они уйдут. Выберите часть, чтобы передвинуть или удалить её."),
+        Column(
+            Select(
+                w.Format("{item[0]}"),
+                id="parts_s",
+                item_id_getter=operator.itemgetter(1),
+                items="draft_items",
+                on_click=do.select_part,
+            ),
+        ),
+        MessageInput(get.postcard_data, content_types=ContentType.ANY),
+        w.SwitchTo("Назад", state=Main.click_send, emoji=Emojis.back),
+        state=Main.parts,
+        getter=get.parts_getter,
+    ),
+    Window(
+        w.Format("{part}"),
+        w.Button("Выше", on_click=do.part_up, emoji=Emojis.up, when="has_part"),
+        w.Button("Ниже", on_click=do.part_down, emoji=Emojis.down, when="has_part"),
+        w.Button("Удалить", on_click=do.remove_part, emoji=Emojis.remove, when="has_part"),
+        w.SwitchTo("Назад", state=Main.parts, emoji=Emojis.back),
+        state=Main.part,
+        getter=get.part_getter,
+    ),
+    Window(
+        w.Format("Когда отправить? В случайное время пост сложнее связать с тем, когда вы были в сети."),
+        Column(
+            Select(
+                w.Format("{item[0]}"),
+                id="schedule_s",
+                item_id_getter=operator.itemgetter(1),
+                items="schedule_selector",
+                on_click=do.postcard_schedule,
+            ),
+        ),
+        w.SwitchTo("Назад", state=Main.click_send, emoji=Emojis.back),
+        state=Main.schedule,
+        getter=get.getter,
+    ),
     Window(
         w.Format("{sent_link}", when="no_error"),
         w.Format("{dialog_error}", when="dialog_error"),
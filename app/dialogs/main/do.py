@@ -1,24 +1,32 @@
 import logging
+import random
+from typing import Optional
 
 from aiogram.types import CallbackQuery, ContentType
 from aiogram_dialog import DialogManager, StartMode
 from aiogram_dialog.widgets.kbd import Select
 
-from app.bot_loader import bot
 from app.dialogs.main.states import Main
 from app.dialogs.main.parsers import PostCardData
-from app.dialogs.main.get import content_author_selector
-from app.config import CHAT_ID
+from app.dialogs.main.get import content_author_selector, event_user_id, schedule_selector, show_size
+from app.config import CHAT_ID, DEDUP_WINDOW
+from app.dedup import dedup, fingerprint
+from app.drafts import DraftSize, drafts
 from app.extensions.widgets import Button
-from app.utils import ALL_MEDIA, Forwarder
+from app.sender import scheduler, send_queue
 
 logger = logging.getLogger(__name__)
+_random = random.SystemRandom()
 
 
 async def on_start_postcard(start_data, dialog_manager: DialogManager):
     data: PostCardData = PostCardData.register(dialog_manager)
     start_data = dialog_manager.start_data
     data.update((start_data, ))
+    # the draft outlives dialogs, new messages are added to what is left of it;
+    # there is none left once a post is sent
+    if dialog_manager.current_context().state != Main.sent:
+        show_size(data, await drafts.size(event_user_id(dialog_manager)))
 
     widget = dialog_manager.find('mine_r_ct')
     await widget.set_checked("0")
@@ -33,28 +41,111 @@ async def change_author(c: CallbackQuery, select: Select, dialog_manager: Dialog
 
 
 async def postcard_send(c: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    await submit(c, dialog_manager)
+
+
+async def postcard_schedule(c: CallbackQuery, select: Select, dialog_manager: DialogManager, item_id: str):
+    label, delay, spread = schedule_selector[int(item_id)]
+    # a random time makes the post harder to match to when its author was online
+    await submit(c, dialog_manager, delay=delay + _random.uniform(0, spread), scheduled=label)
+
+
+async def select_part(c: CallbackQuery, select: Select, dialog_manager: DialogManager, item_id: str):
     data: PostCardData = PostCardData.register(dialog_manager)
-    text = "\n".join(data.text) or None
+    data.part_id = int(item_id)
+    await dialog_manager.switch_to(Main.part)
 
-    if data.content_type == ContentType.POLL:
-        sent = await bot.copy_message(CHAT_ID, c.message.chat.id, data.message_id)
-    elif data.content_type in ALL_MEDIA:
-        if data.content_author:
-            text = (text or "" + '\n' + data.content_author) or None
 
-        fwder: Forwarder = ALL_MEDIA.get(data.content_type)
-        kwargs = {"caption": text}
-        if fwder.spoilering:
-            kwargs.update({"has_spoiler": True})
+async def part_up(c: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    await move_part(c, dialog_manager, -1)
+
 
-        sent = await fwder.sender(CHAT_ID, data.medias[0], **kwargs)
+async def part_down(c: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    await move_part(c, dialog_manager, 1)
+
+
+async def move_part(c: CallbackQuery, dialog_manager: DialogManager, offset: int):
+    data: PostCardData = PostCardData.register(dialog_manager)
+    await drafts.move(c.from_user.id, data.part_id, offset)
+    await dialog_manager.switch_to(Main.parts)
+
+
+async def remove_part(c: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    data: PostCardData = PostCardData.register(dialog_manager)
+    size = await drafts.remove(c.from_user.id, data.part_id)
+    show_size(data, size)
+    data.part_id = None
+    await dialog_manager.switch_to(Main.parts if size.parts else Main.menu)
+
+
+async def clear_draft(c: CallbackQuery, button: Button, dialog_manager: DialogManager):
+    data: PostCardData = PostCardData.register(dialog_manager)
+    await drafts.clear(c.from_user.id)
+    show_size(data, DraftSize())
+    await dialog_manager.switch_to(Main.menu)
+
+
+async def submit(c: CallbackQuery, dialog_manager: DialogManager, delay: float = 0,
+                 scheduled: Optional[str] = None):
+    data: PostCardData = PostCardData.register(dialog_manager)
+    # taken from Redis with the draft removed, a second click finds it empty
+    parts = await drafts.take(c.from_user.id)
+    texts = [part.text for part in parts if part.text]
+    medias = [part for part in parts if part.file_id]
+    polls = [part for part in parts if part.content_type == ContentType.POLL]
+    text = "\n\n".join(texts) or None
+    job = {"user_id": c.from_user.id,
+           "user_chat_id": c.message.chat.id,
+           "chat_id": CHAT_ID}
+
+    if polls:
+        job.update({"content_type": ContentType.POLL,
+                    "from_chat_id": c.message.chat.id, "message_id": polls[0].message_id})
+    elif medias:
+        if data.content_author:
+            text = "\n".join(filter(None, (text, data.content_author)))
+
+        job.update({"content_type": medias[0].content_type, "file_id": medias[0].file_id, "text": text})
+        if len(medias) > 1:
+            job.update({"medias": [(part.content_type, part.file_id) for part in medias]})
+        documents = [part.document for part in medias if part.document]
+        if documents:
+            job.update({"documents": documents})
     elif text is None:
-        sent = await c.message.answer("Что-то пошло не так, "
-                                      "попробуйте заново или напишите разработчику "
-                                      "@mindsweeper")
+        await c.message.answer("Что-то пошло не так, "
+                               "попробуйте заново или напишите разработчику "
+                               "@mindsweeper")
+        return
     else:
-        sent = await bot.send_message(CHAT_ID, text)
+        job.update({"content_type": ContentType.TEXT, "text": text})
+
+    post = None
+    # polls are always new, media without a unique id can't be told apart;
+    # a scheduled post would outlive its claim before it is sent
+    if DEDUP_WINDOW and not scheduled and not polls and all(part.unique_id for part in medias):
+        # the text as it goes out, with the author of the media
+        post = fingerprint(job.get("text"), [part.unique_id for part in medias])
+    if post:
+        claim = await dedup.claim(post, c.from_user.id, c.message.chat.id)
+        if not claim.new:
+            # the same post is in the chat already or on its way there
+            await dialog_manager.start(Main.sent,
+                                       mode=StartMode.RESET_STACK,
+                                       data={"sent_url": claim.sent_url, "queued": not claim.sent})
+            return
+        job.update({"fingerprint": post})
+
+    if scheduled:
+        # the author is told by a message once it is out, not by Main.sent
+        job.update({"scheduled": True})
+        await scheduler.schedule(job, delay)
+        await dialog_manager.start(Main.sent,
+                                   mode=StartMode.RESET_STACK,
+                                   data={"scheduled": scheduled})
+        return
 
+    # the post goes out from the send queue, which reports back through Main.sent
+    await send_queue.put(job)
     await dialog_manager.start(Main.sent,
                                mode=StartMode.RESET_STACK,
-                               data={"sent_url": sent.get_url()})
+                               data={"queued": True})
@@ -1,13 +1,18 @@
+from functools import lru_cache
+
 from aiogram.types import Message, ContentType
 from aiogram.utils.markdown import hlink
 from aiogram_dialog import Dialog, DialogManager
 
 from app.bot_loader import bot
-from app.config import CHAT_NAME, BOT_NAME
+from app.config import CHAT_NAME, BOT_NAME, DRAFT_MAX_CHARS, DRAFT_MAX_MEDIA, DRAFT_MAX_PARTS
 from app.dialogs.main.parsers import PostCardData
 from app.dialogs.main.states import Main
+from app.drafts import DraftSize, Part, drafts
 from app.extensions.emojis import Emojis
-from app.utils import get_id_from_message, ALL_MEDIA
+from app.moderation import moderation
+from app.sanitizer import is_image_document
+from app.utils import get_id_from_message, get_unique_id_from_message, ALL_MEDIA
 
 content_author_selector = (
     ("<пусто>", 0),
@@ -15,12 +20,60 @@ content_author_selector = (
     ('#моё', 2)
 )
 
+# label, delay and the random spread added to it, in seconds
+schedule_selector = (
+    ("Через час", 60 * 60, 0),
+    ("Через 3 часа", 3 * 60 * 60, 0),
+    ("В течение часа, в случайное время", 0, 60 * 60),
+    ("В течение 6 часов, в случайное время", 0, 6 * 60 * 60),
+)
+
+# what the user is told when a part would take the draft past a cap of app.drafts
+draft_caps = {
+    'parts': f"В посте может быть не больше {DRAFT_MAX_PARTS} частей",
+    'media': f"В посте может быть не больше {DRAFT_MAX_MEDIA} медиа",
+    'chars': f"В посте может быть не больше {DRAFT_MAX_CHARS} символов текста",
+    'poll': "Опрос отправляется один, без текста и медиа: отправьте или очистите черновик",
+    'mix': "Файлы не отправить вместе с фото и видео, а GIF — с другими медиа",
+}
+
+part_emojis = {
+    ContentType.TEXT: Emojis.text,
+    ContentType.PHOTO: Emojis.photo,
+    ContentType.VIDEO: Emojis.video,
+    ContentType.DOCUMENT: Emojis.document,
+    ContentType.ANIMATION: Emojis.animation,
+    ContentType.POLL: Emojis.poll,
+}
+
+
+def part_label(part: Part, width: int = 40) -> str:
+    text = ' '.join((part.text or (part.document and part.document[2]) or '').split())
+    if part.content_type == ContentType.POLL:
+        text = 'опрос'
+    if len(text) > width:
+        text = text[:width - 1] + '…'
+    return f"{part_emojis[part.content_type]} {text}".rstrip()
+
+
+def event_user_id(dialog_manager: DialogManager) -> int:
+    # the event is an ErrorEvent when the dialog is started by the error handler
+    return dialog_manager.middleware_data["event_from_user"].id
+
+
+def show_size(data: PostCardData, size: DraftSize):
+    data.draft_parts, data.draft_media, data.draft_chars = size
+
 
 async def final_getter(dialog_manager: DialogManager, **kwargs):
     data: PostCardData = PostCardData.register(dialog_manager)
 
     if data.sent_url:
         sent_link = hlink('Ушло!', data.sent_url)
+    elif data.queued:
+        sent_link = 'Отправляем...'
+    elif data.scheduled:
+        sent_link = f'Отложено, уйдёт {data.scheduled.lower()}. Напишу, когда пост будет в чатике'
     else:
         sent_link = 'Ушло!'
 
@@ -31,16 +84,26 @@ async def final_getter(dialog_manager: DialogManager, **kwargs):
     }
 
 
-async def getter(dialog_manager: DialogManager, **kwargs):
-    data: PostCardData = PostCardData.register(dialog_manager)
-
+@lru_cache(maxsize=None)
+def static_data():
     return {
         "content_author_selector": content_author_selector,
-        "content_author": data.content_author,
-        "m_type": bool(data.medias),
+        "schedule_selector": [(label, i) for i, (label, _, _) in enumerate(schedule_selector)],
         "bot_name": BOT_NAME,
         "chat_name": CHAT_NAME,
         "bot_version": bot.version,
+    }
+
+
+async def getter(dialog_manager: DialogManager, **kwargs):
+    data: PostCardData = PostCardData.register(dialog_manager)
+
+    return {
+        **static_data(),
+        "content_author": data.content_author,
+        "m_type": bool(data.draft_media),
+        "draft_parts": data.draft_parts,
+        "draft_media": data.draft_media,
         "user": data.username,
         "dialog_error": data.dialog_error,
         "no_error": not data.dialog_error,
@@ -57,27 +120,53 @@ async def user_data(m: Message, d: Dialog, dialog_manager: DialogManager):
     await dialog_manager.switch_to(Main.get_postcard)
 
 
+async def parts_getter(dialog_manager: DialogManager, **kwargs):
+    parts = await drafts.parts(event_user_id(dialog_manager))
+    return {
+        "draft_items": [(f"{number}. {part_label(part)}", part_id) for number, (part_id, part) in enumerate(parts, 1)],
+    }
+
+
+async def part_getter(dialog_manager: DialogManager, **kwargs):
+    data: PostCardData = PostCardData.register(dialog_manager)
+    part = data.part_id and await drafts.part(event_user_id(dialog_manager), data.part_id)
+    return {
+        "part": part_label(part, width=200) if part else "Этой части уже нет в посте",
+        "has_part": bool(part),
+    }
+
+
 async def postcard_data(m: Message, d: Dialog, dialog_manager: DialogManager):
     data: PostCardData = PostCardData.register(dialog_manager)
-    data.clean()
-    text, medias, messages = data.text, data.medias, data.messages
-
-    if m.content_type == ContentType.TEXT:
-        text.append(m.text)
-    elif m.content_type in ALL_MEDIA:
-        if m.caption is not None:
-            text.append(m.caption)
-        medias.append(get_id_from_message(m))
-    elif m.content_type == ContentType.POLL:
-        pass
-    else:
-        data.dialog_error = f"{Emojis.error} Принимаем только текст, медиа или опрос"
+    album = dialog_manager.middleware_data.get("album", [m])
+
+    parts, polls = [], []
+    for part in album:
+        if part.content_type == ContentType.TEXT:
+            parts.append(Part(part.content_type, text=part.text))
+        elif part.content_type in ALL_MEDIA:
+            document = None
+            if part.document and is_image_document(part.document.mime_type, part.document.file_name):
+                document = [part.document.file_id, part.document.file_unique_id, part.document.file_name]
+            parts.append(Part(part.content_type, text=part.caption, file_id=get_id_from_message(part),
+                              unique_id=get_unique_id_from_message(part), document=document))
+        elif part.content_type == ContentType.POLL:
+            polls.extend([part.poll.question, *(option.text for option in part.poll.options)])
+            parts.append(Part(part.content_type, message_id=part.message_id))
+        else:
+            data.dialog_error = f"{Emojis.error} Принимаем только текст, медиа или опрос"
+            return
+
+    # the draft so far stays as it is
+    if await moderation.check([*(part.text for part in parts), *polls]):
+        data.dialog_error = f"{Emojis.error} Такое не отправим: в посте есть запрещённые слова"
         return
 
-    data.dialog_error = ''
-    data.message_id = m.message_id
-    data.text = text
-    data.medias = medias
-    data.content_type = m.content_type
+    cap, size = await drafts.add(m.from_user.id, parts)
+    show_size(data, size)
+    if cap:
+        data.dialog_error = f"{Emojis.error} {draft_caps[cap]}"
+        return
 
+    data.dialog_error = ''
     await dialog_manager.switch_to(Main.click_send)
@@ -1,21 +1,22 @@
+import typing
 from dataclasses import dataclass
 
 from app.dataparser import DataParser
 
 
-@dataclass
+@dataclass(slots=True)
 class PostCardData(DataParser):
-    user_id = None
-    username = None
-    reply_message_id = None
-    message_id = None
-    text = None
-    medias = None
-    content_author = None
-    content_type = None
-    sent_url = None
-
-    def __post_init__(self):
-        self.messages = []
-        self.text = []
-        self.medias = []
+    user_id: typing.Optional[int] = None
+    username: typing.Optional[str] = None
+    reply_message_id: typing.Optional[int] = None
+    # size of the user's draft (app.drafts) as of its last change
+    draft_parts: int = 0
+    draft_media: int = 0
+    draft_chars: int = 0
+    # the part of the draft picked to be moved or removed
+    part_id: typing.Optional[int] = None
+    content_author: typing.Optional[str] = None
+    sent_url: typing.Optional[str] = None
+    queued: typing.Optional[bool] = None
+    # label of the time a scheduled post goes out at
+    scheduled: typing.Optional[str] = None
@@ -5,4 +5,7 @@ class Main(StatesGroup):
     menu = State()
     get_postcard = State()
     click_send = State()
+    parts = State()
+    part = State()
+    schedule = State()
     sent = State()
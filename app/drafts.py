@@ -0,0 +1,206 @@
+import json
+from typing import List, NamedTuple, Optional, Tuple
+
+from aiogram.types import ContentType
+
+from app import config
+from app.loader import storage
+
+PREFIX = 'anon:draft:'
+
+# kind of a part as the caps count it: text, photo or video, document, animation, poll
+KINDS = {
+    ContentType.TEXT: 't',
+    ContentType.PHOTO: 'm',
+    ContentType.VIDEO: 'm',
+    ContentType.DOCUMENT: 'd',
+    ContentType.ANIMATION: 'a',
+    ContentType.POLL: 'p',
+}
+
+# KEYS: draft; ARGV: max parts, max media, max characters, ttl, then kind, characters and value of each new part.
+# The draft is a hash of parts 'p<id>' = '<kind><characters>:<json>', their order 'order' = '<id> <id> ...',
+# the last id given out and counts by kind. Parts are added after the others if the draft stays within
+# the caps. Returns the cap it would go past or an empty string, then its parts, media and characters
+ADD_SCRIPT = """
+local counts = redis.call('HMGET', KEYS[1], 't', 'm', 'd', 'a', 'p', 'chars')
+local n = {t = tonumber(counts[1]) or 0, m = tonumber(counts[2]) or 0, d = tonumber(counts[3]) or 0,
+           a = tonumber(counts[4]) or 0, p = tonumber(counts[5]) or 0}
+local chars = tonumber(counts[6]) or 0
+local media = n.m + n.d + n.a
+local parts = n.t + media + n.p
+local added = math.floor((#ARGV - 4) / 3)
+local new = {t = n.t, m = n.m, d = n.d, a = n.a, p = n.p}
+local new_chars = chars
+for i = 5, #ARGV, 3 do
+    new[ARGV[i]] = new[ARGV[i]] + 1
+    new_chars = new_chars + tonumber(ARGV[i + 1])
+end
+local new_media = new.m + new.d + new.a
+local cap = ''
+if new.p > 0 and parts + added > 1 then
+    cap = 'poll'
+elseif (new.a > 0 and new_media > 1) or (new.m > 0 and new.d > 0) then
+    cap = 'mix'
+elseif parts + added > tonumber(ARGV[1]) then
+    cap = 'parts'
+elseif new_media > tonumber(ARGV[2]) then
+    cap = 'media'
+elseif new_chars > tonumber(ARGV[3]) then
+    cap = 'chars'
+end
+if cap ~= '' then
+    return {cap, parts, media, chars}
+end
+
+local last = redis.call('HINCRBY', KEYS[1], 'last', added)
+local order = redis.call('HGET', KEYS[1], 'order') or ''
+for i = 5, #ARGV, 3 do
+    local id = last - added + math.floor((i - 2) / 3)
+    redis.call('HSET', KEYS[1], 'p' .. id, ARGV[i] .. ARGV[i + 1] .. ':' .. ARGV[i + 2])
+    order = order == '' and tostring(id) or order .. ' ' .. id
+end
+redis.call('HSET', KEYS[1], 't', new.t, 'm', new.m, 'd', new.d, 'a', new.a, 'p', new.p,
+           'chars', new_chars, 'order', order)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return {'', parts + added, new_media, new_chars}
+"""
+
+# KEYS: draft; ARGV: part id. Returns the parts, media and characters left
+REMOVE_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], 'p' .. ARGV[1])
+if value then
+    local kind, chars = string.match(value, '^(%a)(%d+):')
+    redis.call('HDEL', KEYS[1], 'p' .. ARGV[1])
+    redis.call('HINCRBY', KEYS[1], kind, -1)
+    if chars ~= '0' then
+        redis.call('HINCRBY', KEYS[1], 'chars', -tonumber(chars))
+    end
+    local order = string.gsub(' ' .. redis.call('HGET', KEYS[1], 'order') .. ' ', ' ' .. ARGV[1] .. ' ', ' ', 1)
+    redis.call('HSET', KEYS[1], 'order', string.match(order, '^%s*(.-)%s*$'))
+end
+local counts = redis.call('HMGET', KEYS[1], 't', 'm', 'd', 'a', 'p', 'chars')
+local n = {}
+for i = 1, 6 do
+    n[i] = tonumber(counts[i]) or 0
+end
+if n[1] + n[2] + n[3] + n[4] + n[5] == 0 then
+    redis.call('DEL', KEYS[1])
+end
+return {n[1] + n[2] + n[3] + n[4] + n[5], n[2] + n[3] + n[4], n[6]}
+"""
+
+# KEYS: draft; ARGV: part id, offset. Moves the part that many places later, earlier if negative
+MOVE_SCRIPT = """
+local ids = {}
+local at
+for id in string.gmatch(redis.call('HGET', KEYS[1], 'order') or '', '%d+') do
+    ids[#ids + 1] = id
+    if id == ARGV[1] then
+        at = #ids
+    end
+end
+local to = at and at + tonumber(ARGV[2])
+if not to or to < 1 or to > #ids then
+    return 0
+end
+table.remove(ids, at)
+table.insert(ids, to, ARGV[1])
+redis.call('HSET', KEYS[1], 'order', table.concat(ids, ' '))
+return 1
+"""
+
+
+class Part(NamedTuple):
+    content_type: str
+    text: Optional[str] = None
+    file_id: Optional[str] = None
+    unique_id: Optional[str] = None
+    # [file_id, file_unique_id, file_name] of an image document, sent without its metadata
+    document: Optional[List] = None
+    # of a poll, which is copied to the chat
+    message_id: Optional[int] = None
+
+    @property
+    def kind(self) -> str:
+        return KINDS[self.content_type]
+
+    def dump(self) -> str:
+        return json.dumps(list(self), ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, value: bytes) -> 'Part':
+        return cls(*json.loads(value[value.index(b':') + 1:]))
+
+
+class DraftSize(NamedTuple):
+    parts: int = 0
+    media: int = 0
+    chars: int = 0
+
+
+class Drafts:
+    """
+    Posts being written, a hash per user of the parts in the order they are to be published.
+    Adding a part costs one round trip carrying only the new part, whatever the size of the draft:
+    the caps are checked against counts kept in the hash
+    """
+
+    def __init__(self, redis, max_parts: int, max_media: int, max_chars: int, ttl: int):
+        self.redis = redis
+        self.max_parts = max_parts
+        self.max_media = max_media
+        self.max_chars = max_chars
+        self.ttl = ttl
+        self._add = redis.register_script(ADD_SCRIPT)
+        self._remove = redis.register_script(REMOVE_SCRIPT)
+        self._move = redis.register_script(MOVE_SCRIPT)
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f'{PREFIX}{user_id}'
+
+    async def add(self, user_id: int, parts: List[Part]) -> Tuple[Optional[str], DraftSize]:
+        """Adds all of `parts` or none. Returns the cap they would go past, or None, and the size of the draft"""
+        args = [self.max_parts, self.max_media, self.max_chars, self.ttl]
+        for part in parts:
+            args.extend((part.kind, len(part.text or ''), part.dump()))
+        cap, *size = await self._add(keys=[self.key(user_id)], args=args, client=self.redis)
+        return cap.decode() or None, DraftSize(*size)
+
+    async def size(self, user_id: int) -> DraftSize:
+        counts = [int(count or 0) for count in
+                  await self.redis.hmget(self.key(user_id), 't', 'm', 'd', 'a', 'p', 'chars')]
+        return DraftSize(sum(counts[:5]), sum(counts[1:4]), counts[5])
+
+    async def parts(self, user_id: int) -> List[Tuple[int, Part]]:
+        """(id, part) in order"""
+        return self._parts(await self.redis.hgetall(self.key(user_id)))
+
+    async def take(self, user_id: int) -> List[Part]:
+        """Parts in order, the draft is removed in the same round trip: a post is taken to be sent once"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            draft, _ = await pipe.hgetall(self.key(user_id)).delete(self.key(user_id)).execute()
+        return [part for _, part in self._parts(draft)]
+
+    @staticmethod
+    def _parts(draft: dict) -> List[Tuple[int, Part]]:
+        return [(int(part_id), Part.load(draft[b'p' + part_id])) for part_id in draft.get(b'order', b'').split()]
+
+    async def part(self, user_id: int, part_id: int) -> Optional[Part]:
+        value = await self.redis.hget(self.key(user_id), f'p{part_id}')
+        return value and Part.load(value)
+
+    async def remove(self, user_id: int, part_id: int) -> DraftSize:
+        return DraftSize(*await self._remove(keys=[self.key(user_id)], args=[part_id], client=self.redis))
+
+    async def move(self, user_id: int, part_id: int, offset: int) -> bool:
+        """False if the part is first or last already"""
+        return bool(await self._move(keys=[self.key(user_id)], args=[part_id, offset], client=self.redis))
+
+    async def clear(self, user_id: int):
+        await self.redis.delete(self.key(user_id))
+
+
+drafts = Drafts(storage.redis, config.DRAFT_MAX_PARTS, config.DRAFT_MAX_MEDIA, config.DRAFT_MAX_CHARS,
+                config.DRAFT_TTL)
@@ -1,7 +1,17 @@
-from emoji import emojize
-
-
 class Emojis:
+    # the characters themselves: the emoji package takes longer to import than the rest of the widgets
     NONE = None
-    mail = emojize(':envelope_with_arrow:')
-    error = emojize(':x:')
+    mail = '\U0001F4E9'  # :envelope_with_arrow:
+    error = '\u274C'  # :x:
+    clock = '\u23F0'  # :alarm_clock:
+    back = '\u2B05\uFE0F'  # :left_arrow:
+    up = '\u2B06\uFE0F'  # :up_arrow:
+    down = '\u2B07\uFE0F'  # :down_arrow:
+    remove = '\U0001F5D1\uFE0F'  # :wastebasket:
+    parts = '\U0001F4CB'  # :clipboard:
+    text = '\U0001F4DD'  # :memo:
+    photo = '\U0001F5BC\uFE0F'  # :framed_picture:
+    video = '\U0001F3AC'  # :clapper_board:
+    document = '\U0001F4C4'  # :page_facing_up:
+    animation = '\U0001F39E\uFE0F'  # :film_frames:
+    poll = '\U0001F4CA'  # :bar_chart:
@@ -0,0 +1,101 @@
+import hashlib
+from typing import Dict, List, Optional
+
+from aiogram.types import Message
+from aiogram_dialog.api.entities import NewMessage, ShowMode
+from aiogram_dialog.context.media_storage import MediaIdStorage
+from aiogram_dialog.manager.manager import ManagerImpl
+from aiogram_dialog.manager.message_manager import MessageManager
+from aiogram_dialog.manager.registry import DefaultManagerFactory
+from aiogram_dialog.utils import get_media_id
+
+from app.metrics import RENDERS
+
+# [message id, digest of what it shows, whether it has a keyboard], kept in dialog_data
+RENDERED_KEY = 'anon_rendered'
+# metric.labels() takes a lock and builds a key on every call
+_renders = {outcome: RENDERS.labels(outcome) for outcome in ('sent', 'edited', 'unchanged', 'superseded')}
+
+
+def render_digest(new_message: NewMessage) -> str:
+    """Hash of everything a redraw would send: text, keyboard and media"""
+    media = new_message.media
+    shown = repr((new_message.text, new_message.parse_mode, new_message.disable_web_page_preview,
+                  media and (media.type, media.path, media.url, media.file_id and media.file_id.file_id)))
+    markup = new_message.reply_markup.json(exclude_none=True) if new_message.reply_markup else ''
+    return hashlib.blake2b(f'{shown}{markup}'.encode(), digest_size=12).hexdigest()
+
+
+def has_keyboard(new_message: NewMessage) -> bool:
+    return bool(new_message.reply_markup and new_message.reply_markup.inline_keyboard)
+
+
+class RenderingManager(ManagerImpl):
+    """
+    Dialog manager that remembers what the dialog message shows with the context
+    and makes no Bot API calls to show it again: an unchanged redraw isn't edited, the keyboard
+    isn't removed from a message which has none. A message followed by a newer one
+    (see `DebounceMiddleware`) isn't redrawn for, the newer one is
+    """
+
+    async def show(self) -> Optional[Message]:
+        if self.middleware_data.get("superseded"):
+            _renders['superseded'].inc()
+            return None
+
+        stack = self.current_stack()
+        context = self.current_context()
+        bot = self._data["bot"]
+        old_message = self._get_last_message()
+        new_message = await self.dialog().render(self)
+        if new_message.show_mode is ShowMode.AUTO:
+            new_message.show_mode = self._calc_show_mode()
+
+        digest = render_digest(new_message)
+        rendered: Optional[List] = context.dialog_data.get(RENDERED_KEY)
+        if old_message and rendered and rendered[0] == old_message.message_id:
+            if new_message.show_mode is ShowMode.EDIT and rendered[1] == digest:
+                _renders['unchanged'].inc()
+                self.show_mode = ShowMode.EDIT
+                return old_message
+            if new_message.show_mode is ShowMode.SEND and not rendered[2]:
+                # sent without one, there is no keyboard to remove
+                old_message = None
+
+        await self._fix_cached_media_id(new_message)
+        sent_message = await self.message_manager.show_message(bot, new_message, old_message)
+        if sent_message is old_message:
+            _renders['unchanged'].inc()
+        else:
+            edited = old_message and sent_message.message_id == old_message.message_id
+            _renders['edited' if edited else 'sent'].inc()
+
+        self._save_last_message(sent_message)
+        context.dialog_data[RENDERED_KEY] = [sent_message.message_id, digest, has_keyboard(new_message)]
+        self.show_mode = ShowMode.EDIT
+        if new_message.media:
+            await self.media_id_storage.save_media_id(
+                path=new_message.media.path,
+                url=new_message.media.url,
+                type=new_message.media.type,
+                media_id=get_media_id(sent_message),
+            )
+        if isinstance(self.event, Message):
+            stack.last_income_media_group_id = self.event.media_group_id
+        return sent_message
+
+
+class RenderingManagerFactory(DefaultManagerFactory):
+    """Makes `RenderingManager`s, `registry` is set once the registry is created with the factory"""
+
+    def __init__(self):
+        super().__init__(message_manager=MessageManager(), media_id_storage=MediaIdStorage(), registry=None)
+
+    def __call__(self, event, data: Dict) -> RenderingManager:
+        return RenderingManager(
+            event=event,
+            data=data,
+            message_manager=self.message_manager,
+            media_id_storage=self.media_id_storage,
+            registry=self.registry,
+        )
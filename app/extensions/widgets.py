@@ -1,10 +1,12 @@
+import hashlib
 import logging
-import uuid
+import re
+from collections import Counter
+from string import Formatter
 from enum import Enum, auto
 from typing import Union, Dict
 
 import aiogram_dialog.widgets.kbd as adw
-import emoji as emj
 from aiogram_dialog import DialogManager, StartMode
 from aiogram_dialog.widgets.text import Text
 
@@ -18,11 +20,36 @@ class ClickMode(Enum):
     NORMAL = auto()
 
 
-def generate_id():
-    return str(uuid.uuid4()).replace('-', '_')
+_formatter = Formatter()
+_FIELD_ROOT = re.compile(r'[^.\[]*')
+_MISSING = object()
+_ID_UNSAFE = re.compile(r'[^a-zA-Z0-9_]+')
+_generated_ids = Counter()
+
+
+def generate_id(action: str, text: str) -> str:
+    """
+    Widget id that is the same in every process and after a restart, so keyboards sent
+    by an earlier one keep working: what the widget does and a hash of its label
+    """
+    name = _ID_UNSAFE.sub('_', action).strip('_')[:24]
+    widget_id = f"{name}_{hashlib.blake2b(text.encode(), digest_size=3).hexdigest()}"
+    _generated_ids[widget_id] += 1
+    if _generated_ids[widget_id] > 1:
+        # the same widget defined again, told apart by the order of definitions
+        widget_id = f"{widget_id}_{_generated_ids[widget_id]}"
+    return widget_id
 
 
 class Format(Text):
+    """
+    str.format_map text widget.
+
+    The template is parsed once, `emojize` applies to its static parts only.
+    Renders are memoized on the values of the fields the template uses
+    """
+    cache_size = 256
+
     def __init__(
             self,
             text: str,
@@ -34,12 +61,46 @@ class Format(Text):
         if err_prefix:
             text = f"{{dialog_error}}\n\n" + text
 
-        self.emojize = emj.emojize if emojize else (lambda x: x)
+        if emojize:
+            # imported only when a widget needs shortcodes, the emoji table is large
+            from emoji import emojize as emj_emojize
+            self.emojize = emj_emojize
+        else:
+            self.emojize = lambda x: x
         self.text = text
+        self.template, self.fields = self._parse(text, self.emojize)
+        self.renders = {}
+
+    @staticmethod
+    def _parse(text, emojize):
+        template, fields = [], []
+        for literal, field_name, format_spec, conversion in _formatter.parse(text):
+            template.append(emojize(literal).replace('{', '{{').replace('}', '}}'))
+            if field_name is None:
+                continue
+
+            fields.append(_FIELD_ROOT.match(field_name).group())
+            template.append('{' + field_name)
+            if conversion:
+                template.append('!' + conversion)
+            if format_spec:
+                template.append(':' + format_spec)
+            template.append('}')
+        return ''.join(template), tuple(dict.fromkeys(fields))
 
     async def _render_text(self, data: Dict, dialog_manager: DialogManager) -> str:
-        text = self.text.format_map(data)
-        return self.emojize(text)
+        try:
+            # typed, as True == 1 and 1 == 1.0 would share a render otherwise
+            key = tuple((type(value), value) for value in (data.get(field, _MISSING) for field in self.fields))
+            text = self.renders.get(key)
+        except TypeError:  # unhashable values are rendered every time
+            return self.template.format_map(data)
+
+        if text is None:
+            if len(self.renders) >= self.cache_size:
+                self.renders.clear()
+            text = self.renders[key] = self.template.format_map(data)
+        return text
 
 
 class Button:
@@ -58,7 +119,7 @@ class Button:
             text = Format(f"{emoji} {text}")
 
         if 'id' not in kwargs:
-            kwargs['id'] = generate_id()
+            kwargs['id'] = generate_id(getattr(on_click, '__qualname__', 'button'), text.text)
 
         b = adw.Button(text, on_click=on_click, **kwargs)
         return b
@@ -79,12 +140,12 @@ class SwitchTo:
             text = Format(f"{emoji} {text}")
 
         if 'id' not in kwargs:
-            kwargs['id'] = generate_id()
-        return adw.SwitchTo(text, state, **kwargs, state=state)
+            kwargs['id'] = generate_id(f'to_{state.state}', text.text)
+        return adw.SwitchTo(text, state=state, **kwargs)
 
 
 class MainMenu:
     def __new__(cls, **kwargs):
         return adw.Start(
-            text=Format(f'{emj.emojize(":house:")} В главное меню'), id='start_bot', state=Main.menu,
+            text=Format('\U0001F3E0 В главное меню'), id='start_bot', state=Main.menu,
             on_click=kwargs.get('on_click'), mode=StartMode.RESET_STACK)
@@ -1,14 +1,16 @@
 import logging
-from typing import Any
+from typing import Any, Optional
 
 from aiogram import Router
+from aiogram.fsm.state import State
 from aiogram.types import ErrorEvent
 from aiogram.filters import ExceptionTypeFilter
-from aiogram_dialog import DialogManager, StartMode
+from aiogram_dialog import DialogManager, ShowMode, StartMode
 
 from aiogram_dialog.api.exceptions import (InvalidStackIdError, UnknownIntent, UnknownState,
                                            OutdatedIntent,
                                            DialogStackOverflow)
+from aiogram_dialog.utils import remove_indent_id
 
 from app.bot_loader import bot
 from app.dialogs.main import Main
@@ -19,11 +21,19 @@ router = Router(name='errors')
 logger = logging.getLogger(__name__)
 
 
+ERROR_MESSAGE = 'Что-то пошло не так, попробуйте еще раз'
+
+# Buttons whose click is done by opening a window, whatever dialog the keyboard belonged to
 BUTTONS_IDS = {'start_bot': Main.menu,
                }
 
 
-@router.errors(ExceptionTypeFilter(OutdatedIntent, UnknownIntent, UnknownState, InvalidStackIdError))
+@router.errors(ExceptionTypeFilter(OutdatedIntent, UnknownIntent))
+async def stale_keyboard_handler(exception: ErrorEvent, dialog_manager: DialogManager) -> Any:
+    await recover_stale_click(exception, dialog_manager)
+
+
+@router.errors(ExceptionTypeFilter(UnknownState, InvalidStackIdError))
 async def dialog_error_handler(exception: ErrorEvent, dialog_manager: DialogManager) -> Any:
     await handle_and_start_new(exception, dialog_manager)
 
@@ -33,10 +43,34 @@ async def dialog_error_skip(exception: ErrorEvent) -> Any:
     return True
 
 
-def guess_state(callback_data):
-    for btn_id, btn_state in BUTTONS_IDS.items():
-        if btn_id in callback_data:
-            return btn_state
+def guess_state(callback_data: str) -> Optional[State]:
+    _, widget_data = remove_indent_id(callback_data)
+    # widgets with items add ':<item id>'
+    return BUTTONS_IDS.get(widget_data.split(':', 1)[0])
+
+
+async def recover_stale_click(error: ErrorEvent, dialog_manager: DialogManager):
+    """
+    A click on the keyboard of a dialog that is over or was replaced by a newer one.
+    Storage is fine, so it is kept: the user gets the window the button leads to or the one they are in
+    """
+    callback = error.update.callback_query
+    if callback is None or callback.message.chat.type != 'private':
+        return await handle_and_start_new(error, dialog_manager)
+
+    state = guess_state(callback.data)
+    if state is not None:
+        await dialog_manager.start(state, mode=StartMode.RESET_STACK, data={'user_id'     : callback.from_user.id,
+                                                                            'dialog_error': ''})
+    elif dialog_manager.current_context() is not None:
+        # below the clicked message, which may be far up the chat
+        dialog_manager.show_mode = ShowMode.SEND
+        await dialog_manager.show()
+    else:
+        logger.info("Stale click of user %s on %s", callback.from_user.id, callback.data)
+        await dialog_manager.start(Main.menu, mode=StartMode.RESET_STACK, data={'user_id'     : callback.from_user.id,
+                                                                                'dialog_error': ERROR_MESSAGE})
+    return True
 
 
 async def handle_and_start_new(error: ErrorEvent, dialog_manager: DialogManager, *args, **kwargs):
@@ -53,7 +87,7 @@ async def handle_and_start_new(error: ErrorEvent, dialog_manager: DialogManager,
 
     if state is None:
         logger.warning("Exception suppressed [User: %s, %s]:\n%s", user.id, user.username, error.exception)
-        err_message = 'Что-то пошло не так, попробуйте еще раз'
+        err_message = ERROR_MESSAGE
         state = Main.menu
     else:
         err_message = ''
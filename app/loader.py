@@ -3,11 +3,14 @@ import warnings
 
 from aiogram import Dispatcher
 from aiogram.types import BotCommand
-from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.redis import DefaultKeyBuilder
 from aiogram.fsm.strategy import FSMStrategy
 from pytz_deprecation_shim import PytzUsageWarning
 
 from app import config
+from app.connections import redis
+from app.serializers import get_serializer
+from app.storage import AnonRedisStorage
 
 
 DEFAULT_USER_COMMANDS = [
@@ -16,8 +19,13 @@ DEFAULT_USER_COMMANDS = [
 
 
 warnings.filterwarnings(action="ignore", category=PytzUsageWarning)
-storage = RedisStorage.from_url(config.REDIS_URL, connection_kwargs={"max_connections": 256},
-                                data_ttl=1000000, state_ttl=1000000,
-                                key_builder=DefaultKeyBuilder(with_destiny=True))
+storage = AnonRedisStorage(redis,
+                           data_ttl=config.DATA_TTL, state_ttl=config.STATE_TTL,
+                           dialog_ttl=config.DIALOG_TTL, finished_dialog_ttl=config.FINISHED_DIALOG_TTL,
+                           # Main.sent, app.dialogs can't be imported here because of a cycle
+                           finished_states=['Main:sent'],
+                           key_builder=DefaultKeyBuilder(with_destiny=True),
+                           serializer=get_serializer(config.STORAGE_SERIALIZER,
+                                                     config.STORAGE_COMPRESS_THRESHOLD))
 
 dp = Dispatcher(storage=storage, fsm_strategy=FSMStrategy.CHAT)
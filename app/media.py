@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from tempfile import SpooledTemporaryFile
+from typing import AsyncGenerator, AsyncIterator, BinaryIO, Optional
+
+from aiogram import Bot
+from aiogram.types import FSInputFile, InputFile, Message
+
+from app import config
+from app.bot_loader import bot
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class SpooledInputFile(InputFile):
+    """
+    Downloaded file kept in memory up to `spool_size` bytes and in a temporary file beyond that.
+    Every upload reads it from the start, so it survives send retries
+    """
+
+    def __init__(self, spool_size: int, filename: Optional[str] = None, chunk_size: int = CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = SpooledTemporaryFile(max_size=spool_size)
+        self.size = 0
+
+    def write(self, chunk: bytes) -> int:
+        written = self.file.write(chunk)
+        self.size += written
+        return written
+
+    async def read(self, chunk_size: int) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class MediaDownloader:
+    """
+    Streams files from the Bot API in chunks, at most `concurrency` at a time
+    and at most `max_size` bytes each
+    """
+
+    def __init__(self, bot: Bot, max_size: int, concurrency: int, spool_size: int, timeout: int = 60):
+        self.bot = bot
+        self.max_size = max_size
+        self.spool_size = spool_size
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    @asynccontextmanager
+    async def open(self, file_id: str, file_size: Optional[int] = None,
+                   filename: Optional[str] = None) -> AsyncIterator[InputFile]:
+        """Downloads the file and yields it as an InputFile, ready to be sent"""
+        self._check_size(file_id, file_size)
+        # held until the caller is done with the file, which bounds the spooled files as well
+        async with self.semaphore:
+            file = await self.bot.get_file(file_id)
+            self._check_size(file_id, file.file_size)
+            filename = filename or file.file_path.rpartition('/')[2]
+
+            if self.bot.session.api.is_local:
+                # a local Bot API server has the file on disk already
+                yield FSInputFile(self.bot.session.api.wrap_local_file.to_local(file.file_path),
+                                  filename=filename, chunk_size=CHUNK_SIZE)
+                return
+
+            media = SpooledInputFile(self.spool_size, filename=filename)
+            try:
+                await self._download(file.file_path, media)
+                yield media
+            finally:
+                media.close()
+
+    async def fetch(self, file_id: str, path: str, file_size: Optional[int] = None) -> str:
+        """Downloads the file to `path` and returns where it is on disk"""
+        self._check_size(file_id, file_size)
+        async with self.semaphore:
+            file = await self.bot.get_file(file_id)
+            self._check_size(file_id, file.file_size)
+
+            if self.bot.session.api.is_local:
+                return self.bot.session.api.wrap_local_file.to_local(file.file_path)
+
+            with open(path, 'wb') as dst:
+                await self._download(file.file_path, dst)
+            return path
+
+    async def _download(self, file_path: str, dst: BinaryIO):
+        stream = self.bot.session.stream_content(url=self.bot.session.api.file_url(self.bot.token, file_path),
+                                                 timeout=self.timeout, chunk_size=CHUNK_SIZE,
+                                                 raise_for_status=True)
+        size = 0
+        try:
+            async for chunk in stream:
+                size += dst.write(chunk)
+                self._check_size(file_path, size)
+        finally:
+            await stream.aclose()
+
+    def _check_size(self, file_id: str, size: Optional[int]):
+        if size is not None and size > self.max_size:
+            raise MediaTooLarge(f"{file_id} is {size} bytes, more than {self.max_size}")
+
+
+def _media_of(m: Message):
+    if m.photo:
+        return m.photo[-1]
+    return m.document or m.video or m.animation
+
+
+def open_message_media(m: Message):
+    """`async with open_message_media(m) as input_file` downloads the media of a message"""
+    media = _media_of(m)
+    if media is None:
+        raise ValueError(f'No media in a {m.content_type} message')
+    return media_downloader.open(media.file_id, media.file_size, getattr(media, 'file_name', None))
+
+
+media_downloader = MediaDownloader(bot, max_size=config.MEDIA_MAX_SIZE,
+                                   concurrency=config.MEDIA_DOWNLOAD_CONCURRENCY,
+                                   spool_size=config.MEDIA_SPOOL_SIZE)
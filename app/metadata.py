@@ -0,0 +1,168 @@
+"""
+Metadata stripping for images sent as documents.
+
+Plain functions over file paths, so they can run in a process pool:
+they stream the file and never hold more than a chunk of it in memory
+"""
+import struct
+from typing import BinaryIO, Optional
+
+CHUNK_SIZE = 256 * 1024
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# APP0 (JFIF) and APP14 (Adobe, colour transform) are needed to decode the image,
+# APP2 only when it is an ICC profile (it also carries MPF previews with their own EXIF)
+JPEG_KEPT_APPS = {0xE0, 0xEE}
+ICC_PROFILE = b'ICC_PROFILE\x00'
+JPEG_COM = 0xFE
+JPEG_SOS = 0xDA
+# markers without a length: TEM, RST0-RST7
+JPEG_RESTARTS = frozenset(range(0xD0, 0xD8))
+JPEG_STANDALONE = {0x01, *JPEG_RESTARTS}
+
+PNG_DROPPED_CHUNKS = {b'tEXt', b'zTXt', b'iTXt', b'eXIf', b'tIME'}
+
+EXIF_HEADER = b'Exif\x00\x00'
+ORIENTATION_TAG = 0x0112
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def strip_metadata(src_path: str, dst_path: str) -> None:
+    """Copies an image without its metadata, raises UnsupportedImage for anything but JPEG and PNG"""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        head = src.read(8)
+        if head.startswith(JPEG_SOI):
+            src.seek(2)
+            _strip_jpeg(src, dst)
+        elif head == PNG_SIGNATURE:
+            _strip_png(src, dst)
+        else:
+            raise UnsupportedImage(f"Unknown image format {head[:4]!r}")
+
+
+def _strip_jpeg(src: BinaryIO, dst: BinaryIO):
+    dst.write(JPEG_SOI)
+    while True:
+        marker = _read_exact(src, 2)
+        while marker[0] == 0xFF and marker[1] == 0xFF:
+            # fill bytes
+            marker = marker[1:] + _read_exact(src, 1)
+        if marker[0] != 0xFF:
+            raise UnsupportedImage("Broken JPEG marker")
+
+        if marker == JPEG_EOI:
+            # anything after it (e.g. MPF previews) is dropped
+            dst.write(marker)
+            return
+        code = marker[1]
+        if code in JPEG_STANDALONE:
+            dst.write(marker)
+            continue
+
+        length = _read_exact(src, 2)
+        payload = _read_exact(src, struct.unpack('>H', length)[0] - 2)
+
+        if code == JPEG_SOS:
+            dst.write(marker + length + payload)
+            if not _copy_scan(src, dst):
+                return
+            # progressive and multi-scan images go on with tables, metadata and more scans
+            continue
+        if code == 0xE1 and payload.startswith(EXIF_HEADER):
+            # keep the orientation alone, without it a rotated photo is shown sideways
+            orientation = _exif_orientation(payload[len(EXIF_HEADER):])
+            if orientation not in (None, 1):
+                dst.write(_orientation_segment(orientation))
+        elif code in JPEG_KEPT_APPS or (code == 0xE2 and payload.startswith(ICC_PROFILE)):
+            dst.write(marker + length + payload)
+        elif not (0xE0 <= code <= 0xEF or code == JPEG_COM):
+            # frame, tables and the rest of the image structure
+            dst.write(marker + length + payload)
+
+
+def _copy_scan(src: BinaryIO, dst: BinaryIO) -> bool:
+    """
+    Copies entropy-coded data and leaves `src` at the marker after it;
+    False when the file ends first
+    """
+    data = b''
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            dst.write(data)
+            return False
+        data += chunk
+        pos = data.find(b'\xff')
+        while pos != -1 and pos + 1 < len(data):
+            # 0xFF in compressed data is followed by 0x00 or a restart marker, anything else starts a marker
+            following = data[pos + 1]
+            if following != 0x00 and following not in JPEG_RESTARTS:
+                dst.write(data[:pos])
+                src.seek(pos - len(data), 1)
+                return True
+            pos = data.find(b'\xff', pos + 2)
+        # a trailing 0xFF waits for the byte after it
+        keep = 1 if pos != -1 else 0
+        dst.write(data[:len(data) - keep])
+        data = data[len(data) - keep:]
+
+
+def _exif_orientation(tiff: bytes) -> Optional[int]:
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        ifd = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[ifd:ifd + 2])[0]
+        for i in range(count):
+            entry = ifd + 2 + i * 12
+            tag, = struct.unpack(order + 'H', tiff[entry:entry + 2])
+            if tag == ORIENTATION_TAG:
+                return struct.unpack(order + 'H', tiff[entry + 8:entry + 10])[0]
+    except (KeyError, struct.error):
+        pass
+    return None
+
+
+def _orientation_segment(orientation: int) -> bytes:
+    # big-endian TIFF with a single IFD holding one SHORT
+    tiff = b'MM\x00\x2a' + struct.pack('>IH', 8, 1) + struct.pack('>HHIHH', ORIENTATION_TAG, 3, 1, orientation, 0) \
+        + struct.pack('>I', 0)
+    payload = EXIF_HEADER + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def _strip_png(src: BinaryIO, dst: BinaryIO):
+    dst.write(PNG_SIGNATURE)
+    while True:
+        header = src.read(8)
+        if not header:
+            return
+        if len(header) < 8:
+            raise UnsupportedImage("Truncated PNG chunk")
+
+        length = struct.unpack('>I', header[:4])[0]
+        kind = header[4:]
+        if kind in PNG_DROPPED_CHUNKS:
+            src.seek(length + 4, 1)
+            continue
+
+        dst.write(header)
+        left = length + 4  # data and crc
+        while left:
+            chunk = _read_exact(src, min(left, CHUNK_SIZE))
+            dst.write(chunk)
+            left -= len(chunk)
+        if kind == b'IEND':
+            return
+
+
+def _read_exact(src: BinaryIO, size: int) -> bytes:
+    data = src.read(size)
+    if len(data) != size:
+        raise UnsupportedImage("Unexpected end of image")
+    return data
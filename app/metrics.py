@@ -0,0 +1,185 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+UPDATE_SECONDS = Histogram('anon_update_seconds', 'Time to handle an update', ['type'])
+UPDATE_ERRORS = Counter('anon_update_errors_total', 'Updates that raised', ['type'])
+UPDATES_IN_FLIGHT = Gauge('anon_updates_in_flight', 'Updates being handled')
+HANDLER_SECONDS = Histogram('anon_handler_seconds', 'Time spent in a handler', ['handler', 'state'])
+REDIS_ROUND_TRIPS = Counter('anon_redis_round_trips_total', 'Redis commands and pipelines sent')
+REDIS_PER_UPDATE = Histogram('anon_redis_round_trips_per_update', 'Redis round trips made by one update',
+                             buckets=(0, 1, 2, 4, 8, 16, 32, 64))
+REDIS_POOL_WAIT = Histogram('anon_redis_pool_wait_seconds', 'Time to get a Redis connection from the pool',
+                            buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5))
+REDIS_CONNECTIONS = Gauge('anon_redis_connections', 'Redis connections of the pool', ['state'])
+BOT_API_SECONDS = Histogram('anon_bot_api_seconds', 'Bot API call latency', ['method'])
+BOT_API_ERRORS = Counter('anon_bot_api_errors_total', 'Failed Bot API calls', ['method', 'error'])
+RENDERS = Counter('anon_renders_total', 'Dialog redraws: sent, edited, unchanged or superseded by a newer one',
+                  ['outcome'])
+QUEUE_DEPTH = Gauge('anon_queue_depth', 'Items waiting in Redis queues', ['queue'])
+SCHEDULE_LAG = Histogram('anon_schedule_lag_seconds', 'Time from a scheduled post being due to it being queued',
+                         buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+MODERATION_BLOCKED = Counter('anon_moderation_blocked_total', 'Posts not accepted for a banned phrase')
+REDIS_KEYS = Gauge('anon_redis_keys', 'Keys by class as of the last retention sweep', ['key_class'])
+REDIS_BYTES = Gauge('anon_redis_bytes', 'Memory used by keys of a class as of the last retention sweep',
+                    ['key_class'])
+REDIS_TTL_CLAMPED = Counter('anon_redis_ttl_clamped_total', 'Keys whose TTL the retention sweep lowered',
+                            ['key_class'])
+
+# round trips made by the update being handled, a mutable cell so background
+# tasks spawned by the handler keep adding to it
+_round_trips: ContextVar[Optional[List[int]]] = ContextVar('anon_round_trips', default=None)
+
+
+def _labelled(metric, cache: Dict, *labels):
+    # metric.labels() takes a lock and builds a key on every call
+    child = cache.get(labels)
+    if child is None:
+        child = cache[labels] = metric.labels(*labels)
+    return child
+
+
+def _count_round_trip():
+    REDIS_ROUND_TRIPS.inc()
+    cell = _round_trips.get()
+    if cell is not None:
+        cell[0] += 1
+
+
+class UpdateMetrics(BaseMiddleware):
+    """Outer update middleware: latency, errors and Redis round trips per update"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.errors = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        cell = [0]
+        token = _round_trips.set(cell)
+        UPDATES_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            _labelled(UPDATE_ERRORS, self.errors, event.event_type).inc()
+            raise
+        finally:
+            _labelled(UPDATE_SECONDS, self.seconds, event.event_type).observe(time.perf_counter() - started)
+            REDIS_PER_UPDATE.observe(cell[0])
+            UPDATES_IN_FLIGHT.dec()
+            _round_trips.reset(token)
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware: latency by handler and the FSM state it ran in"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            callback = data['handler'].callback
+            name = getattr(callback, '__qualname__', None) or type(callback).__name__
+            child = _labelled(HANDLER_SECONDS, self.seconds, name, data.get('raw_state') or '')
+            child.observe(time.perf_counter() - started)
+
+
+class BotAPIMetrics(BaseRequestMiddleware):
+    """Session middleware: Bot API latency and errors by method"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.errors = {}
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            _labelled(BOT_API_ERRORS, self.errors, name, type(e).__name__).inc()
+            raise
+        finally:
+            _labelled(BOT_API_SECONDS, self.seconds, name).observe(time.perf_counter() - started)
+
+
+def instrument_redis(redis):
+    """Counts round trips of the client: every command and every pipeline is one"""
+    execute_command = redis.execute_command
+    pipeline = redis.pipeline
+
+    async def counted_command(*args, **options):
+        _count_round_trip()
+        return await execute_command(*args, **options)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*execute_args, **execute_kwargs):
+            _count_round_trip()
+            return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    redis.execute_command = counted_command
+    redis.pipeline = counted_pipeline
+    return redis
+
+
+def setup(dp: Dispatcher):
+    instrument_redis(dp.storage.redis)
+    dp.update.outer_middleware(UpdateMetrics())
+
+
+def setup_handlers(dp: Dispatcher):
+    """Times handlers of every observer, to be called once all are there: dialogs add aiogd_update"""
+    handler_metrics = HandlerMetrics()
+    for name, observer in dp.observers.items():
+        if name not in ('update', 'error'):
+            observer.middleware(handler_metrics)
+
+
+async def start_server(host: str, port: int, collectors=()) -> web.AppRunner:
+    """
+    Serves /metrics. `collectors` are coroutine functions refreshing gauges
+    that need Redis (queue depths) right before every scrape
+    """
+    async def handle(request: web.Request) -> web.Response:
+        for collect in collectors:
+            try:
+                await collect()
+            except Exception:
+                logger.exception("Metrics collector %s failed", collect)
+        return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info("Serving metrics on %s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+ALBUM_LATENCY = 0.6
+
+
+class AlbumMiddleware(BaseMiddleware):
+    """
+    Collects parts of a media group into `data["album"]`.
+    The handler is called once, for the first part, after no new parts came for `latency` seconds.
+    Workers get the album collected already (see `ShardConsumer`)
+    """
+
+    def __init__(self, latency: float = ALBUM_LATENCY):
+        self.latency = latency
+        self.albums: Dict[str, List[Message]] = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+            event: Message,
+            data: Dict[str, Any],
+    ) -> Any:
+        if not event.media_group_id or "album" in data:
+            return await handler(event, data)
+
+        album = self.albums.get(event.media_group_id)
+        if album is not None:
+            album.append(event)
+            return
+
+        album = self.albums[event.media_group_id] = [event]
+        try:
+            received = 0
+            while received != len(album):
+                received = len(album)
+                await asyncio.sleep(self.latency)
+        finally:
+            del self.albums[event.media_group_id]
+
+        data["album"] = sorted(album, key=lambda m: m.message_id)
+        return await handler(event, data)
@@ -0,0 +1,46 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+from aiogram_dialog.utils import remove_indent_id
+
+from app.storage import AnonRedisStorage
+
+
+class StorageBatchMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that wraps handling of an update into `AnonRedisStorage.batch()`:
+    the FSM state, the dialog stack and the current dialog context are fetched in one round trip
+    and all writes are flushed in one more
+    """
+
+    def __init__(self, dp: Dispatcher):
+        self.fsm = dp.fsm
+        self.storage: AnonRedisStorage = dp.storage
+
+    @classmethod
+    def setup(cls, dp: Dispatcher):
+        # has to open the batch before FSMContextMiddleware reads the state
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(cls(dp))
+        dp.update.outer_middleware(dp.fsm)
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        chat, user = data.get("event_chat"), data.get("event_from_user")
+        context = self.fsm.resolve_event_context(data["bot"], data)
+        if chat is None or user is None or context is None:
+            return await handler(event, data)
+
+        async with self.storage.batch(data["bot"], context.key, chat.id, user.id, self._intent_id(event)):
+            return await handler(event, data)
+
+    def _intent_id(self, event: Update):
+        if event.callback_query and event.callback_query.data:
+            return remove_indent_id(event.callback_query.data)[0]
+        # background updates of aiogram_dialog
+        return getattr(event.event, "intent_id", None)
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+RENDER_DEBOUNCE = 0.3
+
+
+class DebounceMiddleware(BaseMiddleware):
+    """
+    Outer update middleware for bursts of private messages: a message waits `latency` seconds
+    and if a newer one of the chat came meanwhile, it is handled with `data["superseded"]` set,
+    the dialog is redrawn only for the last message of the burst.
+    Parts of an album are left to AlbumMiddleware
+    """
+
+    def __init__(self, latency: float = RENDER_DEBOUNCE):
+        self.latency = latency
+        # chat id: the latest message waiting
+        self.latest: Dict[int, int] = {}
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        message = event.message
+        if message is None or message.media_group_id or message.chat.type != 'private':
+            return await handler(event, data)
+
+        chat_id = message.chat.id
+        superseded = self.latest.get(chat_id, 0) > message.message_id
+        if not superseded:
+            self.latest[chat_id] = message.message_id
+            try:
+                await asyncio.sleep(self.latency)
+            finally:
+                superseded = self.latest.get(chat_id) != message.message_id
+                if not superseded:
+                    del self.latest[chat_id]
+
+        data["superseded"] = superseded
+        return await handler(event, data)
@@ -1,17 +1,75 @@
-from typing import Any, Awaitable, Callable, Dict
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
 
 from aiogram import BaseMiddleware
 from aiogram.dispatcher.flags import get_flag
 from aiogram.types import Message
 from cachetools import TTLCache
+from redis.exceptions import RedisError
 
 THROTTLE_TIME = 2
 
+# throttling_key: (events, per seconds, burst)
+RATES: Dict[str, Tuple[int, float, int]] = {
+    "default": (1, THROTTLE_TIME, 1),
+}
+
+# GCRA: the key holds the theoretical arrival time of the next event (ms).
+# Returns 0 when the event is allowed, otherwise milliseconds to wait
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tolerance = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local allow_at = tat - tolerance
+if now < allow_at then
+    return allow_at - now
+end
+local new_tat = tat + interval
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return 0
+"""
+
+logger = logging.getLogger(__name__)
+
 
 class ThrottlingMiddleware(BaseMiddleware):
-    caches = {
-        "default": TTLCache(maxsize=10_000, ttl=THROTTLE_TIME)
-    }
+    """
+    Rate limit shared by all processes through Redis.
+    Chats known to be throttled are rejected locally until their wait time is over
+    """
+
+    def __init__(self, redis, rates: Dict[str, Tuple[int, float, int]] = None, prefix='anon:throttle'):
+        self.redis = redis
+        self.rates = rates or RATES
+        self.prefix = prefix
+        self.script = redis.register_script(GCRA_SCRIPT)
+        longest = max(period for _, period, _ in self.rates.values())
+        self.blocked = TTLCache(maxsize=10_000, ttl=longest)
+
+    async def throttled(self, throttling_key: str, chat_id: int) -> bool:
+        now = time.monotonic()
+        local_key = (throttling_key, chat_id)
+        if self.blocked.get(local_key, 0) > now:
+            return True
+
+        events, period, burst = self.rates[throttling_key]
+        interval = period * 1000 / events
+        try:
+            wait = await self.script(keys=[f"{self.prefix}:{throttling_key}:{chat_id}"],
+                                     args=[int(time.time() * 1000), interval, interval * (burst - 1)])
+        except RedisError as e:
+            logger.warning("Throttling is unavailable: %s", e)
+            return False
+
+        if wait:
+            self.blocked[local_key] = now + float(wait) / 1000
+            return True
+        return False
 
     async def __call__(
             self,
@@ -20,9 +78,7 @@ class ThrottlingMiddleware(BaseMiddleware):
             data: Dict[str, Any],
     ) -> Any:
         throttling_key = get_flag(data, "throttling_key")
-        if throttling_key is not None and throttling_key in self.caches:
-            if event.chat.id in self.caches[throttling_key]:
+        if throttling_key is not None and throttling_key in self.rates:
+            if await self.throttled(throttling_key, event.chat.id):
                 return
-            else:
-                self.caches[throttling_key][event.chat.id] = None
         return await handler(event, data)
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Iterable, List, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from app import config
+from app.dedup import normalize
+from app.loader import storage
+from app.metrics import MODERATION_BLOCKED
+
+PATTERNS_KEY = 'anon:moderation:patterns'
+VERSION_KEY = 'anon:moderation:version'
+
+# Latin letters written for Cyrillic ones that look the same, in upper or lower case
+HOMOGLYPHS = str.maketrans({
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у', 'ё': 'е',
+})
+
+logger = logging.getLogger(__name__)
+
+
+def fold(text: str) -> str:
+    """Text as a reader sees it, with lookalike Latin letters in place of Cyrillic ones counted as the same"""
+    return normalize(text).translate(HOMOGLYPHS)
+
+
+class Automaton:
+    """Aho–Corasick automaton: every pattern is looked for in one pass over the text"""
+    __slots__ = ('goto', 'fail', 'out')
+
+    def __init__(self, patterns: Iterable[str]):
+        # node 0 is the root; out: patterns ending at the node or at a suffix of it
+        self.goto: List[dict] = [{}]
+        self.out: List[Tuple[str, ...]] = [()]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self.fail: List[int] = [0] * len(self.goto)
+        self._link()
+
+    def _add(self, pattern: str):
+        goto, node = self.goto, 0
+        for char in pattern:
+            child = goto[node].get(char)
+            if child is None:
+                child = goto[node][char] = len(goto)
+                goto.append({})
+                self.out.append(())
+            node = child
+        self.out[node] += (pattern,)
+
+    def _link(self):
+        goto, fail, out = self.goto, self.fail, self.out
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                suffix = fail[node]
+                while suffix and char not in goto[suffix]:
+                    suffix = fail[suffix]
+                fail[child] = goto[suffix].get(char, 0)
+                out[child] += out[fail[child]]
+
+    def __len__(self):
+        return len(self.goto) - 1
+
+    def search(self, text: str) -> Optional[str]:
+        """The first pattern found in `text`"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                return out[node][0]
+        return None
+
+
+class Moderation:
+    """
+    Phrases posts mustn't contain, a set in Redis the admins edit. They are compiled
+    into an automaton once and again when the version key changes, which is looked up
+    at most every `reload_interval` seconds
+    """
+
+    def __init__(self, redis, reload_interval: float):
+        self.redis = redis
+        self.reload_interval = reload_interval
+        self.automaton = Automaton(())
+        self.version: Optional[bytes] = None
+        # patterns are loaded on the first check even if there is no version key yet
+        self._loaded = False
+        self._checked = float('-inf')
+        self._loading = False
+
+    @staticmethod
+    def _compile(patterns: Iterable[bytes]) -> Automaton:
+        phrases = []
+        for pattern in patterns:
+            try:
+                phrases.append(fold(pattern.decode()))
+            except UnicodeDecodeError:
+                logger.warning("Moderation pattern %r skipped, it is not UTF-8", pattern)
+        return Automaton(phrases)
+
+    async def _reload(self):
+        now = time.monotonic()
+        if self._loading or now - self._checked < self.reload_interval:
+            return
+        # updates coming meanwhile use the patterns loaded before
+        self._checked = now
+        self._loading = True
+        try:
+            version = await self.redis.get(VERSION_KEY)
+            if self._loaded and version == self.version:
+                return
+            patterns = await self.redis.smembers(PATTERNS_KEY)
+            # thousands of phrases take a while to compile, the event loop goes on meanwhile
+            self.automaton = await asyncio.get_running_loop().run_in_executor(None, self._compile, patterns)
+            self.version, self._loaded = version, True
+        except RedisError as e:
+            logger.error("Moderation patterns not reloaded: %s", e)
+            return
+        except Exception:
+            # the patterns loaded before stay, compiling is tried again on the next reload
+            logger.exception("Moderation patterns not compiled")
+            return
+        finally:
+            self._loading = False
+        logger.info("Loaded %s moderation patterns", len(patterns))
+
+    async def check(self, texts: Iterable[str]) -> Optional[str]:
+        """The banned phrase found in any of `texts`, folded, or None"""
+        await self._reload()
+        if not len(self.automaton):
+            return None
+        for text in texts:
+            found = text and self.automaton.search(fold(text))
+            if found:
+                MODERATION_BLOCKED.inc()
+                return found
+        return None
+
+
+moderation = Moderation(storage.redis, config.MODERATION_RELOAD_INTERVAL)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.dispatcher import DEFAULT_BACKOFF_CONFIG
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff
+from redis.exceptions import RedisError
+
+from app import config
+from app.bot_loader import bot
+from app.loader import dp, storage
+
+OFFSET_KEY = 'anon:polling:offset'
+PENDING_KEY = 'anon:polling:pending'
+
+logger = logging.getLogger(__name__)
+
+
+class Poller:
+    """
+    Long polling that doesn't lose updates to a restart.
+
+    A batch is saved to Redis before it is confirmed to Telegram by the next getUpdates,
+    and every update is removed from there once handled. A new process handles
+    what the previous one left first, then goes on from the saved offset
+    """
+
+    def __init__(self, redis, dp: Dispatcher, bot: Bot, timeout: int):
+        self.redis = redis
+        self.dp = dp
+        self.bot = bot
+        self.timeout = timeout
+        self.offset: Optional[int] = None
+        self.handling: Set[int] = set()
+        self.handled: Set[int] = set()
+        self.tasks = set()
+        self._saving: Optional[asyncio.Future] = None
+        self._removing: Optional[asyncio.Task] = None
+
+    async def run(self):
+        workflow_data = {'dispatcher': self.dp, 'bots': [self.bot], 'bot': self.bot, **self.dp.workflow_data}
+        await self.dp.emit_startup(**workflow_data)
+        try:
+            await self._resume()
+            await self._poll()
+        finally:
+            await self.dp.emit_shutdown(**workflow_data)
+
+    async def _resume(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            offset, pending = await pipe.get(OFFSET_KEY).hvals(PENDING_KEY).execute()
+        self.offset = int(offset) if offset is not None else None
+
+        updates = sorted((Update.parse_raw(raw) for raw in pending), key=lambda update: update.update_id)
+        if updates:
+            logger.warning("Handling %s updates left by the previous run", len(updates))
+        for update in updates:
+            self._start(update)
+        logger.info("Polling for updates from %s", self.offset)
+
+    async def _poll(self):
+        backoff = Backoff(config=DEFAULT_BACKOFF_CONFIG)
+        kwargs = {}
+        if self.bot.session.timeout:
+            # a long poll must not time out as a request
+            kwargs['request_timeout'] = int(self.bot.session.timeout + self.timeout)
+
+        while True:
+            try:
+                updates = await self.bot(GetUpdates(offset=self.offset, timeout=self.timeout), **kwargs)
+            except Exception as e:
+                logger.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+                await backoff.asleep()
+                continue
+            if not updates:
+                continue
+
+            for update in updates:
+                self._start(update)
+            # a stop doesn't interrupt the save of updates already being handled
+            self._saving = asyncio.ensure_future(self._save(updates))
+            try:
+                await asyncio.shield(self._saving)
+            except RedisError as e:
+                # not confirmed, they come again and those started are skipped
+                logger.error("Updates not saved: %s", e)
+                await backoff.asleep()
+                continue
+            backoff.reset()
+            self._remove_soon()
+
+    async def _save(self, updates):
+        # the next getUpdates confirms the batch, it has to be in Redis by then
+        offset = updates[-1].update_id + 1
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(PENDING_KEY, mapping={update.update_id: update.json(exclude_none=True) for update in updates})
+            pipe.set(OFFSET_KEY, offset)
+            await pipe.execute()
+        self.offset = offset
+
+    def _start(self, update: Update):
+        # left by the updates loop before it restarted
+        if update.update_id in self.handling or update.update_id in self.handled:
+            return
+        self.handling.add(update.update_id)
+        task = asyncio.create_task(self._handle(update))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, update: Update):
+        try:
+            response = await self.dp.feed_update(self.bot, update)
+            if isinstance(response, TelegramMethod):
+                await self.dp.silent_call_request(bot=self.bot, result=response)
+        except Exception:
+            logger.exception("Cause exception while process update id=%d", update.update_id)
+        self.handling.discard(update.update_id)
+        self.handled.add(update.update_id)
+        self._remove_soon()
+
+    def _remove_soon(self):
+        if self.handled and (self._removing is None or self._removing.done()):
+            self._removing = asyncio.create_task(self._remove_handled())
+
+    async def flush(self):
+        """Finishes the save and the removal under way and removes the rest of handled updates"""
+        for pending in (self._saving, self._removing):
+            if pending is not None:
+                with suppress(RedisError):
+                    await pending
+        await self._remove_handled()
+
+    async def _remove_handled(self):
+        # Updates handled while a removal is under way go with the next one. Those handled
+        # before their batch is saved go after it, the batch would bring them back otherwise
+        while True:
+            handled = {update_id for update_id in self.handled if update_id < (self.offset or 0)}
+            if not handled:
+                return
+            try:
+                await self.redis.hdel(PENDING_KEY, *handled)
+            except RedisError as e:
+                logger.error("Handled updates not removed: %s", e)
+                return
+            self.handled -= handled
+
+
+poller = Poller(storage.redis, dp, bot, config.POLLING_TIMEOUT)
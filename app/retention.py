@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from redis.exceptions import RedisError, ResponseError
+
+from app.metrics import REDIS_BYTES, REDIS_KEYS, REDIS_TTL_CLAMPED
+from app.storage import (AnonRedisStorage, CONTEXT_DESTINY_PREFIX, INDEX_DESTINY,
+                         STACK_DESTINY_PREFIX)
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionSweeper:
+    """
+    Walks the keyspace with SCAN in small batches, reports key counts and bytes
+    per key class and clamps TTLs of FSM keys to the configured ones,
+    so keys written with older (or no) TTLs expire too
+    """
+
+    def __init__(self, storage: AnonRedisStorage, interval: float, count: int = 500, pause: float = 0.05):
+        self.storage = storage
+        self.redis = storage.redis
+        self.interval = interval
+        self.count = count
+        self.pause = pause
+        self._memory_usage = True
+        self._task: Optional[asyncio.Task] = None
+
+        builder = storage.key_builder
+        self.separator = builder.separator
+        self.fsm_prefix = builder.prefix + builder.separator
+        self.max_ttls = {
+            'fsm:state': storage.state_ttl,
+            'fsm:data': storage.data_ttl,
+            'fsm:stack': storage.dialog_ttl,
+            'fsm:context': storage.dialog_ttl,
+            'fsm:index': storage.dialog_ttl,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except RedisError:
+                logger.exception("Retention sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def key_class(self, key: str) -> str:
+        if not key.startswith(self.fsm_prefix):
+            # e.g. anon:send, anon:throttle
+            return self.separator.join(key.split(self.separator, 2)[:2])
+        if key.endswith(self.separator + 'state'):
+            return 'fsm:state'
+        for marker, key_class in ((CONTEXT_DESTINY_PREFIX, 'fsm:context'),
+                                  (STACK_DESTINY_PREFIX, 'fsm:stack'),
+                                  (INDEX_DESTINY + self.separator, 'fsm:index')):
+            if self.separator + marker in key:
+                return key_class
+        return 'fsm:data'
+
+    async def sweep(self) -> Dict[str, List[int]]:
+        """Returns {key class: [keys, bytes, clamped ttls]}"""
+        stats = defaultdict(lambda: [0, 0, 0])
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(cursor, count=self.count)
+            if keys:
+                await self._measure([key.decode() if isinstance(key, bytes) else key for key in keys], stats)
+            if not cursor:
+                break
+            # let updates through between batches
+            await asyncio.sleep(self.pause)
+
+        REDIS_KEYS.clear()
+        REDIS_BYTES.clear()
+        for key_class, (count, size, clamped) in sorted(stats.items()):
+            REDIS_KEYS.labels(key_class).set(count)
+            REDIS_BYTES.labels(key_class).set(size)
+            REDIS_TTL_CLAMPED.labels(key_class).inc(clamped)
+            logger.info("Redis %s: %s keys, %s bytes, %s ttls clamped", key_class, count, size, clamped)
+        return stats
+
+    async def _measure(self, keys: List[str], stats: Dict[str, List[int]]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                if self._memory_usage:
+                    pipe.memory_usage(key)
+                else:
+                    pipe.strlen(key)
+                pipe.ttl(key)
+            results = await pipe.execute(raise_on_error=False)
+
+        clamp = []
+        for key, size, ttl in zip(keys, results[::2], results[1::2]):
+            if isinstance(size, ResponseError):
+                if self._memory_usage and 'unknown command' in str(size):
+                    # Redis-compatible servers without MEMORY USAGE: count string values only
+                    self._memory_usage = False
+                size = 0
+            if isinstance(ttl, ResponseError) or ttl == -2:
+                continue
+
+            key_class = self.key_class(key)
+            entry = stats[key_class]
+            entry[0] += 1
+            entry[1] += (size or 0) + (0 if self._memory_usage else len(key))
+            max_ttl = self.max_ttls.get(key_class)
+            if max_ttl and (ttl == -1 or ttl > max_ttl):
+                clamp.append((key, max_ttl))
+                entry[2] += 1
+
+        if clamp:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, ttl in clamp:
+                    pipe.expire(key, ttl)
+                await pipe.execute()
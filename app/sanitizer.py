@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import partial
+from tempfile import TemporaryDirectory
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Union
+
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile, InputFile, Message
+from aiohttp import ClientError
+
+from app import config
+from app.loader import storage
+from app.media import CHUNK_SIZE, MediaDownloader, MediaTooLarge, media_downloader
+from app.metadata import UnsupportedImage, strip_metadata
+
+CACHE_PREFIX = 'anon:sanitized:'
+IMAGE_MIME_TYPES = {'image/jpeg', 'image/png'}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.png')
+
+logger = logging.getLogger(__name__)
+
+
+class SanitizeError(Exception):
+    pass
+
+
+class CleanFiles(dict):
+    """Original file_id: cached file_id or cleaned file to send instead"""
+
+    def __init__(self):
+        super().__init__()
+        # original file_id: its file_unique_id, for files uploaded by this job
+        self.uploaded: Dict[str, str] = {}
+
+
+def is_image_document(mime_type: Optional[str], file_name: Optional[str]) -> bool:
+    # clients send unknown extensions as application/octet-stream, so the name counts as well
+    return mime_type in IMAGE_MIME_TYPES or (file_name or '').lower().endswith(IMAGE_EXTENSIONS)
+
+
+class Sanitizer:
+    """
+    Replaces image documents with copies stripped of their metadata.
+
+    Files are downloaded and cleaned in `workers` processes, the cleaned upload
+    is remembered by the original file_unique_id, so a file is cleaned once
+    """
+
+    def __init__(self, redis, downloader: MediaDownloader, workers: int, cache_ttl: int):
+        self.redis = redis
+        self.downloader = downloader
+        self.workers = workers
+        self.cache_ttl = cache_ttl
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # started on the first document, most processes never need it
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def close(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            # waits for the workers to exit, off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, partial(executor.shutdown, cancel_futures=True))
+
+    @asynccontextmanager
+    async def prepare(self, documents: Sequence[Sequence[str]]) -> AsyncIterator[CleanFiles]:
+        """
+        `documents` are [file_id, file_unique_id, file_name] of image documents,
+        cleaned files are valid until the context exits
+        """
+        files = CleanFiles()
+        if not documents:
+            yield files
+            return
+
+        cached = await self.redis.mget([CACHE_PREFIX + unique_id for _, unique_id, _ in documents])
+        missing = []
+        for document, clean_id in zip(documents, cached):
+            if clean_id is not None:
+                files[document[0]] = clean_id.decode()
+            else:
+                missing.append(document)
+
+        with TemporaryDirectory(prefix='anon-sanitize-') as directory:
+            if missing:
+                cleaned = await asyncio.gather(*(self._clean(directory, i, *document)
+                                                 for i, document in enumerate(missing)))
+                for (file_id, unique_id, _), media in zip(missing, cleaned):
+                    files[file_id] = media
+                    files.uploaded[file_id] = unique_id
+            yield files
+
+    async def _clean(self, directory: str, number: int, file_id: str, unique_id: str,
+                     file_name: Optional[str]) -> InputFile:
+        src = os.path.join(directory, f'{number}.src')
+        dst = os.path.join(directory, f'{number}.clean')
+        pool = None
+        try:
+            src = await self.downloader.fetch(file_id, src)
+            pool = self._pool()
+            await asyncio.get_running_loop().run_in_executor(pool, strip_metadata, src, dst)
+        except (UnsupportedImage, MediaTooLarge, TelegramAPIError, ClientError, asyncio.TimeoutError) as e:
+            raise SanitizeError(f"Can't clean {unique_id}: {e}") from e
+        except BrokenProcessPool as e:
+            # a worker died, the next document gets a fresh pool;
+            # other documents may have got one already
+            pool.shutdown(wait=False)
+            if self._executor is pool:
+                self._executor = None
+            raise SanitizeError(f"Can't clean {unique_id}: {e}") from e
+        return FSInputFile(dst, filename=file_name, chunk_size=CHUNK_SIZE)
+
+    async def remember(self, files: CleanFiles, file_ids: List[str], messages: List[Message]):
+        """Caches what Telegram gave the cleaned uploads among `messages` sent for `file_ids`"""
+        clean_ids = {}
+        for file_id, message in zip(file_ids, messages):
+            unique_id = files.uploaded.get(file_id)
+            if unique_id and message.document:
+                clean_ids[CACHE_PREFIX + unique_id] = message.document.file_id
+        if not clean_ids:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, clean_id in clean_ids.items():
+                pipe.set(key, clean_id, ex=self.cache_ttl)
+            await pipe.execute()
+
+
+sanitizer = Sanitizer(storage.redis, media_downloader,
+                      workers=config.SANITIZE_WORKERS,
+                      cache_ttl=config.SANITIZE_CACHE_TTL)
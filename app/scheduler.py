@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from contextlib import suppress
+from typing import Dict, Optional
+
+from redis.exceptions import RedisError
+
+from app.metrics import QUEUE_DEPTH, SCHEDULE_LAG
+
+DUE_KEY = 'anon:schedule:due'
+JOBS_KEY = 'anon:schedule:jobs'
+
+# KEYS: due times, jobs, send queue; ARGV: now, batch size.
+# Moves up to a batch of jobs due by now to the send queue. Returns their
+# due times and the due time of the next job left, or an empty string
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+local scores = {}
+for i = 1, #due, 2 do
+    local job = redis.call('HGET', KEYS[2], due[i])
+    if job then
+        redis.call('LPUSH', KEYS[3], job)
+        redis.call('HDEL', KEYS[2], due[i])
+    end
+    redis.call('ZREM', KEYS[1], due[i])
+    scores[#scores + 1] = due[i + 1]
+end
+local next = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {scores, next[2] or ''}
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Posts to be sent later: job ids in a sorted set by due time, O(log n) to add,
+    and the jobs in a hash. A loop moves due jobs to the send queue, which keeps
+    to the chat's rate limit. Moving is atomic, any number of processes may run the loop
+    """
+
+    def __init__(self, redis, queue_key: str, batch: int, interval: float):
+        self.redis = redis
+        self.queue_key = queue_key
+        self.batch = batch
+        self.interval = interval
+        self._pop_due = redis.register_script(POP_DUE_SCRIPT)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def schedule(self, job: Dict, delay: float) -> float:
+        """Returns the time the job is due at"""
+        job.setdefault('id', uuid.uuid4().hex)
+        due = time.time() + delay
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(JOBS_KEY, job['id'], json.dumps(job))
+            pipe.zadd(DUE_KEY, {job['id']: due})
+            await pipe.execute()
+        # it may be due before the loop would look again
+        self._wakeup.set()
+        return due
+
+    async def size(self) -> int:
+        return await self.redis.zcard(DUE_KEY)
+
+    async def collect_metrics(self):
+        QUEUE_DEPTH.labels('scheduled').set(await self.size())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                delay = await self.dispatch()
+            except RedisError as e:
+                logger.error("Scheduled posts are unavailable: %s", e)
+                delay = self.interval
+            # jobs scheduled by other processes are found within the interval
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+
+    async def dispatch(self) -> float:
+        """Moves due jobs to the send queue, returns seconds until the next one is due, at most the interval"""
+        while True:
+            now = time.time()
+            scores, next_due = await self._pop_due(keys=[DUE_KEY, JOBS_KEY, self.queue_key], args=[now, self.batch],
+                                                   client=self.redis)
+            for score in scores:
+                SCHEDULE_LAG.observe(max(now - float(score), 0))
+            if len(scores) < self.batch:
+                break
+        if not next_due:
+            return self.interval
+        return min(max(float(next_due) - time.time(), 0), self.interval)
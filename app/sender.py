@@ -0,0 +1,424 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.enums.parse_mode import ParseMode
+from aiogram.types import ContentType, InputMedia
+from aiogram.utils.markdown import hlink
+from aiogram import Bot
+from aiogram.types import Chat, User
+from aiogram_dialog import DialogRegistry, ShowMode, StartMode
+from aiogram_dialog.api.entities import DEFAULT_STACK_ID, DialogAction, DialogStartEvent, DialogUpdate
+from aiogram_dialog.api.internal import FakeChat, FakeUser
+from aiogram_dialog.manager.bg_manager import BgManager
+from redis.exceptions import RedisError
+
+from app import config
+from app.bot_loader import bot
+from app.dedup import DedupIndex, dedup
+from app.dialogs.main.states import Main
+from app.loader import storage
+from app.metrics import QUEUE_DEPTH
+from app.middlewares.throttling import GCRA_SCRIPT
+from app.sanitizer import CleanFiles, SanitizeError, Sanitizer, sanitizer
+from app.scheduler import Scheduler
+from app.sharding import push_report
+from app.utils import ALL_MEDIA, Forwarder, get_message_url
+
+QUEUE_KEY = 'anon:send:queue'
+# jobs being sent by a process are in its own list, while its heartbeat key lives;
+# the processes that have such a list are in the set
+PROCESSING_PREFIX = 'anon:send:processing:'
+HEARTBEAT_PREFIX = 'anon:send:alive:'
+INSTANCES_KEY = 'anon:send:instances'
+SEND_ERROR = ("Что-то пошло не так, "
+              "попробуйте заново или напишите разработчику "
+              "@mindsweeper")
+# characters Telegram takes in a caption and in a message
+CAPTION_LIMIT = 1024
+TEXT_LIMIT = 4096
+SANITIZE_ERROR = ("Не получилось убрать метаданные из файла, "
+                  "отправьте его как фото или в формате JPEG/PNG до 20 МБ")
+
+# KEYS: GCRA key of a chat; ARGV: now, hold, tolerance (ms).
+# Moves the theoretical arrival time past the end of the hold, nothing is allowed before it
+HOLD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now + tonumber(ARGV[2]) + tonumber(ARGV[3]))
+redis.call('SET', KEYS[1], tat, 'PX', math.ceil(tat - now))
+return tat
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def processing_key(instance: str) -> str:
+    return f'{PROCESSING_PREFIX}{instance}'
+
+
+def heartbeat_key(instance: str) -> str:
+    return f'{HEARTBEAT_PREFIX}{instance}'
+
+
+class ChatRateLimiter:
+    """
+    Per-chat flood limit shared by all processes: GCRA in Redis, as throttling does.
+    A Telegram RetryAfter is kept in the same key, every process holds off
+    """
+
+    def __init__(self, redis, rate_per_minute: int, burst: int, prefix: str = 'anon:send:rate'):
+        self.redis = redis
+        self.interval = 60_000 / rate_per_minute
+        self.tolerance = self.interval * (burst - 1)
+        self.prefix = prefix
+        self._gcra = redis.register_script(GCRA_SCRIPT)
+        self._hold = redis.register_script(HOLD_SCRIPT)
+
+    def _key(self, chat_id) -> str:
+        return f'{self.prefix}:{chat_id}'
+
+    async def acquire(self, chat_id):
+        while True:
+            try:
+                wait = await self._gcra(keys=[self._key(chat_id)],
+                                        args=[int(time.time() * 1000), self.interval, self.tolerance],
+                                        client=self.redis)
+            except RedisError as e:
+                logger.warning("Send rate limit is unavailable: %s", e)
+                return
+            if not wait:
+                return
+            await asyncio.sleep(float(wait) / 1000)
+
+    async def hold(self, chat_id, seconds: float):
+        """Telegram asked to back off: nothing goes out to the chat for the next `seconds`"""
+        try:
+            await self._hold(keys=[self._key(chat_id)],
+                             args=[int(time.time() * 1000), int(seconds * 1000), self.tolerance],
+                             client=self.redis)
+        except RedisError as e:
+            logger.warning("Send rate limit is unavailable: %s", e)
+
+
+class SendQueue:
+    """
+    Posts waiting to be sent, a Redis list shared by all processes. A job taken by a process
+    stays in its processing list until sent; lists of processes whose heartbeat expired
+    are put back on the queue by the others
+    """
+
+    def __init__(self, redis, concurrency: int, rate_per_minute: int, burst: int, attempts: int,
+                 sanitizer: Optional[Sanitizer] = None, dedup: Optional[DedupIndex] = None,
+                 heartbeat_ttl: int = 30, sharded: bool = False):
+        self.redis = redis
+        self.sharded = sharded
+        self.sanitizer = sanitizer
+        self.dedup = dedup
+        self.concurrency = concurrency
+        self.attempts = attempts
+        self.limiter = ChatRateLimiter(redis, rate_per_minute, burst)
+        self.heartbeat_ttl = heartbeat_ttl
+        self.instance = uuid.uuid4().hex[:16]
+        self.processing_key = processing_key(self.instance)
+        self.registry: Optional[DialogRegistry] = None
+        self._workers = []
+        self._heartbeat = None
+        self._busy = set()
+        self._stopping = False
+
+    async def put(self, job: Dict):
+        job.setdefault('id', uuid.uuid4().hex)
+        await self.redis.lpush(QUEUE_KEY, json.dumps(job))
+
+    async def size(self) -> int:
+        return await self.redis.llen(QUEUE_KEY)
+
+    async def in_progress(self) -> int:
+        """Jobs being sent by all processes"""
+        instances = await self.redis.smembers(INSTANCES_KEY)
+        if not instances:
+            return 0
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for instance in instances:
+                pipe.llen(processing_key(instance.decode()))
+            return sum(await pipe.execute())
+
+    async def collect_metrics(self):
+        QUEUE_DEPTH.labels('send').set(await self.size())
+        QUEUE_DEPTH.labels('send_processing').set(await self.in_progress())
+
+    async def start(self, registry: DialogRegistry):
+        self.registry = registry
+        self._stopping = False
+        await self._beat()
+        await self._requeue_dead()
+        self._heartbeat = asyncio.create_task(self._keep_alive())
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout: float = 0):
+        """
+        Stops taking jobs. Jobs being sent get `timeout` seconds to finish,
+        the rest are put back on the queue for other processes or the next start
+        """
+        self._stopping = True
+        busy = [worker for worker in self._workers if worker in self._busy]
+        if busy and timeout:
+            _, busy = await asyncio.wait(busy, timeout=timeout)
+        if busy:
+            logger.warning("Interrupted %s send jobs, they will be requeued", len(busy))
+        for task in (*self._workers, self._heartbeat):
+            if task:
+                task.cancel()
+        await asyncio.gather(*self._workers, *filter(None, (self._heartbeat,)), return_exceptions=True)
+        self._workers, self._heartbeat = [], None
+        try:
+            await self._requeue(self.instance)
+        except RedisError as e:
+            # left to the others once the heartbeat expires
+            logger.error("Unfinished send jobs not requeued: %s", e)
+
+    async def _beat(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            # the heartbeat first: the instance is never listed without one
+            pipe.set(heartbeat_key(self.instance), 1, ex=self.heartbeat_ttl)
+            pipe.sadd(INSTANCES_KEY, self.instance)
+            await pipe.execute()
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_ttl / 3)
+            try:
+                await self._beat()
+                await self._requeue_dead()
+            except RedisError as e:
+                logger.error("Send queue heartbeat failed: %s", e)
+
+    async def _requeue_dead(self):
+        # jobs taken by processes that died before finishing them
+        for instance in await self.redis.smembers(INSTANCES_KEY):
+            instance = instance.decode()
+            if instance != self.instance and not await self.redis.exists(heartbeat_key(instance)):
+                await self._requeue(instance)
+
+    async def _requeue(self, instance: str):
+        count = 0
+        while await self.redis.lmove(processing_key(instance), QUEUE_KEY, 'LEFT', 'RIGHT'):
+            count += 1
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.srem(INSTANCES_KEY, instance).delete(heartbeat_key(instance)).execute()
+        if count:
+            logger.warning("Requeued %s unfinished send jobs of %s", count, instance)
+
+    async def _work(self):
+        while not self._stopping:
+            try:
+                raw = await self.redis.brpoplpush(QUEUE_KEY, self.processing_key, timeout=5)
+            except RedisError as e:
+                logger.error("Send queue is unavailable: %s", e)
+                await asyncio.sleep(5)
+                continue
+
+            if raw is None:
+                continue
+
+            worker = asyncio.current_task()
+            self._busy.add(worker)
+            try:
+                await self._process(json.loads(raw))
+            except Exception:
+                logger.exception("Send job failed: %s", raw)
+            finally:
+                self._busy.discard(worker)
+            # a cancelled job is left to be requeued
+            await self.redis.lrem(self.processing_key, 1, raw)
+
+    async def _process(self, job: Dict):
+        result, cancelled = {'dialog_error': SEND_ERROR}, False
+        try:
+            result = await self._deliver(job)
+            await self._report(job, result)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # whatever became of the report; a cancelled job is requeued with its claim
+            if self.dedup and job.get('fingerprint') and not cancelled:
+                await self._report_duplicates(job['fingerprint'], result)
+
+    async def _deliver(self, job: Dict) -> Dict:
+        """Sends the post, returns what to tell its author"""
+        documents = job.get('documents')
+        prepare = self.sanitizer.prepare(documents) if self.sanitizer and documents else nullcontext(CleanFiles())
+
+        result = {'dialog_error': SEND_ERROR}
+        try:
+            # downloaded and cleaned once, whatever number of attempts the post takes
+            async with prepare as files:
+                for attempt in range(self.attempts):
+                    await self.limiter.acquire(job['chat_id'])
+                    try:
+                        sent_url = await self._send(job, files)
+                    except TelegramRetryAfter as e:
+                        logger.warning("Flood control in chat %s, retry in %s s", job['chat_id'], e.retry_after)
+                        await self.limiter.hold(job['chat_id'], e.retry_after)
+                    except TelegramNetworkError as e:
+                        logger.warning("Network error on send job %s: %s", job['id'], e)
+                        await asyncio.sleep(2 ** attempt)
+                    except TelegramAPIError as e:
+                        logger.error("Send job %s rejected: %s", job['id'], e)
+                        break
+                    else:
+                        result = {'sent_url': sent_url}
+                        break
+        except SanitizeError as e:
+            logger.warning("Send job %s not sanitized: %s", job['id'], e)
+            result = {'dialog_error': SANITIZE_ERROR}
+        return result
+
+    async def _report_duplicates(self, post: str, result: Dict):
+        # the same post submitted by others while this one was queued
+        if 'sent_url' in result:
+            waiters = await self.dedup.resolve(post, result['sent_url'])
+        else:
+            waiters = await self.dedup.release(post)
+        for user_id, user_chat_id in waiters:
+            try:
+                await self._report({'user_id': user_id, 'user_chat_id': user_chat_id}, result)
+            except Exception:
+                logger.exception("Author of a duplicate post %s not told", post)
+
+    async def _send(self, job: Dict, files: CleanFiles) -> Optional[str]:
+        chat_id, content_type = job['chat_id'], job['content_type']
+
+        if content_type == ContentType.POLL:
+            sent = await bot.copy_message(chat_id, job['from_chat_id'], job['message_id'])
+            return get_message_url(chat_id, sent.message_id)
+
+        caption, first_url = job.get('text'), None
+        if caption and len(caption) > (CAPTION_LIMIT if content_type in ALL_MEDIA else TEXT_LIMIT):
+            # too long to go with the media or in one message: the text goes first, on its own
+            first_url = await self._send_chunks(job)
+            if content_type not in ALL_MEDIA:
+                return first_url
+            caption = None
+            await self.limiter.acquire(chat_id)
+
+        if job.get('medias'):
+            sent = await bot.send_media_group(chat_id, build_album(job['medias'], caption, files))
+            if files.uploaded:
+                await self.sanitizer.remember(files, [file_id for _, file_id in job['medias']], sent)
+            return first_url or sent[0].get_url()
+
+        if content_type in ALL_MEDIA:
+            fwder: Forwarder = ALL_MEDIA.get(content_type)
+            kwargs = {"caption": caption}
+            if fwder.spoilering:
+                kwargs.update({"has_spoiler": True})
+
+            sent = await fwder.sender(chat_id, files.get(job['file_id'], job['file_id']), **kwargs)
+            if files.uploaded:
+                await self.sanitizer.remember(files, [job['file_id']], [sent])
+        else:
+            sent = await bot.send_message(chat_id, job['text'])
+
+        return first_url or sent.get_url()
+
+    async def _send_chunks(self, job: Dict) -> str:
+        """
+        Sends the text of `job` in messages of up to TEXT_LIMIT characters and returns the link to the first.
+        The job keeps count of those sent, another attempt picks up after them
+        """
+        for i, chunk in enumerate(split_text(job['text'], TEXT_LIMIT)[job.get('chunks_sent', 0):]):
+            if i:
+                await self.limiter.acquire(job['chat_id'])
+            sent = await bot.send_message(job['chat_id'], chunk)
+            job.setdefault('first_url', sent.get_url())
+            job['chunks_sent'] = job.get('chunks_sent', 0) + 1
+        return job['first_url']
+
+    async def _report(self, job: Dict, data: Dict):
+        if job.get('scheduled'):
+            # hours may have passed, the dialog the user is in now is left alone
+            return await self._notify(job['user_chat_id'], data)
+        if self.sharded:
+            # shown by the chat's shard, so that it doesn't race the user's own updates for the dialog
+            return await push_report(self.redis, job['user_chat_id'],
+                                     {'user_id': job['user_id'], 'user_chat_id': job['user_chat_id'], 'data': data})
+        manager = BgManager(user=FakeUser(id=job['user_id'], is_bot=False, first_name=''),
+                            chat=FakeChat(id=job['user_chat_id'], type='private'),
+                            bot=bot,
+                            registry=self.registry,
+                            intent_id=None,
+                            stack_id=DEFAULT_STACK_ID)
+        await manager.start(Main.sent, mode=StartMode.RESET_STACK, data=data)
+
+    async def show_report(self, report: Dict):
+        """Starts Main.sent for a report from the shard's stream, done by the time it returns"""
+        user = FakeUser(id=report['user_id'], is_bot=False, first_name='')
+        chat = FakeChat(id=report['user_chat_id'], type='private')
+        event = DialogStartEvent(action=DialogAction.START, data=report['data'], new_state=Main.sent,
+                                 mode=StartMode.RESET_STACK, show_mode=ShowMode.AUTO,
+                                 from_user=user, chat=chat, intent_id=None, stack_id=DEFAULT_STACK_ID)
+        # what BgManager has the registry do in a task of its own
+        Bot.set_current(bot)
+        User.set_current(user)
+        Chat.set_current(chat)
+        await self.registry.dp.propagate_event(update_type='update', event=DialogUpdate(aiogd_update=event),
+                                               bot=bot, event_from_user=user, event_chat=chat)
+
+    async def _notify(self, user_chat_id: int, data: Dict):
+        if 'sent_url' in data:
+            text = hlink('Отложенный пост ушёл!', data['sent_url']) if data['sent_url'] else 'Отложенный пост ушёл!'
+        else:
+            text = data['dialog_error']
+        try:
+            await bot.send_message(user_chat_id, text, parse_mode=ParseMode.HTML)
+        except TelegramAPIError as e:
+            logger.warning("Author of a scheduled post not notified: %s", e)
+
+
+def split_text(text: str, limit: int) -> List[str]:
+    """`text` in pieces of at most `limit` characters, cut at a line break or else a space where there is one"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(' ', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n ')
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def build_album(medias, caption=None, files: Optional[Dict] = None) -> List[InputMedia]:
+    album = []
+    files = files or {}
+    for content_type, file_id in medias:
+        fwder: Forwarder = ALL_MEDIA.get(content_type)
+        kwargs = {"caption": caption} if not album else {}
+        if fwder.spoilering:
+            kwargs.update({"has_spoiler": True})
+
+        album.append(fwder.aio_type(media=files.get(file_id, file_id), **kwargs))
+    return album
+
+
+send_queue = SendQueue(storage.redis,
+                       concurrency=config.SEND_CONCURRENCY,
+                       rate_per_minute=config.SEND_RATE_PER_MINUTE,
+                       burst=config.SEND_BURST,
+                       attempts=config.SEND_ATTEMPTS,
+                       sanitizer=sanitizer if config.SANITIZE_DOCUMENTS else None,
+                       dedup=dedup if config.DEDUP_WINDOW else None,
+                       heartbeat_ttl=config.SEND_HEARTBEAT_TTL,
+                       sharded=config.PROCESS_ROLE == 'worker')
+# posts sent later, moved to the send queue once due
+scheduler = Scheduler(storage.redis, QUEUE_KEY, batch=config.SCHEDULE_BATCH, interval=config.SCHEDULE_INTERVAL)
@@ -0,0 +1,64 @@
+import json
+import zlib
+from typing import Any
+
+import msgpack
+
+# first byte of a stored value; anything else is JSON written before serializers existed
+MSGPACK = 1
+MSGPACK_ZLIB = 2
+
+
+def _default(obj):
+    if hasattr(obj, 'to_json'):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class Serializer:
+    """
+    Encodes FSM data for the storage.
+
+    `loads` reads every format the storage has ever written, so the format
+    can be switched both ways and old keys are rewritten on their next update
+    """
+
+    def dumps(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, value: bytes) -> Any:
+        version = value[0]
+        if version == MSGPACK:
+            return msgpack.unpackb(value[1:])
+        if version == MSGPACK_ZLIB:
+            return msgpack.unpackb(zlib.decompress(value[1:]))
+        return json.loads(value)
+
+
+class JsonSerializer(Serializer):
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+class MsgpackSerializer(Serializer):
+    """msgpack, zlib-compressed when longer than `compress_threshold` bytes"""
+
+    def __init__(self, compress_threshold: int = 1024, compress_level: int = 1):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    def dumps(self, data: Any) -> bytes:
+        packed = msgpack.packb(data, default=_default)
+        if self.compress_threshold and len(packed) > self.compress_threshold:
+            compressed = zlib.compress(packed, self.compress_level)
+            if len(compressed) < len(packed):
+                return bytes((MSGPACK_ZLIB,)) + compressed
+        return bytes((MSGPACK,)) + packed
+
+
+def get_serializer(name: str, compress_threshold: int) -> Serializer:
+    if name == 'json':
+        return JsonSerializer()
+    if name == 'msgpack':
+        return MsgpackSerializer(compress_threshold)
+    raise ValueError(f"Unknown storage serializer {name!r}")
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import Message, Update
+from redis.exceptions import RedisError, ResponseError
+
+from app import config
+from app.loader import storage
+
+GROUP = 'workers'
+UPDATE_FIELD = 'update'
+# the outcome of a post, for the chat's shard to show its author
+REPORT_FIELD = 'report'
+CHAT_FIELD = 'chat'
+
+logger = logging.getLogger(__name__)
+
+
+# entries that couldn't be read, kept for a look
+DEAD_LETTER_KEY = 'anon:updates:dead'
+DEAD_LETTER_MAXLEN = 10_000
+
+
+def stream_key(shard: int) -> str:
+    return f'anon:updates:{shard}'
+
+
+def shard_for(chat_id: int) -> int:
+    return chat_id % config.SHARDS
+
+
+class ShardingMiddleware(BaseMiddleware):
+    """
+    Outer update middleware for the ingress process:
+    updates are pushed to the stream of their chat's shard instead of being handled
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: Dict[str, Any],
+    ) -> Any:
+        chat, user = data.get('event_chat'), data.get('event_from_user')
+        chat_id = chat.id if chat else (user.id if user else 0)
+
+        await self.redis.xadd(stream_key(shard_for(chat_id)),
+                              {UPDATE_FIELD: event.json(exclude_none=True), CHAT_FIELD: chat_id},
+                              maxlen=config.UPDATES_STREAM_MAXLEN, approximate=True)
+
+
+async def push_report(redis, chat_id: int, report: Dict):
+    """Puts `report` on the stream of the chat's shard, it is handled in turn with the chat's updates"""
+    await redis.xadd(stream_key(shard_for(chat_id)),
+                     {REPORT_FIELD: json.dumps(report), CHAT_FIELD: chat_id},
+                     maxlen=config.UPDATES_STREAM_MAXLEN, approximate=True)
+
+
+class ShardConsumer:
+    """
+    Feeds updates of one shard to the dispatcher and reports to `on_report`.
+    Entries of one chat are handled one by one and in order, different chats concurrently.
+    Parts of an album are collected by the first one while it waits for its turn and then
+    `album_latency` seconds more, it is fed with all of them in `data["album"]`
+    """
+
+    def __init__(self, redis, dp: Dispatcher, bot: Bot, shard: int, concurrency: int, album_latency: float,
+                 on_report: Callable[[Dict], Awaitable[Any]]):
+        self.redis = redis
+        self.dp = dp
+        self.bot = bot
+        self.on_report = on_report
+        self.stream = stream_key(shard)
+        self.consumer = f'shard-{shard}'
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.album_latency = album_latency
+        self.chat_locks: Dict[bytes, Tuple[asyncio.Lock, int]] = {}
+        # ids of the entries being handled, pending ones read again after a restart of `run` are skipped
+        self.in_flight: Set[bytes] = set()
+        # (chat, media group id): entry ids and messages of the parts that came after the first one
+        self.albums: Dict[Tuple[bytes, str], List[Tuple[bytes, Message]]] = {}
+        self.tasks = set()
+
+    async def _ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def run(self):
+        await self._ensure_group()
+        logger.info("Consuming updates from %s", self.stream)
+
+        # updates read but not acknowledged before a restart come first
+        last_id = '0'
+        while True:
+            pending = last_id != '>'
+            try:
+                response = await self.redis.xreadgroup(GROUP, self.consumer, {self.stream: last_id},
+                                                       count=100, block=None if pending else 5000)
+            except RedisError as e:
+                logger.error("Updates stream is unavailable: %s", e)
+                await asyncio.sleep(5)
+                continue
+
+            entries = response[0][1] if response else []
+            if pending:
+                # pending entries are paged by id, then switch to new ones
+                last_id = entries[-1][0] if entries else '>'
+
+            for entry_id, fields in entries:
+                if entry_id in self.in_flight:
+                    continue
+                try:
+                    chat = fields[CHAT_FIELD.encode()]
+                    report = fields.get(REPORT_FIELD.encode())
+                    if report is not None:
+                        update, album = json.loads(report), None
+                    else:
+                        update = Update.parse_raw(fields[UPDATE_FIELD.encode()])
+                        group = update.message and update.message.media_group_id
+                        album = group and (chat, group)
+                except Exception:
+                    # read again after every restart otherwise
+                    logger.exception("Unreadable stream entry %s moved to %s", entry_id, DEAD_LETTER_KEY)
+                    await self._dead_letter(entry_id, fields)
+                    continue
+
+                self.in_flight.add(entry_id)
+                if album and album in self.albums:
+                    # the first part is waiting for it
+                    self.albums[album].append((entry_id, update.message))
+                    continue
+                if album:
+                    self.albums[album] = []
+
+                await self.semaphore.acquire()
+                task = asyncio.create_task(self._handle(entry_id, chat, update, album))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, entry_id, chat: bytes, update: Union[Update, Dict], album: Optional[Tuple[bytes, str]]):
+        lock, users = self.chat_locks.get(chat, (asyncio.Lock(), 0))
+        self.chat_locks[chat] = (lock, users + 1)
+        parts = self.albums.get(album)
+        entry_ids, kwargs = [entry_id], {}
+        try:
+            async with lock:
+                if album:
+                    await self._collect(parts)
+                    del self.albums[album]
+                    entry_ids.extend(part_id for part_id, _ in parts)
+                    kwargs['album'] = sorted([update.message, *(message for _, message in parts)],
+                                             key=lambda message: message.message_id)
+                try:
+                    if isinstance(update, Update):
+                        await self.dp.feed_update(self.bot, update, **kwargs)
+                    else:
+                        await self.on_report(update)
+                except Exception:
+                    logger.exception("Cause exception while process stream entry %s", entry_id)
+                await self.redis.xack(self.stream, GROUP, *entry_ids)
+        finally:
+            self.in_flight.discard(entry_id)
+            if album:
+                self.in_flight.difference_update(part_id for part_id, _ in parts)
+            # a later album with the same id may be collected by now
+            if album and self.albums.get(album) is parts:
+                del self.albums[album]
+            lock, users = self.chat_locks[chat]
+            if users == 1:
+                del self.chat_locks[chat]
+            else:
+                self.chat_locks[chat] = (lock, users - 1)
+            self.semaphore.release()
+
+    async def _dead_letter(self, entry_id: bytes, fields: Dict[bytes, bytes]):
+        try:
+            await self.redis.xadd(DEAD_LETTER_KEY, {**fields, b'stream': self.stream, b'id': entry_id},
+                                  maxlen=DEAD_LETTER_MAXLEN, approximate=True)
+            await self.redis.xack(self.stream, GROUP, entry_id)
+        except RedisError as e:
+            logger.error("Stream entry %s not moved: %s", entry_id, e)
+
+    async def _collect(self, parts: List[Tuple[bytes, Message]]):
+        # as AlbumMiddleware does: until no new part came for album_latency seconds
+        received = -1
+        while received != len(parts):
+            received = len(parts)
+            await asyncio.sleep(self.album_latency)
+
+
+def setup_ingress(dp: Dispatcher):
+    dp.update.outer_middleware(ShardingMiddleware(storage.redis))
+
+
+_consumer: Optional[ShardConsumer] = None
+
+
+async def consume_updates(dp: Dispatcher, bot: Bot, on_report: Callable[[Dict], Awaitable[Any]]):
+    global _consumer
+    # one for the process: after a crash the entries still being handled and their chats' locks are kept
+    if _consumer is None:
+        _consumer = ShardConsumer(storage.redis, dp, bot,
+                                  shard=config.SHARD_INDEX,
+                                  concurrency=config.WORKER_CONCURRENCY,
+                                  album_latency=config.ALBUM_LATENCY,
+                                  on_report=on_report)
+    await _consumer.run()
@@ -0,0 +1,48 @@
+"""
+`python app --profile-startup`: import time of every module the bot loads, measured
+by a fresh interpreter with `-X importtime`. Standard library only, it runs before the bot is imported
+"""
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Tuple
+
+ROOT = Path(__file__).absolute().parent.parent
+
+
+def _parse(output: str) -> List[Tuple[int, int, str]]:
+    """(self µs, cumulative µs, module) from -X importtime output"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return rows
+
+
+def profile_imports(limit: int = 25) -> int:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (str(ROOT), os.environ.get('PYTHONPATH')))))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app.__main__'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    rows = _parse(result.stderr)
+    if result.returncode:
+        print('\n'.join(line for line in result.stderr.splitlines() if not line.startswith('import time:')))
+        return result.returncode
+
+    packages = defaultdict(int)
+    for self_us, _, name in rows:
+        packages[name.split('.')[0]] += self_us
+    total = sum(packages.values())
+
+    print(f"Imports: {total / 1000:.0f} ms, {len(rows)} modules\n")
+    print(f"{'package':<32}{'ms':>8}{'%':>6}")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:limit]:
+        print(f"{package:<32}{self_us / 1000:>8.1f}{self_us * 100 / total:>6.1f}")
+
+    print(f"\n{'module':<56}{'self ms':>9}{'with imports ms':>17}")
+    for self_us, cumulative_us, name in sorted(rows, key=lambda row: -row[1])[:limit]:
+        print(f"{name:<56}{self_us / 1000:>9.1f}{cumulative_us / 1000:>17.1f}")
+    return 0
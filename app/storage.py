@@ -0,0 +1,219 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Collection, Dict, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+from aiogram_dialog.api.entities import DEFAULT_STACK_ID
+from cachetools import LRUCache
+
+from app.serializers import JsonSerializer, Serializer
+
+DIALOG_DESTINY_PREFIX = 'aiogd:'
+CONTEXT_DESTINY_PREFIX = 'aiogd:context:'
+STACK_DESTINY_PREFIX = 'aiogd:stack:'
+INDEX_DESTINY = 'aiogd:index'
+STACK_DESTINY = f'{STACK_DESTINY_PREFIX}{DEFAULT_STACK_ID}'
+
+
+class UpdateBatch:
+    """Raw values read and written while handling one update"""
+    __slots__ = ('values', 'dirty', 'finished_intents', 'closed')
+
+    def __init__(self):
+        self.values: Dict[str, Optional[bytes]] = {}
+        # redis key: (value or None to delete, ttl, dialogs index key)
+        self.dirty: Dict[str, Tuple[Optional[bytes], Optional[int], Optional[str]]] = {}
+        # contexts saved in a finished state, their stack expires early as well
+        self.finished_intents: Set[str] = set()
+        self.closed = False
+
+
+_batch: ContextVar[Optional[UpdateBatch]] = ContextVar('anon_storage_batch', default=None)
+
+
+class AnonRedisStorage(RedisStorage):
+    """
+    RedisStorage that keeps a per user set of aiogram_dialog keys,
+    so a user's dialogs can be dropped without scanning the keyspace.
+
+    Inside `batch()` the keys an update needs are fetched with one MGET
+    and its writes go to Redis in one MULTI when the update is done.
+
+    Dialog stacks and contexts live for `dialog_ttl`, contexts in one of
+    `finished_states` (and the stack they are on top of) for `finished_dialog_ttl`
+    """
+
+    def __init__(self, *args, serializer: Optional[Serializer] = None, dialog_ttl: Optional[int] = None,
+                 finished_dialog_ttl: Optional[int] = None, finished_states: Collection[str] = (), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.serializer = serializer or JsonSerializer()
+        self.dialog_ttl = dialog_ttl or self.data_ttl
+        self.finished_dialog_ttl = finished_dialog_ttl or self.dialog_ttl
+        self.finished_states = frozenset(finished_states)
+        # (chat_id, user_id): intent on top of the user's stack, to prefetch its context
+        self._top_intents = LRUCache(maxsize=10000)
+        # contexts last saved in a finished state outside a batch, their stack is saved right after them
+        self._finished_intents = LRUCache(maxsize=10000)
+
+    def _index_key(self, key: StorageKey) -> str:
+        return self.key_builder.build(StorageKey(bot_id=key.bot_id,
+                                                 chat_id=key.chat_id,
+                                                 user_id=key.user_id,
+                                                 destiny=INDEX_DESTINY), "keys")
+
+    def _dialog_key(self, bot: Bot, chat_id: int, user_id: int, destiny: str) -> StorageKey:
+        return StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id, destiny=destiny)
+
+    @asynccontextmanager
+    async def batch(self, bot: Bot, state_key: StorageKey, chat_id: int, user_id: int,
+                    intent_id: Optional[str] = None) -> AsyncIterator[UpdateBatch]:
+        batch = UpdateBatch()
+        stack_key = self._dialog_key(bot, chat_id, user_id, STACK_DESTINY)
+        redis_keys = [self.key_builder.build(state_key, "state"), self.key_builder.build(stack_key, "data")]
+        intent_id = intent_id or self._top_intents.get((chat_id, user_id))
+        if intent_id:
+            context_key = self._dialog_key(bot, chat_id, user_id, f"aiogd:context:{intent_id}")
+            redis_keys.append(self.key_builder.build(context_key, "data"))
+        batch.values.update(zip(redis_keys, await self.redis.mget(redis_keys)))
+
+        token = _batch.set(batch)
+        try:
+            yield batch
+        finally:
+            _batch.reset(token)
+            batch.closed = True
+            stack = batch.dirty.get(redis_keys[1])
+            if stack is not None:
+                top_intent = self._remember_top_intent(chat_id, user_id, stack[0])
+                if top_intent in batch.finished_intents:
+                    batch.dirty[redis_keys[1]] = (stack[0], self.finished_dialog_ttl, stack[2])
+            await self._flush(batch)
+
+    def _remember_top_intent(self, chat_id: int, user_id: int, raw_stack: Optional[bytes]) -> Optional[str]:
+        intents = raw_stack and self.serializer.loads(raw_stack).get('intents')
+        if intents:
+            self._top_intents[chat_id, user_id] = intents[-1]
+            return intents[-1]
+        self._top_intents.pop((chat_id, user_id), None)
+        return None
+
+    async def _flush(self, batch: UpdateBatch):
+        if not batch.dirty:
+            return
+        index_keys = set()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for redis_key, (value, ttl, index_key) in batch.dirty.items():
+                self._queue_write(pipe, redis_key, value, ttl, index_key)
+                if index_key and value is not None:
+                    index_keys.add(index_key)
+            for index_key in index_keys:
+                self._expire_index(pipe, index_key)
+            await pipe.execute()
+
+    def _expire_index(self, pipe, index_key: str):
+        # the index outlives every key it lists
+        if self.dialog_ttl is not None:
+            pipe.expire(index_key, self.dialog_ttl)
+
+    def _queue_write(self, pipe, redis_key: str, value: Optional[bytes], ttl: Optional[int],
+                     index_key: Optional[str]):
+        if value is None:
+            pipe.delete(redis_key)
+            if index_key:
+                pipe.srem(index_key, redis_key)
+            return
+
+        pipe.set(redis_key, value, ex=ttl)
+        if index_key:
+            pipe.sadd(index_key, redis_key)
+
+    async def _read(self, redis_key: str) -> Optional[bytes]:
+        batch = _batch.get()
+        if batch is None or batch.closed:
+            return await self.redis.get(redis_key)
+        if redis_key not in batch.values:
+            batch.values[redis_key] = await self.redis.get(redis_key)
+        return batch.values[redis_key]
+
+    async def _write(self, redis_key: str, value: Optional[bytes], ttl: Optional[int],
+                     index_key: Optional[str] = None):
+        batch = _batch.get()
+        if batch is not None and not batch.closed:
+            batch.values[redis_key] = value
+            batch.dirty[redis_key] = (value, ttl, index_key)
+            return
+
+        if index_key is None:
+            if value is None:
+                await self.redis.delete(redis_key)
+            else:
+                await self.redis.set(redis_key, value, ex=ttl)
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_write(pipe, redis_key, value, ttl, index_key)
+            if value is not None:
+                self._expire_index(pipe, index_key)
+            await pipe.execute()
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._write(self.key_builder.build(key, "state"), value and value.encode('utf-8'), self.state_ttl)
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        value = await self._read(self.key_builder.build(key, "state"))
+        return value and value.decode('utf-8')
+
+    def _data_ttl(self, key: StorageKey, data: Dict[str, Any]) -> Optional[int]:
+        if not key.destiny.startswith(DIALOG_DESTINY_PREFIX):
+            return self.data_ttl
+        batch = _batch.get()
+        batched = batch is not None and not batch.closed
+        if key.destiny.startswith(CONTEXT_DESTINY_PREFIX):
+            intent_id = data.get('_intent_id')
+            finished = data.get('state') in self.finished_states
+            if batched:
+                if finished:
+                    batch.finished_intents.add(intent_id)
+            elif finished:
+                self._finished_intents[intent_id] = True
+            else:
+                self._finished_intents.pop(intent_id, None)
+            return self.finished_dialog_ttl if finished else self.dialog_ttl
+        if key.destiny.startswith(STACK_DESTINY_PREFIX) and not batched:
+            # batch() sets it once the update is done
+            intents = data.get('intents')
+            if intents and intents[-1] in self._finished_intents:
+                return self.finished_dialog_ttl
+        return self.dialog_ttl
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        index_key = self._index_key(key) if key.destiny.startswith(DIALOG_DESTINY_PREFIX) else None
+        value = self.serializer.dumps(data) if data else None
+        await self._write(self.key_builder.build(key, "data"), value, self._data_ttl(key, data), index_key)
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        value = await self._read(self.key_builder.build(key, "data"))
+        if value is None:
+            return {}
+        return self.serializer.loads(value)
+
+    async def clean_dialogs(self, bot: Bot, chat_id: int, user_id: int) -> None:
+        index_key = self._index_key(StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id))
+        keys = await self.redis.smembers(index_key)
+        await self.redis.unlink(index_key, *keys)
+        self._top_intents.pop((chat_id, user_id), None)
+
+        batch = _batch.get()
+        if batch is not None and not batch.closed:
+            # forget what the update has read or is about to write
+            for redis_key, (_, _, dirty_index_key) in list(batch.dirty.items()):
+                if dirty_index_key == index_key:
+                    del batch.dirty[redis_key]
+            dialogs_prefix = index_key[:index_key.index(INDEX_DESTINY)] + DIALOG_DESTINY_PREFIX
+            for redis_key in batch.values:
+                if redis_key.startswith(dialogs_prefix):
+                    batch.values[redis_key] = None
@@ -1,20 +1,18 @@
 import logging
-import logging
+import re
 import typing
 from collections import namedtuple
-from io import BytesIO
+from functools import lru_cache
 
 from aiogram import types
 from aiogram.types import Message
-from emoji import demojize, emojize
-
-from app import config
-from bot_loader import bot
+from app.bot_loader import bot
+from app.loader import storage
 
 FSM_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 MEDIA = [types.ContentType.DOCUMENT, types.ContentType.PHOTO, types.ContentType.VIDEO]
 
-Forwarder = namedtuple("Forwarder", "content_type, aio_type, sender, spoilering")
+Forwarder = namedtuple("Forwarder", "aio_type, content_type, sender, spoilering")
 
 ALL_MEDIA = {types.ContentType.PHOTO    : Forwarder(types.InputMediaPhoto,
                                                     types.ContentType.PHOTO,
@@ -29,7 +27,7 @@ ALL_MEDIA = {types.ContentType.PHOTO    : Forwarder(types.InputMediaPhoto,
              types.ContentType.DOCUMENT : Forwarder(types.InputMediaDocument,
                                                     types.ContentType.DOCUMENT,
                                                     bot.send_document,
-                                                    Forwarder,
+                                                    False,
                                                     ),
              types.ContentType.ANIMATION: Forwarder(types.InputMediaAnimation,
                                                     types.ContentType.ANIMATION,
@@ -45,50 +43,79 @@ def extract_special_command(message_text):
     emj = extract_emojis(message_text)
     if not emj:
         return
+    from emoji import emojize
     return emojize(emj[0])
 
 
-def extract_emojis(message_text):
-    def is_emoji(command):
-        return demojize(command).startswith(':') and demojize(command).endswith(':')
-
-    def gen_emoji():
-        if message_text:
-            for command in message_text.split():
-                if is_emoji(command):
-                    yield demojize(command)
-
-    return list(gen_emoji())
+VARIATION_SELECTORS = '\ufe0e\ufe0f'
+
+
+@lru_cache(maxsize=None)
+def _emoji_table():
+    # the emoji package is imported on the first message, not on start
+    from emoji import EMOJI_DATA
+
+    # shortcode of every emoji sequence and every prefix of one, to walk words as emoji.demojize does
+    names = {emj: data['en'] for emj, data in EMOJI_DATA.items()}
+    prefixes = frozenset(emj[:end] for emj in names for end in range(1, len(emj) + 1))
+
+    # characters an emoji can start with, any character of an emoji;
+    # both with the shortcode delimiter
+    starts = frozenset(emj[0] for emj in names) | {':'}
+    chars = frozenset(''.join(names)) | {':'}
+
+    # whole words starting with a cheap superset of `starts`, to scan messages with:
+    # latin-1 characters one by one and a single range for the rest
+    low = sorted(char for char in starts if char <= '\xff')
+    high = [char for char in starts if char > '\xff']
+    scanner = re.compile('[' + ''.join(map(re.escape, low)) + f'{re.escape(min(high))}-{re.escape(max(high))}]'
+                         r'(?<!\S.)\S*')
+    return names, prefixes, starts, chars, scanner
+
+
+@lru_cache(maxsize=4096)
+def _demojize_command(command):
+    # emoji.demojize(command) off the table if it is all emoji and shortcodes, else None
+    names, prefixes, starts, chars, _ = _emoji_table()
+    if command in names:
+        return names[command]
+
+    # demojized command can start and end with ':' only if these characters can
+    edges = command.strip(VARIATION_SELECTORS)
+    if not edges or edges[0] not in starts or edges[-1] not in chars:
+        return None
+
+    # the longest run of an emoji prefix is replaced if it is an emoji, as emoji.demojize does
+    demojized, i, length = [], 0, len(command)
+    while i < length:
+        char = command[i]
+        if char in prefixes:
+            j = i + 1
+            while j < length and command[i:j + 1] in prefixes:
+                j += 1
+            if command[i:j] in names:
+                demojized.append(names[command[i:j]])
+                i = j
+                continue
+        if char not in VARIATION_SELECTORS:
+            demojized.append(char)
+        i += 1
+    demojized = ''.join(demojized)
+    return demojized if demojized.startswith(':') and demojized.endswith(':') else None
 
 
-def contains(message_text, text=typing.Union[typing.List[str], str], ignore_case=True):
+def extract_emojis(message_text):
     if not message_text:
-        return False
+        return []
 
-    if ignore_case:
-        message_text = message_text.lower()
-
-    if isinstance(text, typing.List):
-        for text_item in text:
-
-            if ignore_case:
-                text_item = text_item.lower()
-
-            if text_item in message_text:
-                return True
-        return False
-
-    if ignore_case:
-        text = text.lower()
-    return text in message_text
+    # one regex pass finds the commands that can be emoji, most messages have none
+    scanner = _emoji_table()[-1]
+    return [emj for emj in map(_demojize_command, scanner.findall(message_text)) if emj]
 
 
 async def clean_user_fsm(user_id):
     chat_id = user_id
-    import redis
-    r = redis.Redis().from_url(config.REDIS_URL)
-    for key in r.scan_iter(f"fsm:{chat_id}:{user_id}:aiogd*"):
-        r.delete(key)
+    await storage.clean_dialogs(bot, chat_id=chat_id, user_id=user_id)
 
 
 def get_content_type_and_file_id_from_message(m: types.Message, allowed_types: typing.Iterable):
@@ -101,16 +128,13 @@ def get_content_type_and_file_id_from_message(m: types.Message, allowed_types: t
     return content_type, file_id
 
 
-async def get_photo_from_message(m: types.Message):
-    pic_io = BytesIO()
+def get_message_url(chat_id, message_id):
+    chat_id = int(chat_id)
+    if chat_id > 0:
+        return None
 
-    file_id = get_id_from_message(m)
-    if m.content_type != types.ContentType.PHOTO:
-        file_id = None
-
-    if file_id:
-        await bot.download_file_by_id(file_id=file_id, destination=pic_io)
-        return pic_io
+    shifted_id = abs(chat_id) - 1_000_000_000_000
+    return f"https://t.me/c/{shifted_id}/{message_id}"
 
 
 def get_id_from_message(m: types.Message):
@@ -126,3 +150,18 @@ def get_id_from_message(m: types.Message):
         file_id = None
 
     return file_id
+
+
+def get_unique_id_from_message(m: types.Message):
+    if m.content_type == types.ContentType.DOCUMENT:
+        file_unique_id = m.document.file_unique_id
+    elif m.content_type == types.ContentType.PHOTO:
+        file_unique_id = m.photo[-1].file_unique_id
+    elif m.content_type == types.ContentType.VIDEO:
+        file_unique_id = m.video.file_unique_id
+    elif m.content_type == types.ContentType.ANIMATION:
+        file_unique_id = m.animation.file_unique_id
+    else:
+        file_unique_id = None
+
+    return file_unique_id
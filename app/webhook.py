@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from app import config
+from app.bot_loader import bot
+from app.loader import dp
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class AnonRequestHandler(SimpleRequestHandler):
+    def __init__(self, *args, secret_token=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.secret_token = secret_token
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            logger.warning("Webhook request with wrong secret token from %s", request.remote)
+            return web.Response(status=401)
+        return await super().handle(request)
+
+    async def close(self) -> None:
+        # bot session is closed by app.__main__
+        pass
+
+
+async def on_startup(app: web.Application):
+    url = f"{config.WEBHOOK_URL.rstrip('/')}{config.WEBHOOK_PATH}"
+    await bot.set_webhook(url, secret_token=config.WEBHOOK_SECRET)
+    logger.info("Webhook is set to %s", url)
+
+
+def build_app() -> web.Application:
+    app = web.Application()
+    # Updates are acknowledged right away and handled in background tasks
+    handler = AnonRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True,
+                                 secret_token=config.WEBHOOK_SECRET)
+    handler.register(app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def start_webhook():
+    if not config.WEBHOOK_URL:
+        raise RuntimeError('WEBHOOK_URL is required for webhook mode')
+
+    app = build_app()
+    # on the app, not the dispatcher: a restart builds a new one
+    app.on_startup.append(on_startup)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
+    await site.start()
+    logger.info("Listening for updates on %s:%s%s", config.WEBAPP_HOST, config.WEBAPP_PORT, config.WEBHOOK_PATH)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
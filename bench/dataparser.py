@@ -0,0 +1,126 @@
+"""
+Cost of the dialog_data views getters and handlers use: the DataParser that copied the whole of
+dialog_data onto itself on every attribute read and write, and the slotted one read once per update.
+A render is what an update does with PostCardData: `getter` and a handler register it and read or
+set its fields, repeated for dialog_data holding --extra keys of other widgets and dialogs besides:
+
+    python -m bench.dataparser [--renders 20000] [--extra 0 20 100]
+"""
+import argparse
+import os
+import time
+import typing
+from contextlib import suppress
+from dataclasses import dataclass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=20_000)
+    parser.add_argument('--extra', type=int, nargs='+', default=[0, 20, 100])
+    return parser.parse_args()
+
+
+@dataclass
+class OldDataParser:
+    # app.dataparser.DataParser before it was slotted
+    dialog_error = ''
+    dialog_manager: typing.Any = None
+
+    @classmethod
+    def register(cls, dialog_manager):
+        inst = cls()
+        inst.dialog_manager = dialog_manager
+        inst._fetch()
+        return inst
+
+    def _fetch(self, data=None):
+        dialog_data = None
+
+        if not self.dialog_manager:
+            if data:
+                dialog_data = data
+        else:
+            dialog_data = self.dialog_manager.dialog_data
+
+        if dialog_data is not None:
+            for key, value in dialog_data.items():
+                with suppress(Exception):
+                    super().__setattr__(key, value)
+
+    def __getattr__(self, item):
+        self._fetch()
+        try:
+            return super().__getattribute__(item)
+        except AttributeError:
+            return None
+
+    def __setattr__(self, key, value):
+        if key != 'dialog_manager':
+            self._fetch()
+
+            if self.dialog_manager:
+                self.dialog_manager.dialog_data[key] = value
+        super().__setattr__(key, value)
+
+
+@dataclass
+class OldPostCardData(OldDataParser):
+    user_id: typing.Optional[int] = None
+    username: typing.Optional[str] = None
+    reply_message_id: typing.Optional[int] = None
+    draft_parts: int = 0
+    draft_media: int = 0
+    draft_chars: int = 0
+    part_id: typing.Optional[int] = None
+    content_author: typing.Optional[str] = None
+    sent_url: typing.Optional[str] = None
+    queued: typing.Optional[bool] = None
+    scheduled: typing.Optional[str] = None
+
+
+class Manager:
+    """What DataParser uses of a DialogManager; middleware_data is new for every update"""
+
+    def __init__(self, dialog_data: dict):
+        self.dialog_data = dialog_data
+        self.middleware_data = {}
+
+
+def render(parser, manager: Manager):
+    # get.getter
+    data = parser.register(manager)
+    shown = (data.content_author, data.draft_media, data.draft_parts, data.username, data.dialog_error)
+    # get.postcard_data after the draft grew
+    data = parser.register(manager)
+    data.draft_parts, data.draft_media, data.draft_chars = data.draft_parts + 1, data.draft_media, 120
+    data.dialog_error = ''
+    # get.getter for the redraw
+    data = parser.register(manager)
+    return shown, data.content_author, data.draft_media, data.draft_parts, data.username, data.dialog_error
+
+
+def timed(parser, dialog_data: dict, renders: int) -> float:
+    started = time.perf_counter()
+    for _ in range(renders):
+        render(parser, Manager(dialog_data))
+    return (time.perf_counter() - started) / renders
+
+
+def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': 'redis://localhost:6379/0'})
+    from app.dialogs.main.parsers import PostCardData
+
+    for extra in args.extra:
+        dialog_data = {'content_author': '#моё', 'draft_parts': 2, 'draft_media': 1, 'draft_chars': 80,
+                       'dialog_error': '', 'anon_rendered': [1, 'digest', True]}
+        dialog_data.update((f'other_{i}', i) for i in range(extra))
+        before = timed(OldPostCardData, dict(dialog_data), args.renders)
+        after = timed(PostCardData, dict(dialog_data), args.renders)
+        print(f"{len(dialog_data):>4} keys in dialog_data: before {before * 1e6:7.1f} µs, "
+              f"after {after * 1e6:5.1f} µs a render ({before / after:.0f}x)")
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,94 @@
+"""
+Cost of the duplicate post check: fingerprinting a post and the claim round trip,
+on an empty index and on one holding --index posts:
+
+    python -m bench.dedup [--redis-url redis://localhost:6379/15] [--index 100000]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import timeit
+
+FILE_UNIQUE_ID = "AQADaccxG06t4Et-"
+POSTS = {
+    "short text": ("Всем привет! Кто идёт на встречу в субботу?", []),
+    "long text": ("Длинный пост про жизнь, работу и котиков. " * 95, []),
+    "photo": ("Закат на море 🌅", [FILE_UNIQUE_ID]),
+    "album": ("Закат на море 🌅", [f"{FILE_UNIQUE_ID}{i}" for i in range(10)]),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis, the database is flushed')
+    parser.add_argument('--index', type=int, default=100_000, help='posts in the filled index')
+    parser.add_argument('--claims', type=int, default=5000)
+    return parser.parse_args()
+
+
+def bench_fingerprint():
+    from app.dedup import fingerprint
+
+    for name, (text, unique_ids) in POSTS.items():
+        number, total = timeit.Timer(lambda: fingerprint(text, unique_ids)).autorange()
+        print(f"fingerprint {name:<11} {total / number * 1e6:7.2f} µs")
+
+
+async def fill(redis, count: int):
+    from app.dedup import PREFIX, fingerprint
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(count):
+            pipe.set(f'{PREFIX}{fingerprint(str(i), [])}', b'sent:https://t.me/c/1/1', ex=600)
+            if len(pipe) == 10_000:
+                await pipe.execute()
+        await pipe.execute()
+
+
+async def timed_claims(dedup, posts) -> str:
+    timings = []
+    for post in posts:
+        started = time.perf_counter()
+        await dedup.claim(post, 1, 1)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return (f"p50 {statistics.median(timings) * 1e6:6.0f} µs, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e6:6.0f} µs")
+
+
+async def bench_claims(args, redis):
+    from app.dedup import PREFIX, DedupIndex, fingerprint
+
+    dedup = DedupIndex(redis, window=600)
+    for size in (0, args.index):
+        await redis.flushdb()
+        await fill(redis, size)
+        new = [fingerprint(f'new {size} {i}', []) for i in range(args.claims)]
+        print(f"index of {size:>7} posts: new post   {await timed_claims(dedup, new)}")
+        print(f"index of {size:>7} posts: duplicate  {await timed_claims(dedup, new)}")
+
+    if args.redis_url:
+        key = f'{PREFIX}{fingerprint("0", [])}'
+        print(f"memory per indexed post: {await redis.memory_usage(key)} bytes")
+    await redis.flushdb()
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': args.redis_url or 'redis://localhost:6379/0'})
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url)
+    else:
+        from fakeredis.aioredis import FakeRedis
+        redis = FakeRedis()
+
+    bench_fingerprint()
+    await bench_claims(args, redis)
+    await redis.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
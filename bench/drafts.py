@@ -0,0 +1,131 @@
+"""
+Adding a part to a draft as it grows: latency and bytes over the wire of `Drafts.add`,
+and of keeping the parts in a list read and written whole, as a draft in dialog_data would be:
+
+    python -m bench.drafts [--redis-url redis://localhost:6379/15] [--sizes 1,10,100,1000] [--adds 200]
+
+The caps are lifted so that the draft can grow past the configured ones.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+USER_ID = 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis, the database is flushed')
+    parser.add_argument('--sizes', default='1,10,100,1000', help='parts in the draft, comma separated')
+    parser.add_argument('--adds', type=int, default=200, help='parts added at every size')
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    return args
+
+
+class WireCounter:
+    """Bytes of the arguments sent and of the replies got, for single commands"""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+
+    def install(self):
+        from redis.asyncio.client import Redis
+
+        execute_command = Redis.execute_command
+        counter = self
+
+        async def counted_command(self, *args, **options):
+            counter.sent += sum(len(arg if isinstance(arg, bytes) else str(arg).encode()) for arg in args)
+            reply = await execute_command(self, *args, **options)
+            counter.received += sum(len(item if isinstance(item, bytes) else str(item).encode())
+                                    for item in (reply if isinstance(reply, list) else [reply]) if item is not None)
+            return reply
+
+        Redis.execute_command = counted_command
+
+
+def part(i: int):
+    from app.drafts import Part
+    return Part('text', text=f'Часть {i}: ' + 'слово ' * 30)
+
+
+async def add_to_list(redis, new):
+    # the draft as a list kept with the dialog: read whole, one part appended, written whole
+    key = f'bench:draft:list:{USER_ID}'
+    parts = json.loads(await redis.get(key) or '[]')
+    parts.append(list(new))
+    await redis.set(key, json.dumps(parts, ensure_ascii=False, separators=(',', ':')))
+
+
+async def measure(args, counter, add, fill, shrink):
+    for size in args.sizes:
+        await fill(size)
+        timings, sent, received = [], 0, 0
+        for i in range(args.adds):
+            new = part(size + i)
+            counter.sent = counter.received = 0
+            started = time.perf_counter()
+            await add(new)
+            timings.append(time.perf_counter() - started)
+            sent += counter.sent
+            received += counter.received
+            # back to `size` parts for the next one
+            await shrink()
+        timings.sort()
+        print(f"  {size:>5} parts: p50 {statistics.median(timings) * 1e6:6.0f} µs, "
+              f"p99 {timings[int(len(timings) * 0.99)] * 1e6:6.0f} µs, "
+              f"{sent / args.adds:8.0f} bytes sent, {received / args.adds:8.0f} received per add")
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': args.redis_url or 'redis://localhost:6379/0'})
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url)
+    else:
+        from fakeredis.aioredis import FakeRedis
+        redis = FakeRedis()
+    await redis.flushdb()
+
+    from app.drafts import Drafts
+    drafts = Drafts(redis, max_parts=10 ** 6, max_media=10 ** 6, max_chars=10 ** 9, ttl=3600)
+    counter = WireCounter()
+    counter.install()
+
+    async def fill_hash(size):
+        await drafts.clear(USER_ID)
+        for start in range(0, size, 100):
+            await drafts.add(USER_ID, [part(i) for i in range(start, min(size, start + 100))])
+
+    async def shrink_hash():
+        last = (await drafts.parts(USER_ID))[-1][0]
+        await drafts.remove(USER_ID, last)
+
+    print("hash, Drafts.add:")
+    await measure(args, counter, lambda new: drafts.add(USER_ID, [new]), fill_hash, shrink_hash)
+
+    list_key = f'bench:draft:list:{USER_ID}'
+
+    async def fill_list(size):
+        await redis.set(list_key, json.dumps([list(part(i)) for i in range(size)], ensure_ascii=False,
+                                             separators=(',', ':')))
+
+    async def shrink_list():
+        parts = json.loads(await redis.get(list_key))
+        await redis.set(list_key, json.dumps(parts[:-1], ensure_ascii=False, separators=(',', ':')))
+
+    print("list read and written whole:")
+    await measure(args, counter, lambda new: add_to_list(redis, new), fill_list, shrink_list)
+
+    await redis.flushdb()
+    await redis.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
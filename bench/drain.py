@@ -0,0 +1,239 @@
+"""
+Lost and duplicated posts when the bot is stopped under load. Synthetic users keep
+posting unique texts while the bot, a child process, is stopped every --interval
+seconds and started again; afterwards every post a user sent is looked for in the chat:
+
+    python -m bench.drain [--signal term|kill] [--redis-url redis://localhost:6379/15]
+
+The Bot API stand-in keeps updates until getUpdates confirms them, as Telegram does,
+and the bot records every update it handled, so updates lost or handled twice are
+counted as well. Duplicate post detection is off in the bot, it would hide the latter.
+Needs a real Redis shared by the runs of the bot, its database is flushed.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import re
+import signal
+import sys
+import time
+from collections import Counter
+from contextlib import suppress
+from pathlib import Path
+
+from bench.e2e import CHAT_ID, Users
+from bench.fake_api import FakeBotAPI
+
+ROOT = Path(__file__).absolute().parent.parent
+TOKEN = re.compile(r'post-\d+-\d+')
+QUEUE_KEY = 'anon:send:queue'
+# a processing list per run of the bot
+PROCESSING_KEYS = 'anon:send:processing:*'
+HANDLED_KEY = 'bench:handled'
+QUEUED_KEY = 'bench:queued'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between stops of the bot')
+    parser.add_argument('--signal', choices=('term', 'kill'), default='term')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='seconds every Bot API call takes')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--api-port', type=int, default=8086)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def child():
+    """The bot, recording the id of every update it handled and the text of every post it queued"""
+    from app import __main__ as entry
+    from app.loader import dp, storage
+    from app.sender import send_queue
+
+    async def record(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            # dialog background updates are all 0
+            if event.update_id:
+                await storage.redis.rpush(HANDLED_KEY, event.update_id)
+
+    setup_dispatcher = entry.setup_dispatcher
+
+    async def recording_dispatcher():
+        registry = await setup_dispatcher()
+        dp.update.outer_middleware(record)
+        return registry
+
+    put = send_queue.put
+
+    async def recording_put(job):
+        await put(job)
+        await storage.redis.rpush(QUEUED_KEY, job.get('text') or '')
+
+    entry.setup_dispatcher = recording_dispatcher
+    send_queue.put = recording_put
+    asyncio.run(entry.main())
+
+
+class DrainAPI(FakeBotAPI):
+    """Keeps updates until getUpdates is called with an offset past them and records posts in the chat"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backlog = []
+        self.arrived = asyncio.Event()
+        self.posts = Counter()
+        self.versions = Counter()
+
+    async def push(self, update: dict):
+        self.backlog.append(update)
+        self.arrived.set()
+
+    async def _get_updates(self, data):
+        offset = int(data.get('offset') or 0)
+        self.backlog = [update for update in self.backlog if update['update_id'] >= offset]
+        if not self.backlog:
+            self.arrived.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.arrived.wait(), float(data.get('timeout') or 0) or 0.01)
+        return self.backlog[:int(data.get('limit') or 100)]
+
+    def _remember_keyboard(self, data, message_id):
+        super()._remember_keyboard(data, message_id)
+        if data.get('reply_markup') and 'chat_id' in data:
+            self.versions[int(data['chat_id'])] += 1
+
+    async def result(self, method, data):
+        if method == 'sendmessage' and int(data['chat_id']) == CHAT_ID:
+            self.posts.update(TOKEN.findall(data.get('text', '')))
+        return await super().result(method, data)
+
+
+class Load:
+    def __init__(self, api: DrainAPI, users: int):
+        self.api = api
+        self.users = Users(api)
+        self.count = users
+        self.submitted = set()
+        self.stalled = 0
+        self.running = True
+
+    async def _wait(self, done, timeout=10.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while not done():
+            if time.monotonic() > deadline:
+                self.stalled += 1
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def _step(self, uid, update) -> bool:
+        """Delivers the update and waits for the bot to answer with a keyboard"""
+        if update is None:
+            return False
+        version = self.api.versions[uid]
+        await self.api.push(update)
+        return await self._wait(lambda: self.api.versions[uid] > version)
+
+    async def user(self, uid):
+        # the dialog that reports a sent post takes the next one, /menu is throttled
+        await self._step(uid, self.users.command(uid, '/menu'))
+        for n in itertools.count():
+            if not self.running:
+                return
+            token = f'post-{uid}-{n}'
+            if not await self._step(uid, self.users.text(uid, f'{token} 👋')):
+                continue
+            click = self.users.click(uid, 'Отправляем')
+            if click is None:
+                continue
+            self.submitted.add(token)
+            version = self.api.versions[uid]
+            # the keyboard changes once more when the post is out, the next post mustn't take it for its answer
+            if await self._step(uid, click) and await self._wait(lambda: token in self.api.posts):
+                await self._wait(lambda: self.api.versions[uid] >= version + 2)
+
+    async def run(self, duration: float):
+        users = [asyncio.create_task(self.user(uid)) for uid in range(10000, 10000 + self.count)]
+        await asyncio.sleep(duration)
+        self.running = False
+        await asyncio.gather(*users)
+
+
+async def start_bot(args, api: DrainAPI):
+    env = dict(os.environ, BOT_TOKEN='42:BENCH', TELEGRAM_API_URL=api.url, CHAT_ID=str(CHAT_ID),
+               CHAT_NAME='bench', BOT_NAME='anon_bench_bot', REDIS_URL=args.redis_url,
+               SEND_RATE_PER_MINUTE='1000000', SEND_BURST='1000', DEDUP_WINDOW='0', POLLING_TIMEOUT='1',
+               RESTART_DELAY='0', SWEEP_INTERVAL='0', METRICS_PORT='0', LOG_LEVEL='ERROR', PYTHONPATH=str(ROOT))
+    env.pop('SENTRY_DSN', None)
+    return await asyncio.create_subprocess_exec(sys.executable, '-m', 'bench.drain', '--child', cwd=ROOT, env=env)
+
+
+async def stop_bot(process, sig) -> float:
+    started = time.monotonic()
+    process.send_signal(sig)
+    await process.wait()
+    return time.monotonic() - started
+
+
+async def main(args):
+    from redis.asyncio import Redis
+    redis = Redis.from_url(args.redis_url)
+    await redis.flushdb()
+
+    api = DrainAPI(port=args.api_port, latency=args.api_latency)
+    await api.start()
+    load = Load(api, args.users)
+    process = await start_bot(args, api)
+    stop_signal = signal.SIGKILL if args.signal == 'kill' else signal.SIGTERM
+
+    async def restarts():
+        nonlocal process
+        stops = []
+        while True:
+            await asyncio.sleep(args.interval)
+            stops.append(await stop_bot(process, stop_signal))
+            process = await start_bot(args, api)
+            print(f"stop {len(stops)}: {args.signal} took {stops[-1] * 1000:.0f} ms", flush=True)
+
+    restarting = asyncio.create_task(restarts())
+    await load.run(args.duration)
+    restarting.cancel()
+    with suppress(asyncio.CancelledError):
+        await restarting
+
+    # whatever is left in the backlog and the send queue goes out before the last stop
+    while api.backlog or any([await redis.llen(key) for key in [QUEUE_KEY, *await redis.keys(PROCESSING_KEYS)]]):
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1)
+    await stop_bot(process, signal.SIGTERM)
+    await api.stop()
+    handled = Counter(int(update_id) for update_id in await redis.lrange(HANDLED_KEY, 0, -1))
+    queued = set(TOKEN.findall(b' '.join(await redis.lrange(QUEUED_KEY, 0, -1)).decode()))
+    await redis.close()
+
+    pushed = next(load.users.update_ids) - 1
+    sent = api.posts
+    lost = load.submitted - set(sent)
+    duplicated = [token for token, count in sent.items() if count > 1]
+    print(f"users={args.users} duration={args.duration:.0f}s stop every {args.interval:.0f}s "
+          f"by SIG{args.signal.upper()} api_latency={args.api_latency * 1000:.0f}ms")
+    print(f"updates pushed:   {pushed}, lost {pushed - len(handled)}, "
+          f"handled twice {sum(count > 1 for count in handled.values())}")
+    print(f"posts submitted:  {len(load.submitted)}")
+    print(f"posts in chat:    {len(sent)}")
+    print(f"lost:             {len(lost)}, {len(lost - queued)} of them never queued")
+    print(f"duplicated:       {len(duplicated)}")
+    print(f"stalled steps:    {load.stalled}, missed clicks: {sum(load.users.missed.values())}")
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child:
+        child()
+    else:
+        asyncio.run(main(arguments))
@@ -0,0 +1,285 @@
+"""
+End-to-end throughput benchmark.
+
+Runs the real dispatcher, dialogs, middlewares and send queue against an in-process
+Bot API stand-in and drives synthetic users through the posting flow:
+
+    python -m bench.e2e --users 200 --mode polling
+    python -m bench.e2e --users 200 --mode webhook --redis-url redis://localhost:6379/15
+
+Without --redis-url the bot runs on fakeredis (pip install -r bench/requirements.txt).
+The --redis-url database is flushed before the run.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from bench.fake_api import FakeBotAPI
+
+ROOT = Path(__file__).resolve().parent.parent
+CHAT_ID = -1001234567890
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='synthetic users running at the same time')
+    parser.add_argument('--mode', choices=('direct', 'polling', 'webhook'), default='direct',
+                        help='how updates get into the dispatcher')
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds every Bot API call takes')
+    parser.add_argument('--no-storage-batch', action='store_true',
+                        help='make a Redis round trip for every storage read and write')
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--webhook-port', type=int, default=8082)
+    return parser.parse_args()
+
+
+def configure(args):
+    """Settings have to be in place before the first `import app`"""
+    os.environ.update({
+        'BOT_TOKEN': '42:BENCH',
+        'TELEGRAM_API_URL': f'http://127.0.0.1:{args.api_port}',
+        'REDIS_URL': args.redis_url or 'redis://localhost:6379/0',
+        'CHAT_ID': str(CHAT_ID),
+        'CHAT_NAME': 'bench',
+        'BOT_NAME': 'anon_bench_bot',
+        'SEND_RATE_PER_MINUTE': '1000000',
+        'SEND_BURST': '1000',
+        'UPDATES_MODE': 'webhook' if args.mode == 'webhook' else 'polling',
+        'WEBHOOK_URL': f'http://127.0.0.1:{args.webhook_port}',
+        'WEBAPP_HOST': '127.0.0.1',
+        'PORT': str(args.webhook_port),
+        'STORAGE_BATCH': '0' if args.no_storage_batch else '1',
+    })
+    os.environ.pop('SENTRY_DSN', None)
+    sys.path.insert(0, str(ROOT))
+
+
+class RedisCounter:
+    """Counts network round trips: a command or a whole pipeline is one"""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.commands = 0
+
+    def install(self):
+        from redis.asyncio.client import Redis, Pipeline
+
+        execute_command = Redis.execute_command
+        execute = Pipeline.execute
+        counter = self
+
+        async def counted_command(self, *args, **options):
+            counter.round_trips += 1
+            counter.commands += 1
+            return await execute_command(self, *args, **options)
+
+        async def counted_pipeline(self, *args, **kwargs):
+            counter.round_trips += 1
+            counter.commands += len(self.command_stack)
+            return await execute(self, *args, **kwargs)
+
+        Redis.execute_command = counted_command
+        Pipeline.execute = counted_pipeline
+
+
+class Recorder:
+    """Outer update middleware that measures the time from delivery to handled"""
+
+    def __init__(self):
+        self.pushed = {}
+        self.done = {}
+        self.latencies = []
+
+    def expect(self, update_id):
+        self.pushed[update_id] = time.perf_counter()
+        self.done[update_id] = asyncio.get_running_loop().create_future()
+        return self.done[update_id]
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            started = self.pushed.pop(event.update_id, None)
+            if started is not None:
+                self.latencies.append(time.perf_counter() - started)
+                self.done.pop(event.update_id).set_result(None)
+
+
+class Users:
+    """Builds updates the way Telegram would send them for a user talking to the bot"""
+
+    def __init__(self, api: FakeBotAPI):
+        self.api = api
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.missed = Counter()
+
+    def _user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": "user", "username": f"user{uid}"}
+
+    def message(self, uid, **fields):
+        message = {"message_id": next(self.message_ids), "date": int(time.time()),
+                   "chat": {"id": uid, "type": "private", "first_name": "user"}, "from": self._user(uid)}
+        message.update(fields)
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def command(self, uid, command):
+        return self.message(uid, text=command, entities=[{"type": "bot_command", "offset": 0,
+                                                          "length": len(command)}])
+
+    def text(self, uid, text):
+        return self.message(uid, text=text)
+
+    def photo(self, uid, caption):
+        file_id = f"photo{uid}-{next(self.message_ids)}"
+        return self.message(uid, caption=caption,
+                            photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}])
+
+    def poll(self, uid):
+        return self.message(uid, poll={
+            "id": str(next(self.message_ids)), "question": "Как дела?", "total_voter_count": 0,
+            "options": [{"text": "хорошо", "voter_count": 0}, {"text": "отлично", "voter_count": 0}],
+            "is_closed": False, "is_anonymous": True, "type": "regular", "allows_multiple_answers": False,
+        })
+
+    def click(self, uid, label):
+        """Presses the button containing `label` on the last keyboard the bot sent to the user"""
+        keyboard = self.api.keyboards.get(uid)
+        buttons = keyboard and [button for row in keyboard['markup']['inline_keyboard'] for button in row
+                                if label in button['text']]
+        if not buttons:
+            self.missed[label] += 1
+            return None
+
+        return {"update_id": next(self.update_ids), "callback_query": {
+            "id": str(next(self.message_ids)), "from": self._user(uid), "chat_instance": str(uid),
+            "data": buttons[0]['callback_data'],
+            "message": {"message_id": keyboard['message_id'], "date": int(time.time()),
+                        "chat": {"id": uid, "type": "private", "first_name": "user"},
+                        "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": keyboard['text'],
+                        "reply_markup": keyboard['markup']},
+        }}
+
+    def scenario(self, uid):
+        yield lambda: self.command(uid, '/menu')
+        yield lambda: self.text(uid, f'Привет от {uid} 👋')
+        yield lambda: self.click(uid, 'Отправляем')
+        yield lambda: self.photo(uid, 'закат')
+        yield lambda: self.click(uid, '#моё')
+        yield lambda: self.click(uid, 'Отправляем')
+        yield lambda: self.poll(uid)
+        yield lambda: self.click(uid, 'Отправляем')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1] if len(values) > 1 else values[0]
+
+
+async def run(args):
+    api = FakeBotAPI(port=args.api_port, latency=args.api_latency)
+    await api.start()
+
+    from app import __main__ as entry
+    from app.bot_loader import bot
+    from app.dedup import dedup
+    from app.drafts import drafts
+    from app.loader import dp, storage
+    from app.moderation import moderation
+    from app.polling import poller
+    from app.sanitizer import sanitizer
+    from app.sender import send_queue, QUEUE_KEY
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.redis_url:
+        await storage.redis.flushdb()
+    else:
+        from fakeredis.aioredis import FakeRedis
+        storage.redis = send_queue.redis = dedup.redis = sanitizer.redis = moderation.redis = drafts.redis = poller.redis = FakeRedis()
+
+    redis = RedisCounter()
+    redis.install()
+    recorder = Recorder()
+    registry = await entry.setup_dispatcher()
+    dp.update.outer_middleware(recorder)
+    await send_queue.start(registry)
+
+    if args.mode == 'polling':
+        await bot.delete_webhook()
+        poller.timeout = 1
+        ingress = asyncio.create_task(poller.run())
+    elif args.mode == 'webhook':
+        ingress = asyncio.create_task(entry.start_webhook())
+        while not api.webhook_url:
+            await asyncio.sleep(0.01)
+    else:
+        ingress = None
+
+    users = Users(api)
+
+    async def deliver(update):
+        handled = recorder.expect(update['update_id'])
+        if args.mode == 'direct':
+            await dp.feed_raw_update(bot, update)
+        else:
+            await api.push(update)
+        await handled
+
+    async def user(uid):
+        for build in users.scenario(uid):
+            update = build()
+            if update is not None:
+                await deliver(update)
+
+    api.calls.clear()
+    api.sent_to.clear()
+    round_trips, commands = redis.round_trips, redis.commands
+    started = time.perf_counter()
+    await asyncio.gather(*(user(uid) for uid in range(10000, 10000 + args.users)))
+    handled_in = time.perf_counter() - started
+
+    while await send_queue.size() or await send_queue.in_progress():
+        await asyncio.sleep(0.05)
+    # the send queue reports back to users with background dialog updates
+    while any(task.get_coro().__qualname__ == 'DialogRegistry._process_update' for task in asyncio.all_tasks()):
+        await asyncio.sleep(0.01)
+    drained_in = time.perf_counter() - started
+
+    updates = len(recorder.latencies)
+    print(f"mode={args.mode} users={args.users} redis={'real' if args.redis_url else 'fakeredis'} "
+          f"api_latency={args.api_latency * 1000:.0f}ms")
+    print(f"updates:            {updates} in {handled_in:.2f}s, {updates / handled_in:.1f} updates/s")
+    print(f"latency:            p50 {percentile(recorder.latencies, 50) * 1000:.1f}ms, "
+          f"p99 {percentile(recorder.latencies, 99) * 1000:.1f}ms")
+    print(f"posts in chat:      {api.sent_to[CHAT_ID]}, send queue drained in {drained_in:.2f}s")
+    print(f"redis per update:   {(redis.round_trips - round_trips) / updates:.1f} round trips, "
+          f"{(redis.commands - commands) / updates:.1f} commands")
+    print(f"bot api per update: {sum(api.calls.values()) / updates:.1f} calls "
+          f"({', '.join(f'{m} {n}' for m, n in api.calls.most_common(5))})")
+    print(f"max rss:            {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    if users.missed:
+        print(f"missed clicks:      {dict(users.missed)}")
+
+    if ingress:
+        ingress.cancel()
+        await asyncio.gather(ingress, return_exceptions=True)
+    await send_queue.stop()
+    await bot.session.close()
+    await api.stop()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    configure(arguments)
+    asyncio.run(run(arguments))
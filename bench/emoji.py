@@ -0,0 +1,112 @@
+"""
+Emoji detection in the text of a message: `extract_emojis` as it was, demojizing every word up to three
+times, against the current one over a corpus of chat messages. The corpus is either a file with one
+message per line or generated: short Russian and English chat lines, links, hashtags and shortcodes,
+--emoji-share of them carrying emoji, mostly one or two:
+
+    python -m bench.emoji [--messages 40000] [--emoji-share 0.1 0.5 1] [--corpus messages.txt]
+
+Results of both are compared, a mismatch is reported.
+"""
+import argparse
+import os
+import random
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=40_000, help='messages generated')
+    parser.add_argument('--emoji-share', type=float, nargs='+', default=[0.1, 0.5, 1.0],
+                        help='share of generated messages with emoji')
+    parser.add_argument('--corpus', help='file of messages, one a line, instead of generated ones')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args()
+
+
+def old_extract_emojis(message_text):
+    # app.utils.extract_emojis before the lookup tables
+    from emoji import demojize
+
+    def is_emoji(command):
+        return demojize(command).startswith(':') and demojize(command).endswith(':')
+
+    def gen_emoji():
+        if message_text:
+            for command in message_text.split():
+                if is_emoji(command):
+                    yield demojize(command)
+
+    return list(gen_emoji())
+
+
+WORDS = ('привет всем кто знает где купить нормальный кофе рядом с общагой вчера было очень весело '
+         'сегодня пары отменили завтра контрольная по матану кто идёт на концерт в субботу '
+         'ребята помогите пожалуйста найти потерянные наушники в столовой спасибо огромное '
+         'hello anyone going to the party tonight lol ok thanks see you').split()
+TAILS = ('', '', '', ',', '.', '!', '?', '...', ')', '))')
+EXTRAS = ('https://t.me/anon_chat/123', '#моё', '#вопрос', '@someone', '12:30', ':)', ':D', 'ахах:',
+          ':thumbs_up:', '2+2=4', '(нет)', '—')
+
+
+def generate(count: int, emoji_share: float, rng: random.Random):
+    from emoji import EMOJI_DATA
+
+    # mostly the everyday ones, some of anything else
+    everyday = ['😂', '❤️', '🔥', '👍', '😭', '🙏', '😊', '🥺', '✨', '🤔', '👀', '💀', '❤', '☺️', '🎉']
+    anything = sorted(EMOJI_DATA)
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) + rng.choice(TAILS) for _ in range(rng.randint(2, 25))]
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(EXTRAS))
+        if rng.random() < emoji_share:
+            for _ in range(rng.choice((1, 1, 1, 2, 2, 3))):
+                emj = rng.choice(everyday) if rng.random() < 0.8 else rng.choice(anything)
+                position = rng.randrange(len(words) + 1)
+                if rng.random() < 0.3 and position:
+                    # stuck to the word before it
+                    words[position - 1] += emj
+                else:
+                    words.insert(position, emj * rng.choice((1, 1, 1, 2, 3)))
+        messages.append(' '.join(words))
+    return messages
+
+
+def timed(extract, messages) -> float:
+    started = time.perf_counter()
+    for message in messages:
+        extract(message)
+    return time.perf_counter() - started
+
+
+def compare(name: str, messages):
+    from app.utils import extract_emojis
+
+    mismatches = sum(old_extract_emojis(message) != extract_emojis(message) for message in messages)
+    before = timed(old_extract_emojis, messages)
+    after = timed(extract_emojis, messages)
+    print(f"{name:<22} before {before / len(messages) * 1e6:6.1f} µs, after {after / len(messages) * 1e6:5.1f} µs "
+          f"a message ({before / after:4.1f}x), {mismatches} mismatches")
+
+
+def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': 'redis://localhost:6379/0'})
+    from app.utils import extract_emojis
+
+    # the lookup tables are built on first use
+    extract_emojis('👍')
+
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as corpus:
+            compare(args.corpus, [line.rstrip('\n') for line in corpus if line.strip()])
+        return
+
+    rng = random.Random(args.seed)
+    for share in args.emoji_share:
+        compare(f'{share:.0%} with emoji', generate(args.messages, share, rng))
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,171 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import ClientSession, web
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+CHUNK = 64 * 1024
+ZEROS = bytes(CHUNK)
+
+
+class FakeBotAPI:
+    """
+    In-process stand-in for the Telegram Bot API.
+
+    Answers the methods the bot uses with plausible results, serves getUpdates
+    from a queue (or pushes updates to a webhook) and remembers the last keyboard
+    every chat got, so synthetic users can click it
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081, latency=0.0, file_size=4, file_body: Optional[bytes] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # every file is `file_body` if given, `file_size` zero bytes otherwise
+        self.file_body = file_body
+        self.file_size = len(file_body) if file_body is not None else file_size
+        self.calls = Counter()
+        self.keyboards: Dict[int, dict] = {}
+        self.sent_to = Counter()
+        self.updates: Optional[asyncio.Queue] = None
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.flood_wait = 0
+        self._message_ids = itertools.count(1000)
+        self._runner = None
+        self._client = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        self.updates = asyncio.Queue()
+        # uploads are read into temporary files by aiohttp
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/file/bot{token}/{path:.*}', self.file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._client:
+            await self._client.close()
+        await self._runner.cleanup()
+
+    async def push(self, update: dict):
+        """Deliver an update the way Telegram would: to the webhook if one is set"""
+        if not self.webhook_url:
+            await self.updates.put(update)
+            return
+
+        if self._client is None:
+            self._client = ClientSession()
+        headers = {SECRET_HEADER: self.webhook_secret} if self.webhook_secret else {}
+        async with self._client.post(self.webhook_url, json=update, headers=headers) as response:
+            response.raise_for_status()
+
+    def message(self, chat_id, **fields):
+        chat_id = int(chat_id)
+        message = {"message_id": next(self._message_ids),
+                   "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                   "from": {"id": 1, "is_bot": True, "first_name": "bot"}}
+        message.update(fields)
+        return message
+
+    def _document(self, chat_id):
+        message = self.message(chat_id)
+        message['document'] = {"file_id": f"document{message['message_id']}",
+                               "file_unique_id": f"document{message['message_id']}"}
+        return message
+
+    def _remember_keyboard(self, data, message_id):
+        if data.get('reply_markup') and 'chat_id' in data:
+            # Telegram trims the text of a message
+            self.keyboards[int(data['chat_id'])] = {"message_id": message_id, "text": data.get('text', '...').strip(),
+                                                    "markup": json.loads(data['reply_markup'])}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        data = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.flood_wait and (method.startswith('send') or method == 'copymessage'):
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {self.flood_wait}",
+                                      "parameters": {"retry_after": self.flood_wait}})
+
+        if method.startswith('send') or method == 'copymessage':
+            self.sent_to[int(data['chat_id'])] += 1
+        result = await self.result(method, data)
+        return web.json_response({"ok": True, "result": result})
+
+    async def result(self, method, data):
+        if method == 'getme':
+            return {"id": 1, "is_bot": True, "first_name": "bot", "username": "anon_bench_bot"}
+        if method == 'getupdates':
+            return await self._get_updates(data)
+        if method == 'setwebhook':
+            self.webhook_url = data['url']
+            self.webhook_secret = data.get('secret_token')
+            return True
+        if method == 'deletewebhook':
+            self.webhook_url = None
+            return True
+        if method in ('sendmessage', 'editmessagetext'):
+            message = self.message(data['chat_id'], text=data.get('text', '').strip())
+            if method == 'editmessagetext':
+                message['message_id'] = int(data['message_id'])
+            self._remember_keyboard(data, message['message_id'])
+            return message
+        if method == 'copymessage':
+            return {"message_id": next(self._message_ids)}
+        if method == 'sendmediagroup':
+            return [self._document(data['chat_id']) if media['type'] == 'document'
+                    else self.message(data['chat_id'], photo=[_photo()]) for media in json.loads(data['media'])]
+        if method == 'senddocument':
+            return self._document(data['chat_id'])
+        if method in ('sendphoto', 'sendvideo', 'sendanimation'):
+            return self.message(data['chat_id'], photo=[_photo()])
+        if method == 'getfile':
+            return {"file_id": data['file_id'], "file_unique_id": data['file_id'],
+                    "file_size": self.file_size, "file_path": f"documents/{data['file_id']}.jpg"}
+        return True
+
+    async def _get_updates(self, data):
+        updates = []
+        timeout = float(data.get('timeout') or 0)
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return updates
+
+        limit = int(data.get('limit') or 100)
+        while not self.updates.empty() and len(updates) < limit:
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        """Serves `file_body` or streams `file_size` zero bytes without holding them in memory"""
+        if self.file_body is not None:
+            return web.Response(body=self.file_body)
+        response = web.StreamResponse(headers={'Content-Length': str(self.file_size)})
+        await response.prepare(request)
+        left = self.file_size
+        while left > 0:
+            await response.write(ZEROS[:min(left, CHUNK)])
+            left -= CHUNK
+        await response.write_eof()
+        return response
+
+
+def _photo():
+    return {"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}
@@ -0,0 +1,103 @@
+"""
+Dropping a user's dialogs with --keys other keys in Redis: the SCAN over the keyspace on a synchronous
+client that clean_user_fsm used to make, and `AnonRedisStorage.clean_dialogs` with its per-user index,
+while a ticker measures how long the event loop is blocked:
+
+    python -m bench.fsm_clean [--redis-url redis://localhost:6379/15] [--keys 1000000] [--users 5]
+
+Needs a real Redis, the database is flushed.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from bench.sanitize import LoopLag
+
+BOT_ID = 42
+# dialog keys a user has: the stack and a few contexts
+USER_KEYS = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15', help='the database is flushed')
+    parser.add_argument('--keys', type=int, default=1_000_000, help='keys of other users in the database')
+    parser.add_argument('--users', type=int, default=5, help='users whose dialogs are dropped')
+    return parser.parse_args()
+
+
+async def fill(redis, count: int):
+    # other users' dialogs, as DefaultKeyBuilder(with_destiny=True) names them
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(count):
+            user_id = 1_000_000 + i // USER_KEYS
+            pipe.set(f'fsm:{user_id}:{user_id}:aiogd:context:{i % USER_KEYS}:data', b'{}')
+            if len(pipe) >= 10_000:
+                await pipe.execute()
+        await pipe.execute()
+
+
+async def write_dialogs(storage, user_id: int):
+    from aiogram.fsm.storage.base import StorageKey
+
+    for i in range(USER_KEYS):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id, destiny=f'aiogd:context:{i}')
+        await storage.set_data(None, key, {'state': 'Main:menu'})
+
+
+def clean_by_scan(redis_url: str, user_id: int):
+    # clean_user_fsm before the index: a new synchronous client and a SCAN of the whole keyspace
+    import redis
+
+    chat_id = user_id
+    r = redis.Redis().from_url(redis_url)
+    for key in r.scan_iter(f"fsm:{chat_id}:{user_id}:aiogd*"):
+        r.delete(key)
+
+
+async def measure(name: str, users, clean, storage):
+    timings = []
+    for user_id in users:
+        await write_dialogs(storage, user_id)
+    with LoopLag(interval=0.001) as lag:
+        for user_id in users:
+            started = time.perf_counter()
+            await clean(user_id)
+            timings.append(time.perf_counter() - started)
+            # let the ticker see the stall
+            await asyncio.sleep(0.005)
+    left = sum([await storage.redis.exists(f'fsm:{user_id}:{user_id}:aiogd:context:{i}:data')
+                for user_id in users for i in range(USER_KEYS)])
+    print(f"{name:<14} p50 {statistics.median(timings) * 1000:8.2f} ms, max {max(timings) * 1000:8.2f} ms "
+          f"per user, worst loop lag {lag.worst * 1000:8.2f} ms, {left} keys left")
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': f'{BOT_ID}:BENCH', 'REDIS_URL': args.redis_url})
+    from aiogram.fsm.storage.redis import DefaultKeyBuilder
+    from redis.asyncio import Redis
+    from app.storage import AnonRedisStorage
+
+    redis = Redis.from_url(args.redis_url)
+    storage = AnonRedisStorage(redis, key_builder=DefaultKeyBuilder(with_destiny=True))
+    bot = type('Bot', (), {'id': BOT_ID})()
+    await redis.flushdb()
+
+    started = time.perf_counter()
+    await fill(redis, args.keys)
+    print(f"{await redis.dbsize()} keys written in {time.perf_counter() - started:.1f} s")
+
+    users = range(1, args.users + 1)
+    await measure('scan + delete', users, lambda user_id: asyncio.sleep(0, clean_by_scan(args.redis_url, user_id)),
+                  storage)
+    await measure('index', users, lambda user_id: storage.clean_dialogs(bot, user_id, user_id), storage)
+
+    await redis.flushdb()
+    await redis.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
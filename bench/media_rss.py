@@ -0,0 +1,74 @@
+"""
+Peak RSS of relaying media through the bot: N concurrent files of a given size are
+downloaded from a Bot API stand-in and uploaded back, either through BytesIO (how
+utils.get_photo_from_message used to do it) or streamed by app.media:
+
+    python -m bench.media_rss --files 50 --size-mb 20
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+
+from bench.fake_api import FakeBotAPI
+
+CHAT_ID = -1001234567890
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--size-mb', type=float, default=20)
+    parser.add_argument('--api-port', type=int, default=8083)
+    parser.add_argument('--worker', choices=('bytesio', 'stream'), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+async def relay(args):
+    """Runs in a child process, so that its peak RSS is not shared with the API stand-in"""
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'TELEGRAM_API_URL': f'http://127.0.0.1:{args.api_port}',
+                       'REDIS_URL': 'redis://localhost:6379/0', 'CHAT_ID': str(CHAT_ID),
+                       'MEDIA_MAX_SIZE': str(int(args.size_mb * 1024 * 1024) + 1)})
+    from aiogram.types import BufferedInputFile
+    from app.bot_loader import bot
+    from app.media import media_downloader
+
+    async def bytesio(file_id):
+        buffer = await bot.download(file_id)
+        await bot.send_video(CHAT_ID, BufferedInputFile(buffer.getvalue(), filename='video.mp4'))
+
+    async def stream(file_id):
+        async with media_downloader.open(file_id) as video:
+            await bot.send_video(CHAT_ID, video)
+
+    relay_one = bytesio if args.worker == 'bytesio' else stream
+    started = time.perf_counter()
+    await asyncio.gather(*(relay_one(f'video{i}') for i in range(args.files)))
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, elapsed)
+
+
+async def main(args):
+    api = FakeBotAPI(port=args.api_port, file_size=int(args.size_mb * 1024 * 1024))
+    await api.start()
+    print(f"{args.files} concurrent files of {args.size_mb:g} MB")
+    try:
+        for mode in ('bytesio', 'stream'):
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', 'bench.media_rss', '--worker', mode, '--files', str(args.files),
+                '--size-mb', str(args.size_mb), '--api-port', str(args.api_port),
+                stdout=asyncio.subprocess.PIPE)
+            output, _ = await process.communicate()
+            peak_rss, elapsed = map(float, output.decode().split()[-2:])
+            print(f"{mode:8} peak rss {peak_rss:7.1f} MiB in {elapsed:.1f}s, "
+                  f"{api.calls['sendvideo']} videos uploaded so far")
+    finally:
+        await api.stop()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    asyncio.run(relay(arguments) if arguments.worker else main(arguments))
@@ -0,0 +1,92 @@
+"""
+Overhead of the metrics middlewares on a dispatcher with one trivial handler:
+
+    python -m bench.metrics_overhead --updates 20000
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import GetMe
+from aiogram.types import Message, User
+
+from app import metrics
+
+
+class NullSession(BaseSession):
+    """Answers every request instantly without touching the network"""
+
+    async def make_request(self, bot, method, timeout=None):
+        return User(id=1, is_bot=True, first_name='bot')
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def build_dispatcher(instrumented: bool) -> Dispatcher:
+    dp = Dispatcher(storage=MemoryStorage())
+    router = Router()
+
+    @router.message()
+    async def echo(message: Message):
+        return message.text
+
+    dp.include_router(router)
+    if instrumented:
+        dp.update.outer_middleware(metrics.UpdateMetrics())
+        dp.message.middleware(metrics.HandlerMetrics())
+    return dp
+
+
+def update(update_id):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "hi",
+        "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "user"}}}
+
+
+async def feed(dp: Dispatcher, bot: Bot, updates) -> float:
+    started = time.perf_counter()
+    for raw in updates:
+        await dp.feed_raw_update(bot, raw)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def call(bot: Bot, count) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        await bot(GetMe())
+    return (time.perf_counter() - started) / count
+
+
+async def run(count, rounds):
+    updates = [update(i) for i in range(count)]
+    bots = {False: Bot('42:BENCH', session=NullSession()), True: Bot('42:BENCH', session=NullSession())}
+    bots[True].session.middleware(metrics.BotAPIMetrics())
+    dispatchers = {False: build_dispatcher(False), True: build_dispatcher(True)}
+
+    best = {}
+    for _ in range(rounds):
+        for instrumented in (False, True):
+            per_update = await feed(dispatchers[instrumented], bots[instrumented], updates)
+            per_call = await call(bots[instrumented], count)
+            old = best.get(instrumented, (per_update, per_call))
+            best[instrumented] = (min(old[0], per_update), min(old[1], per_call))
+
+    for i, name in enumerate(('update', 'bot api call')):
+        plain, instrumented = best[False][i] * 1e6, best[True][i] * 1e6
+        print(f"{name:13} plain {plain:7.1f}us  instrumented {instrumented:7.1f}us  "
+              f"overhead {instrumented - plain:5.1f}us ({(instrumented / plain - 1) * 100:.0f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=3)
+    arguments = parser.parse_args()
+    asyncio.run(run(arguments.updates, arguments.rounds))
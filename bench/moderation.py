@@ -0,0 +1,89 @@
+"""
+Matching posts against banned phrases: --messages posts against --patterns phrases with the
+automaton, folding included, and with a lowercase `in` scan per phrase as `utils.contains` did:
+
+    python -m bench.moderation [--messages 10000] [--patterns 5000]
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+SYLLABLES = ['ка', 'ро', 'ни', 'ла', 'ти', 'ме', 'со', 'ву', 'па', 'ды', 'ше', 'го', 'за', 'би', 'ло', 'му', 'ре', 'ха']
+# in banned phrases only, so that posts don't contain them by chance
+RARE_SYLLABLES = ['жу', 'щи', 'фэ', 'цо', 'юх', 'чё']
+# Cyrillic letters swapped for Latin lookalikes in some of the posts
+LOOKALIKES = str.maketrans('аеорсух', 'aeopcyx')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--patterns', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def word(rng: random.Random, rare: bool = False) -> str:
+    syllables = [rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))]
+    if rare:
+        syllables.insert(rng.randrange(len(syllables) + 1), rng.choice(RARE_SYLLABLES))
+    return ''.join(syllables)
+
+
+def generate(args):
+    """Patterns of one to three words, posts of 3 to 60 words, every tenth with a pattern in it"""
+    rng = random.Random(args.seed)
+    patterns = list(dict.fromkeys(' '.join(word(rng, rare=True) for _ in range(rng.randint(1, 3)))
+                                  for _ in range(args.patterns * 2)))
+    patterns = patterns[:args.patterns]
+    messages = []
+    for i in range(args.messages):
+        words = [word(rng) for _ in range(rng.randint(3, 60))]
+        if i % 10 == 0:
+            phrase = rng.choice(patterns)
+            words.insert(rng.randrange(len(words)), phrase.upper() if i % 20 else phrase.translate(LOOKALIKES))
+        messages.append(' '.join(words))
+    return patterns, messages
+
+
+def contains(message_text, patterns) -> bool:
+    # utils.contains before the automaton
+    message_text = message_text.lower()
+    for pattern in patterns:
+        if pattern.lower() in message_text:
+            return True
+    return False
+
+
+def timed(check, messages):
+    timings, found = [], 0
+    for message in messages:
+        started = time.perf_counter()
+        found += bool(check(message))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return (f"{sum(timings):6.2f} s, p50 {statistics.median(timings) * 1e6:8.1f} µs, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e6:8.1f} µs, {found} posts matched")
+
+
+def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': 'redis://localhost:6379/0'})
+    from app.moderation import Automaton, fold
+
+    patterns, messages = generate(args)
+    chars = sum(map(len, messages))
+    print(f"{len(messages)} posts of {chars // len(messages)} characters on average, {len(patterns)} patterns, "
+          f"{args.messages // 10} posts with a pattern, half of them in Latin lookalikes")
+
+    started = time.perf_counter()
+    automaton = Automaton(fold(pattern) for pattern in patterns)
+    print(f"automaton: built in {(time.perf_counter() - started) * 1000:.0f} ms, {len(automaton)} nodes")
+    print(f"automaton: {timed(lambda message: automaton.search(fold(message)), messages)}")
+    print(f"in scan:   {timed(lambda message: contains(message, patterns), messages)}")
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,124 @@
+"""
+Redis latency with --users concurrent users whose updates read and write their keys the way
+a batched update does (one MGET, one MULTI): steady, --updates updates a user --think seconds
+apart on average, and in bursts, every user at once. Compares the client the bot had,
+a pool failing past 256 connections, with the shared blocking pool:
+
+    python -m bench.redis_pool --redis-url redis://localhost:6379/15 [--unix-socket /tmp/redis.sock]
+
+Needs a real Redis, its database is flushed. Keep the steady load below what the machine
+can handle, past it the numbers measure the event loop rather than the pool.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from collections import Counter
+from typing import Tuple
+from urllib.parse import urlparse
+
+from redis.exceptions import ConnectionError
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--unix-socket', help='the same Redis on a unix socket')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--updates', type=int, default=10, help='updates per user')
+    parser.add_argument('--think', type=float, default=1, help='mean seconds between updates of a user')
+    parser.add_argument('--bursts', type=int, default=3)
+    parser.add_argument('--max-connections', type=int, default=64, help='REDIS_MAX_CONNECTIONS')
+    return parser.parse_args()
+
+
+async def update(redis, uid: int):
+    keys = [f'fsm:{uid}:{uid}:state', f'fsm:{uid}:{uid}:aiogd:stack::data', f'fsm:{uid}:{uid}:aiogd:context:x:data']
+    await redis.mget(keys)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.set(keys[1], b'x' * 120, ex=3600)
+        pipe.set(keys[2], b'x' * 600, ex=3600)
+        pipe.sadd(f'fsm:{uid}:{uid}:aiogd:index:keys', keys[1], keys[2])
+        pipe.expire(f'fsm:{uid}:{uid}:aiogd:index:keys', 3600)
+        await pipe.execute()
+
+
+async def timed_update(redis, uid: int, timings, errors: Counter):
+    started = time.perf_counter()
+    try:
+        await update(redis, uid)
+    except ConnectionError as e:
+        errors[str(e)] += 1
+    else:
+        timings.append(time.perf_counter() - started)
+
+
+async def steady_user(redis, uid: int, args, timings, errors: Counter):
+    for _ in range(args.updates):
+        await asyncio.sleep(random.expovariate(1 / args.think))
+        await timed_update(redis, uid, timings, errors)
+
+
+async def bursts(redis, args, timings, errors: Counter):
+    for _ in range(args.bursts):
+        await asyncio.gather(*(timed_update(redis, 10000 + i, timings, errors) for i in range(args.users)))
+        await asyncio.sleep(1)
+
+
+def pool_wait() -> Tuple[float, float]:
+    from app.metrics import REDIS_POOL_WAIT
+
+    samples = {sample.name: sample.value for sample in REDIS_POOL_WAIT.collect()[0].samples}
+    return samples['anon_redis_pool_wait_seconds_sum'], samples['anon_redis_pool_wait_seconds_count']
+
+
+async def run(name: str, redis, args, connections):
+    await redis.flushdb()
+    for load in ('steady', 'bursts'):
+        timings, errors = [], Counter()
+        wait_before, count_before = pool_wait()
+        started = time.perf_counter()
+        if load == 'steady':
+            await asyncio.gather(*(steady_user(redis, 10000 + i, args, timings, errors) for i in range(args.users)))
+        else:
+            await bursts(redis, args, timings, errors)
+        took = time.perf_counter() - started
+
+        timings.sort()
+        line = (f"{name:<32} {load:<6} {len(timings) / took:6.0f} updates/s, "
+                f"p50 {statistics.median(timings) * 1000:7.2f} ms, p99 {timings[int(len(timings) * 0.99)] * 1000:7.2f} ms, "
+                f"{connections()} connections")
+        wait, count = pool_wait()
+        if count > count_before:
+            line += f", pool wait {(wait - wait_before) / (count - count_before) * 1000:.2f} ms on average"
+        print(line)
+        for error, count in errors.items():
+            print(f"{'':<39} {count} failed: {error}")
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': args.redis_url})
+    from redis.asyncio import ConnectionPool, Redis
+    from app.connections import create_redis
+
+    pool = ConnectionPool.from_url(args.redis_url, max_connections=256)
+    before = Redis(connection_pool=pool)
+    await run('before: fails past 256', before, args, lambda: pool._created_connections)
+    await pool.disconnect()
+
+    setups = [(f'shared pool of {args.max_connections}', args.redis_url)]
+    if args.unix_socket:
+        db = urlparse(args.redis_url).path.strip('/') or '0'
+        setups.append((f'shared pool of {args.max_connections}, unix', f'unix://{args.unix_socket}?db={db}'))
+    for name, url in setups:
+        redis = create_redis(url, args.max_connections, pool_timeout=5, health_check_interval=30)
+        await run(name, redis, args, lambda: len(redis.connection_pool._connections))
+        await redis.flushdb()
+        await redis.connection_pool.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
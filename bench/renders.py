@@ -0,0 +1,150 @@
+"""
+Bot API calls per posting session, with aiogram_dialog's own manager and with the rendering one,
+which skips unchanged redraws and removing keyboards that aren't there and draws once for a burst
+of messages. A session: /menu, two messages, then three sent at once, all added to the draft,
+a photo with its author picked and picked again, sent, then the main menu:
+
+    python -m bench.renders [--users 200] [--redis-url redis://localhost:6379/15]
+
+Every variant runs in a process of its own. The stand-in trims the text of messages as Telegram
+does, but keeps HTML tags in it: aiogram_dialog's comparison with a clicked message finds HTML
+windows unchanged here, it wouldn't with Telegram.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench.e2e import CHAT_ID, ROOT, Users, configure
+from bench.fake_api import FakeBotAPI
+
+VARIANTS = ('aiogram_dialog', 'rendering')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis, the database is flushed')
+    parser.add_argument('--pause', type=float, default=1, help='seconds a user takes between steps')
+    parser.add_argument('--burst', type=float, default=0.05, help='seconds between the messages sent at once')
+    parser.add_argument('--debounce', type=float, default=0.3, help='RENDER_DEBOUNCE')
+    parser.add_argument('--api-port', type=int, default=8087)
+    parser.add_argument('--variant', choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.mode, args.webhook_port, args.no_storage_batch = 'direct', 0, False
+    return args
+
+
+def use_aiogram_dialog_manager(entry):
+    """Registers dialogs with the manager aiogram_dialog makes by default"""
+    from aiogram_dialog.manager.manager import ManagerImpl
+    from app.extensions.rendering import RenderingManagerFactory
+
+    class Factory(RenderingManagerFactory):
+        def __call__(self, event, data):
+            return ManagerImpl(event=event, data=data, message_manager=self.message_manager,
+                               media_id_storage=self.media_id_storage, registry=self.registry)
+
+    entry.RenderingManagerFactory = Factory
+
+
+async def run(args):
+    api = FakeBotAPI(port=args.api_port)
+    await api.start()
+
+    from app import __main__ as entry
+    from app.bot_loader import bot
+    from app.dedup import dedup
+    from app.drafts import drafts
+    from app.loader import dp, storage
+    from app.moderation import moderation
+    from app.sanitizer import sanitizer
+    from app.sender import send_queue
+    logging.getLogger().setLevel(logging.ERROR)
+
+    if args.redis_url:
+        await storage.redis.flushdb()
+    else:
+        from fakeredis.aioredis import FakeRedis
+        storage.redis = send_queue.redis = dedup.redis = sanitizer.redis = moderation.redis = drafts.redis = FakeRedis()
+
+    if args.variant == 'aiogram_dialog':
+        use_aiogram_dialog_manager(entry)
+    registry = await entry.setup_dispatcher()
+    await send_queue.start(registry)
+    users = Users(api)
+    latencies = []
+
+    async def feed(update):
+        if update is None:
+            return
+        started = time.perf_counter()
+        await dp.feed_raw_update(bot, update)
+        latencies.append(time.perf_counter() - started)
+
+    async def step(*updates):
+        # a burst: the messages are handled at the same time, as polling would
+        tasks = []
+        for i, build in enumerate(updates):
+            if i:
+                await asyncio.sleep(args.burst)
+            tasks.append(asyncio.create_task(feed(build())))
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(args.pause)
+
+    async def session(uid):
+        await step(lambda: users.command(uid, '/menu'))
+        await step(lambda: users.text(uid, f'черновик {uid}'))
+        await step(lambda: users.text(uid, f'черновик {uid}, исправленный'))
+        await step(*(lambda i=i: users.text(uid, f'часть {i} от {uid}') for i in range(3)))
+        await step(lambda: users.photo(uid, f'закат {uid}'))
+        await step(lambda: users.click(uid, '#моё'))
+        await step(lambda: users.click(uid, '#моё'))
+        await step(lambda: users.click(uid, 'Отправляем'))
+        await step(lambda: users.click(uid, 'В главное меню'))
+
+    api.calls.clear()
+    await asyncio.gather(*(session(10000 + i) for i in range(args.users)))
+    while await send_queue.size() or await send_queue.in_progress():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+
+    # posts themselves are the same in both variants, only the dialog's calls are compared
+    calls = {method: count for method, count in api.calls.items() if method != 'getme'}
+    calls.pop('sendphoto', None)
+    latencies.sort()
+    print(json.dumps({'calls': calls, 'sessions': args.users, 'posts': api.sent_to[CHAT_ID],
+                      'p50': statistics.median(latencies), 'p99': latencies[int(len(latencies) * 0.99)],
+                      'missed': dict(users.missed)}))
+
+    await send_queue.stop()
+    await bot.session.close()
+    await api.stop()
+
+
+def main(args):
+    print(f"users={args.users} redis={'real' if args.redis_url else 'fakeredis'} debounce={args.debounce} s")
+    for variant in VARIANTS:
+        command = [sys.executable, '-m', 'bench.renders', '--variant', variant, *sys.argv[1:]]
+        output = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True,
+                                env={**os.environ, 'RENDER_DEBOUNCE': str(args.debounce)})
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        sessions = result['sessions']
+        calls = ', '.join(f"{method} {count / sessions:.1f}" for method, count in sorted(result['calls'].items()))
+        print(f"{variant:<15} {sum(result['calls'].values()) / sessions:5.1f} Bot API calls a session ({calls}), "
+              f"update p50 {result['p50'] * 1000:.1f} ms, p99 {result['p99'] * 1000:.1f} ms, "
+              f"{result['posts']} posts" + (f", missed clicks {result['missed']}" if result['missed'] else ''))
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.variant:
+        configure(arguments)
+        asyncio.run(run(arguments))
+    else:
+        main(arguments)
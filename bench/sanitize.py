@@ -0,0 +1,130 @@
+"""
+Throughput of the document sanitizer at 1, 2 and 4 worker processes: N image documents
+are downloaded from a Bot API stand-in, stripped of their metadata and uploaded back,
+while a ticker measures how late the event loop gets:
+
+    python -m bench.sanitize --files 200 --size-mb 4
+"""
+import argparse
+import asyncio
+import os
+import struct
+import tempfile
+import time
+
+from bench.fake_api import FakeBotAPI
+
+CHAT_ID = -1001234567890
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size-mb', type=float, default=4)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=8, help='documents in flight')
+    parser.add_argument('--api-port', type=int, default=8084)
+    return parser.parse_args()
+
+
+def synthetic_jpeg(size: int) -> bytes:
+    """A JPEG-shaped file: EXIF with a GPS-sized payload, a comment and `size` bytes of scan data"""
+    def segment(marker: int, payload: bytes) -> bytes:
+        return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+    # compressed data never has 0xFF followed by anything but 0x00
+    scan = os.urandom(size).replace(b'\xff', b'\xfe')
+    return b''.join((b'\xff\xd8',
+                     segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'),
+                     segment(0xE1, b'Exif\x00\x00MM\x00\x2a\x00\x00\x00\x08\x00\x00' + bytes(60000)),
+                     segment(0xFE, b'taken at home'),
+                     segment(0xDB, bytes(65)),
+                     segment(0xDA, b'\x01\x01\x00\x00\x3f\x00'),
+                     scan,
+                     b'\xff\xd9'))
+
+
+class LoopLag:
+    """Worst delay of a 10 ms ticker, i.e. how long the event loop was blocked"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.worst = 0.0
+        self._task = None
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.worst = max(self.worst, loop.time() - expected)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._tick())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+async def run(args, workers: int, bot, redis):
+    from app.media import MediaDownloader
+    from app.sanitizer import Sanitizer
+
+    size = int(args.size_mb * 1024 * 1024)
+    downloader = MediaDownloader(bot, max_size=size * 2, concurrency=args.concurrency, spool_size=1024 * 1024)
+    sanitizer = Sanitizer(redis, downloader, workers=workers, cache_ttl=60)
+    # pool start-up is not what is measured
+    await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(sanitizer._pool(), time.sleep, 0.1)
+                           for _ in range(workers)))
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def post(i):
+        document = [f'document{workers}-{i}', f'unique{workers}-{i}', 'photo.jpg']
+        async with limit, sanitizer.prepare([document]) as files:
+            sent = await bot.send_document(CHAT_ID, files[document[0]])
+            await sanitizer.remember(files, [document[0]], [sent])
+
+    with LoopLag() as lag:
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(args.files)))
+        elapsed = time.perf_counter() - started
+    await sanitizer.close()
+    print(f"workers={workers}: {args.files / elapsed:.1f} files/s, "
+          f"{args.files * args.size_mb / elapsed:.1f} MB/s, worst loop lag {lag.worst * 1000:.1f} ms")
+
+
+def strip_rate(path: str, size_mb: float, rounds: int = 5) -> float:
+    from app.metadata import strip_metadata
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        strip_metadata(path, path + '.clean')
+    return rounds * size_mb / (time.perf_counter() - started)
+
+
+async def main(args):
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'TELEGRAM_API_URL': f'http://127.0.0.1:{args.api_port}',
+                       'REDIS_URL': 'redis://localhost:6379/0', 'CHAT_ID': str(CHAT_ID)})
+    from fakeredis.aioredis import FakeRedis
+    from app.bot_loader import bot
+
+    body = synthetic_jpeg(int(args.size_mb * 1024 * 1024))
+    api = FakeBotAPI(port=args.api_port, file_body=body)
+    await api.start()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'photo.jpg')
+        with open(path, 'wb') as f:
+            f.write(body)
+        print(f"{args.files} documents of {args.size_mb:g} MB, {args.concurrency} in flight, "
+              f"{os.cpu_count()} CPUs; stripping alone: {strip_rate(path, args.size_mb):.0f} MB/s per process")
+    try:
+        for workers in args.workers:
+            await run(args, workers, bot, FakeRedis())
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
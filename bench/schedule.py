@@ -0,0 +1,114 @@
+"""
+Scheduled posts: time to schedule one with an empty and a full schedule, and the lag between
+a post being due and it reaching the send queue while --pending posts fall due over --spread seconds:
+
+    python -m bench.schedule [--redis-url redis://localhost:6379/15] [--pending 100000] [--spread 20]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis, the database is flushed')
+    parser.add_argument('--pending', type=int, default=100_000, help='posts in the full schedule')
+    parser.add_argument('--spread', type=float, default=20, help='seconds the full schedule falls due over')
+    parser.add_argument('--batch', type=int, default=100, help='SCHEDULE_BATCH')
+    parser.add_argument('--inserts', type=int, default=2000)
+    return parser.parse_args()
+
+
+def job(i: int, due: float) -> dict:
+    # 'due' is the bench's own, the lag is measured from it
+    return {'id': f'job{i}', 'user_id': 1, 'user_chat_id': 1, 'chat_id': -1, 'content_type': 'text',
+            'text': f'Отложенный пост номер {i}', 'scheduled': True, 'due': due}
+
+
+async def fill(redis, count: int, start: float, spread: float):
+    from app.scheduler import DUE_KEY, JOBS_KEY
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for i in range(count):
+            due = start + spread * i / count
+            pipe.hset(JOBS_KEY, f'job{i}', json.dumps(job(i, due)))
+            pipe.zadd(DUE_KEY, {f'job{i}': due})
+            if len(pipe) >= 10_000:
+                await pipe.execute()
+        await pipe.execute()
+
+
+def percentiles(values) -> str:
+    values = sorted(values)
+    return (f"p50 {statistics.median(values) * 1000:7.1f} ms, p99 {values[int(len(values) * 0.99)] * 1000:7.1f} ms, "
+            f"max {values[-1] * 1000:7.1f} ms")
+
+
+async def bench_inserts(args, redis, scheduler):
+    for size in (0, args.pending):
+        await redis.flushdb()
+        # far in the future, nothing falls due
+        await fill(redis, size, time.time() + 3600, 3600)
+        timings = []
+        for i in range(args.inserts):
+            started = time.perf_counter()
+            await scheduler.schedule(job(size + i, 0), 3600)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        print(f"schedule with {size:>7} pending: p50 {statistics.median(timings) * 1e6:6.0f} µs, "
+              f"p99 {timings[int(len(timings) * 0.99)] * 1e6:6.0f} µs")
+
+    if args.redis_url:
+        from app.scheduler import DUE_KEY, JOBS_KEY
+        used = await redis.memory_usage(DUE_KEY) + await redis.memory_usage(JOBS_KEY)
+        print(f"memory per pending post: {used / (args.pending + args.inserts):.0f} bytes")
+
+
+async def bench_lag(args, redis, scheduler):
+    await redis.flushdb()
+    # the first posts mustn't fall due while the rest are still being added
+    start = time.time() + 2 + args.pending / 10_000
+    await fill(redis, args.pending, start, args.spread)
+    if time.time() > start:
+        print("the schedule took too long to fill, the first posts are late already")
+    scheduler.start()
+
+    lags = []
+    while len(lags) < args.pending:
+        raws = await redis.rpop(scheduler.queue_key, 1000)
+        if not raws:
+            await asyncio.sleep(0.005)
+            continue
+        now = time.time()
+        lags.extend(now - json.loads(raw)['due'] for raw in raws)
+    took = time.time() - start
+    await scheduler.stop()
+
+    print(f"{args.pending} posts due over {args.spread:.0f} s, moved by {took:.1f} s "
+          f"({args.pending / took:.0f}/s), batch {args.batch}")
+    print(f"due to queued: {percentiles(lags)}")
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': args.redis_url or 'redis://localhost:6379/0'})
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url)
+    else:
+        from fakeredis.aioredis import FakeRedis
+        redis = FakeRedis()
+
+    from app.scheduler import Scheduler
+    scheduler = Scheduler(redis, 'bench:send:queue', batch=args.batch, interval=1)
+    await bench_inserts(args, redis, scheduler)
+    await bench_lag(args, redis, scheduler)
+    await redis.flushdb()
+    await redis.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,67 @@
+"""
+Bytes stored per user and encode/decode time of the storage serializers:
+
+    python -m bench.serialization
+"""
+import json
+import timeit
+
+from app.serializers import JsonSerializer, MsgpackSerializer
+
+FILE_ID = "AgACAgIAAxkBAAIBY2P8nX0AAWc1bHqQjR4uQ2xVvVt9AAJpxzEbTq3gS3yTTr8t0wABAQADAgADeQADLgQ"
+
+
+class LegacyJson:
+    """What RedisStorage wrote before the serializers: aiogram's json.dumps"""
+
+    def dumps(self, data):
+        return json.dumps(data).encode()
+
+    loads = JsonSerializer().loads
+
+
+def context(text, medias):
+    dialog_data = {
+        "dialog_error": "", "user_id": 123456789, "message_id": 4242, "messages": [],
+        "text": text, "medias": [FILE_ID] * medias, "media_types": ["photo"] * medias,
+        "media_group_id": "13412341234123412" if medias > 1 else None,
+        "content_author": 2 if medias else None, "content_type": "photo" if medias else "text",
+    }
+    return {"_intent_id": "Ab3dEf", "_stack_id": "", "state": "Main:click_send", "start_data": None,
+            "dialog_data": dialog_data, "widget_data": {"mine_r_ct": "2"}}
+
+
+STACK = {"_id": "", "intents": ["Ab3dEf"], "last_message_id": 4243, "last_media_id": None,
+         "last_media_unique_id": None, "last_income_media_group_id": None}
+
+USERS = {
+    "short text": [context(["Всем привет! Кто идёт на встречу в субботу?"], 0), STACK],
+    "long text": [context(["Длинный пост про жизнь, работу и котиков. " * 95], 0), STACK],
+    "album": [context(["Закат на море 🌅"], 10), STACK],
+}
+
+SERIALIZERS = {
+    "json (before)": LegacyJson(),
+    "json": JsonSerializer(),
+    "msgpack": MsgpackSerializer(compress_threshold=0),
+    "msgpack+zlib>1k": MsgpackSerializer(compress_threshold=1024),
+    "msgpack+zlib>256": MsgpackSerializer(compress_threshold=256),
+}
+
+
+def main():
+    print(f"{'':18}" + "".join(f"{name:>28}" for name in USERS))
+    print(f"{'':18}" + f"{'bytes   dumps   loads':>28}" * len(USERS))
+    for name, serializer in SERIALIZERS.items():
+        row = f"{name:18}"
+        for values in USERS.values():
+            encoded = [serializer.dumps(value) for value in values]
+            size = sum(map(len, encoded))
+            dumps = min(timeit.repeat(lambda: [serializer.dumps(value) for value in values], number=2000, repeat=3))
+            loads = min(timeit.repeat(lambda: [serializer.loads(value) for value in encoded], number=2000, repeat=3))
+            row += f"{size:>12}{dumps / 2000 * 1e6:>6.1f}us{loads / 2000 * 1e6:>6.1f}us"
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
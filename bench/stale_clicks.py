@@ -0,0 +1,135 @@
+"""
+Cost of clicks on stale keyboards: keyboards of a dialog the user has left (OutdatedIntent)
+or one the bot doesn't know (UnknownIntent), and whether the user can go on posting after one.
+Also checks that a new process, as after a deploy, gives the widgets the same ids:
+
+    python -m bench.stale_clicks [--users 200] [--redis-url redis://localhost:6379/15]
+
+A user's two dialogs are started within a second here, and aiogram_dialog intent ids made
+in the same second differ in one of 100 random values: now and then the old keyboard
+belongs to the new dialog and its click isn't stale at all.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+from bench.e2e import CHAT_ID, ROOT, RedisCounter, Users, configure
+from bench.fake_api import FakeBotAPI
+
+WIDGET_IDS = """
+import app.dialogs.main as main, json
+print(json.dumps({str(state): [getattr(widget, 'widget_id', None) for widget in getattr(window.keyboard, 'buttons', [])]
+                  for state, window in main.dialog.windows.items()}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis, the database is flushed')
+    parser.add_argument('--api-port', type=int, default=8087)
+    args = parser.parse_args()
+    args.mode, args.webhook_port, args.no_storage_batch = 'direct', 0, False
+    return args
+
+
+def stale(click, intent_id=None):
+    """The click with the intent id of its keyboard replaced"""
+    if intent_id is not None:
+        query = click['callback_query']
+        query['data'] = intent_id + query['data'][query['data'].index('\x1d'):]
+    return click
+
+
+def widget_ids():
+    output = subprocess.run([sys.executable, '-c', WIDGET_IDS], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+async def run(args):
+    api = FakeBotAPI(port=args.api_port)
+    await api.start()
+
+    from app import __main__ as entry
+    from app.bot_loader import bot
+    from app.dedup import dedup
+    from app.drafts import drafts
+    from app.loader import dp, storage
+    from app.moderation import moderation
+    from app.sanitizer import sanitizer
+    from app.sender import send_queue
+    logging.getLogger().setLevel(logging.ERROR)
+
+    if args.redis_url:
+        await storage.redis.flushdb()
+    else:
+        from fakeredis.aioredis import FakeRedis
+        storage.redis = send_queue.redis = dedup.redis = sanitizer.redis = moderation.redis = drafts.redis = FakeRedis()
+
+    redis = RedisCounter()
+    redis.install()
+    registry = await entry.setup_dispatcher()
+    await send_queue.start(registry)
+    users = Users(api)
+    costs = defaultdict(list)
+    # the post being written is still there to be sent after the stale click
+    kept = Counter()
+
+    async def feed(update, kind=None):
+        if update is None:
+            return
+        round_trips, commands, calls = redis.round_trips, redis.commands, sum(api.calls.values())
+        started = time.perf_counter()
+        await dp.feed_raw_update(bot, update)
+        if kind:
+            costs[kind].append((time.perf_counter() - started, redis.round_trips - round_trips,
+                                redis.commands - commands, sum(api.calls.values()) - calls))
+
+    async def user(uid, kind):
+        await feed(users.command(uid, '/menu'))
+        await feed(users.text(uid, f'первый пост {uid}'))
+        first_send, first_menu = users.click(uid, 'Отправляем'), users.click(uid, 'В главное меню')
+        if kind == 'unknown intent':
+            await feed(stale(first_send, 'NoSuchIntent'), kind)
+        else:
+            # a new dialog, the first keyboard is outdated
+            await feed(first_menu)
+            await feed(users.text(uid, f'второй пост {uid}'))
+            await feed(first_send if kind == 'outdated: send' else first_menu, kind)
+        send = users.click(uid, 'Отправляем')
+        kept[kind] += send is not None
+        await feed(send)
+
+    kinds = ('outdated: send', 'outdated: main menu', 'unknown intent')
+    for i in range(args.users):
+        await user(10000 + i, kinds[i % len(kinds)])
+
+    while await send_queue.size() or await send_queue.in_progress():
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+    print(f"users={args.users} redis={'real' if args.redis_url else 'fakeredis'}")
+    for kind, rows in costs.items():
+        seconds, round_trips, commands, calls = zip(*rows)
+        print(f"{kind:<20} {statistics.median(seconds) * 1000:6.2f} ms, {statistics.mean(round_trips):5.1f} round trips, "
+              f"{statistics.mean(commands):5.1f} Redis commands, {statistics.mean(calls):4.1f} Bot API calls, "
+              f"post kept {kept[kind]}/{len(rows)}")
+    print(f"posts sent: {api.sent_to[CHAT_ID]} of {args.users}")
+
+    ids = widget_ids()
+    print(f"widget ids in a new process: {'the same' if ids == widget_ids() else 'different'}")
+
+    await send_queue.stop()
+    await bot.session.close()
+    await api.stop()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    configure(arguments)
+    asyncio.run(run(arguments))
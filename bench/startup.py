@@ -0,0 +1,123 @@
+"""
+Cold start and restart time of the bot: a child process runs app.__main__ against
+a Bot API stand-in and is timed from its launch to its first getUpdates. Its updates
+loop then crashes once and is timed again until it polls. A restart used to mean a new
+process, so the cold start is what a crash cost before.
+
+    python -m bench.startup [--starts 3] [--redis-url redis://localhost:6379/15]
+
+With a real Redis, the commands are set by the first start only.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+from bench.fake_api import FakeBotAPI
+
+ROOT = Path(__file__).absolute().parent.parent
+CRASH_AFTER = 1.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--starts', type=int, default=3)
+    parser.add_argument('--redis-url', help='real Redis shared by the starts instead of fakeredis in each')
+    parser.add_argument('--api-port', type=int, default=8085)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+class TimedAPI(FakeBotAPI):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.polls = []
+
+    async def result(self, method, data):
+        if method == 'getupdates':
+            self.polls.append(time.time())
+        return await super().result(method, data)
+
+
+def child():
+    """The bot, with its updates loop crashing once CRASH_AFTER seconds after it started"""
+    from app import __main__ as entry
+
+    if not os.environ.get('BENCH_REDIS'):
+        from fakeredis.aioredis import FakeRedis
+        from app.dedup import dedup
+        from app.loader import storage
+        from app.polling import poller
+        from app.sanitizer import sanitizer
+        from app.sender import send_queue
+        storage.redis = send_queue.redis = dedup.redis = sanitizer.redis = poller.redis = FakeRedis()
+
+    receive_updates = entry.receive_updates
+    crashed = False
+
+    async def crash_once():
+        nonlocal crashed
+        if crashed:
+            return await receive_updates()
+        crashed = True
+        try:
+            await asyncio.wait_for(receive_updates(), CRASH_AFTER)
+        except asyncio.TimeoutError:
+            pass
+        print(f'crash {time.time()}', flush=True)
+        raise RuntimeError('crash for the benchmark')
+
+    entry.receive_updates = crash_once
+    asyncio.run(entry.main())
+
+
+async def start_once(args, api: TimedAPI):
+    env = dict(os.environ, BOT_TOKEN='42:BENCH', TELEGRAM_API_URL=api.url, CHAT_ID='-1001234567890',
+               REDIS_URL=args.redis_url or 'redis://localhost:6379/0', BENCH_REDIS=args.redis_url or '',
+               RESTART_DELAY='0', SWEEP_INTERVAL='0', METRICS_PORT='0', LOG_LEVEL='CRITICAL', PYTHONPATH=str(ROOT))
+    env.pop('SENTRY_DSN', None)
+    api.polls.clear()
+    api.calls.clear()
+
+    launched = time.time()
+    process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'bench.startup', '--child', cwd=ROOT,
+                                                   env=env, stdout=asyncio.subprocess.PIPE)
+    crashed_at = float((await process.stdout.readline()).split()[1])
+    while not api.polls or api.polls[-1] < crashed_at:
+        await asyncio.sleep(0.001)
+    restarted = next(poll for poll in api.polls if poll > crashed_at)
+
+    process.send_signal(signal.SIGINT)
+    stopping = time.time()
+    await process.wait()
+    print(f"cold start {(api.polls[0] - launched) * 1000:6.0f} ms, "
+          f"restart {(restarted - crashed_at) * 1000:5.1f} ms, "
+          f"stop {(time.time() - stopping) * 1000:5.0f} ms, "
+          f"setMyCommands calls: {api.calls['setmycommands']}")
+
+
+async def main(args):
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url)
+        await redis.flushdb()
+        await redis.close()
+
+    api = TimedAPI(port=args.api_port)
+    await api.start()
+    try:
+        for _ in range(args.starts):
+            await start_once(args, api)
+    finally:
+        await api.stop()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child:
+        child()
+    else:
+        asyncio.run(main(arguments))
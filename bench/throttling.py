@@ -0,0 +1,132 @@
+"""
+Per-check overhead of ThrottlingMiddleware on a dispatcher with one throttled /menu handler, updates
+built as in bench.e2e: the per-process TTLCache it used to be, the Redis GCRA check of a chat that
+is let through, and a chat already throttled that is rejected by the local fast path:
+
+    python -m bench.throttling [--updates 20000] [--redis-url redis://localhost:6379/15]
+
+Without --redis-url the checks run on fakeredis, whose Lua is far slower than Redis' own;
+the given Redis database is flushed.
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message
+from cachetools import TTLCache
+
+THROTTLE_TIME = 2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=20_000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--redis-url', help='real Redis to run on instead of fakeredis, the database is flushed')
+    return parser.parse_args()
+
+
+class OldThrottlingMiddleware(BaseMiddleware):
+    # app.middlewares.throttling.ThrottlingMiddleware before it moved to Redis
+    caches = {
+        "default": TTLCache(maxsize=10_000, ttl=THROTTLE_TIME)
+    }
+
+    async def __call__(
+            self,
+            handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+            event: Message,
+            data: Dict[str, Any],
+    ) -> Any:
+        throttling_key = get_flag(data, "throttling_key")
+        if throttling_key is not None and throttling_key in self.caches:
+            if event.chat.id in self.caches[throttling_key]:
+                return
+            else:
+                self.caches[throttling_key][event.chat.id] = None
+        return await handler(event, data)
+
+
+def build_dispatcher(middleware):
+    from aiogram import Dispatcher, Router
+    from aiogram.filters import Command
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    dp = Dispatcher(storage=MemoryStorage())
+    router = Router()
+
+    @router.message(Command('menu'), flags={'throttling_key': 'default'})
+    async def menu(message: Message):
+        return message.text
+
+    dp.include_router(router)
+    if middleware:
+        dp.message.middleware(middleware)
+    return dp
+
+
+async def feed(dp, bot, updates) -> float:
+    started = time.perf_counter()
+    for raw in updates:
+        await dp.feed_raw_update(bot, raw)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': args.redis_url or 'redis://localhost:6379/0'})
+    from aiogram import Bot
+    from bench.e2e import Users
+    from bench.metrics_overhead import NullSession
+    from app.middlewares.throttling import ThrottlingMiddleware
+
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url)
+    else:
+        from fakeredis.aioredis import FakeRedis
+        redis = FakeRedis()
+    await redis.flushdb()
+
+    bot = Bot('42:BENCH', session=NullSession())
+    users = Users(api=None)
+    chats = iter(range(1, 10 ** 9))
+
+    def new_chats():
+        # every update from a chat not seen before: all of them are let through
+        return [users.command(next(chats), '/menu') for _ in range(args.updates)]
+
+    def one_chat():
+        # the first update is let through, the rest are throttled
+        chat = next(chats)
+        return [users.command(chat, '/menu') for _ in range(args.updates)]
+
+    cases = [
+        ('no throttling', None, new_chats),
+        ('TTLCache, let through', OldThrottlingMiddleware, new_chats),
+        ('TTLCache, throttled', OldThrottlingMiddleware, one_chat),
+        ('Redis, let through', lambda: ThrottlingMiddleware(redis), new_chats),
+        ('local, throttled', lambda: ThrottlingMiddleware(redis), one_chat),
+    ]
+    best = {}
+    for _ in range(args.rounds):
+        for name, middleware, updates in cases:
+            dp = build_dispatcher(middleware and middleware())
+            per_update = await feed(dp, bot, updates())
+            best[name] = min(best.get(name, per_update), per_update)
+
+    plain = best['no throttling']
+    for name, _, _ in cases:
+        print(f"{name:22} {best[name] * 1e6:7.1f} µs an update, "
+              f"{(best[name] - plain) * 1e6:+6.1f} µs to no throttling")
+
+    await redis.flushdb()
+    await redis.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
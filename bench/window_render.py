@@ -0,0 +1,94 @@
+"""
+Render time of every window of the main dialog: its text and keyboard drawn from getter-like data,
+with Format formatting and emojizing the whole template on every render, as it did, and with the
+pre-parsed template and memoized renders. --users users with drafts of different sizes and authors
+picked take turns, so that renders are not all of the same data:
+
+    python -m bench.window_render [--renders 20000] [--users 50]
+
+Getters are left out, they need Redis; the windows are drawn as the manager does once it has the data.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--renders', type=int, default=20_000, help='renders of every window')
+    parser.add_argument('--users', type=int, default=50, help='users whose data the renders take turns with')
+    return parser.parse_args()
+
+
+async def old_render_text(self, data, dialog_manager) -> str:
+    # app.extensions.widgets.Format._render_text before templates were pre-parsed
+    text = self.text.format_map(data)
+    return self.emojize(text)
+
+
+class Manager:
+    """What the widgets of a window use of a DialogManager while rendering"""
+
+    def __init__(self, state):
+        from aiogram_dialog.api.entities import Context
+
+        self.middleware_data = {}
+        self.context = Context(_intent_id='bench', _stack_id='', state=state, start_data=None)
+
+    def current_context(self):
+        return self.context
+
+    def is_preview(self):
+        return False
+
+
+def user_data(uid: int) -> dict:
+    from app.dialogs.main import get
+
+    parts = uid % 5 + 1
+    error = 'Ошибка! Нет текста.' if uid % 7 == 0 else ''
+    return {
+        **get.static_data(),
+        "content_author": uid % 3,
+        "m_type": bool(uid % 2),
+        "draft_parts": parts,
+        "draft_media": uid % 2,
+        "user": None,
+        "dialog_error": error,
+        "no_error": not error,
+        "sent_link": 'Ушло!',
+        "draft_items": [(f"{number}. 📝 часть {number} от {uid}", f'p{number}') for number in range(1, parts + 1)],
+        "part": f"📝 часть 1 от {uid}",
+        "has_part": True,
+    }
+
+
+async def timed(render, manager, users, renders: int) -> float:
+    started = time.perf_counter()
+    for i in range(renders):
+        await render(users[i % len(users)], manager)
+    return (time.perf_counter() - started) / renders
+
+
+async def main(args):
+    # app modules read their settings on import
+    os.environ.update({'BOT_TOKEN': '42:BENCH', 'REDIS_URL': 'redis://localhost:6379/0'})
+    from app.dialogs.main import dialog
+    from app.extensions.widgets import Format
+
+    users = [user_data(uid) for uid in range(1, args.users + 1)]
+    render_text = Format._render_text
+    for state, window in dialog.windows.items():
+        manager = Manager(state)
+        for part, render in (('text', window.render_text), ('keyboard', window.render_kbd)):
+            Format._render_text = old_render_text
+            before = await timed(render, manager, users, args.renders)
+            Format._render_text = render_text
+            after = await timed(render, manager, users, args.renders)
+            print(f"{state.state:<16} {part:<8} before {before * 1e6:6.1f} µs, after {after * 1e6:6.1f} µs "
+                  f"a render ({before / after:.1f}x)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,169 @@
+"""
+Throughput as worker processes are added: an ingress process polls the Bot API stand-in and pushes
+updates to the Redis streams, --workers worker processes handle their shards. Synthetic users
+write a post and send it, over and over; updates handled per second are counted once the load is up:
+
+    python -m bench.workers [--workers 1 2 4] [--users 200] [--redis-url redis://localhost:6379/15]
+
+Every worker handles one shard. Workers are CPU bound without --api-latency, so they only scale
+with cores to run on; with it and a low --worker-concurrency a worker is bound by the updates it
+may handle at once instead, which shows the sharding scale on a single core too.
+Needs a real Redis shared by the processes, its database is flushed.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import defaultdict
+from contextlib import suppress
+
+from bench.drain import ROOT, DrainAPI
+from bench.e2e import CHAT_ID, Users
+
+HANDLED_KEY = 'bench:handled'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of load before counting')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of load counted')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds every Bot API call takes')
+    parser.add_argument('--worker-concurrency', type=int, default=64, help='WORKER_CONCURRENCY')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--api-port', type=int, default=8088)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def child():
+    """A bot process, the worker ones recording the id of every update they handled"""
+    from app import __main__ as entry
+    from app.loader import dp, storage
+
+    async def record(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            # dialog background updates are all 0
+            if event.update_id:
+                await storage.redis.rpush(HANDLED_KEY, event.update_id)
+
+    setup_dispatcher = entry.setup_dispatcher
+
+    async def recording_dispatcher():
+        registry = await setup_dispatcher()
+        dp.update.outer_middleware(record)
+        return registry
+
+    entry.setup_dispatcher = recording_dispatcher
+    asyncio.run(entry.main())
+
+
+class WorkersAPI(DrainAPI):
+    """Wakes up the users waiting for the bot to answer them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.answered = defaultdict(asyncio.Event)
+
+    def _remember_keyboard(self, data, message_id):
+        super()._remember_keyboard(data, message_id)
+        if data.get('reply_markup') and 'chat_id' in data:
+            self.answered[int(data['chat_id'])].set()
+
+
+class Load:
+    def __init__(self, api: WorkersAPI, users: int):
+        self.api = api
+        self.users = Users(api)
+        self.count = users
+        self.posts = 0
+        self.running = True
+
+    async def _step(self, uid, update, timeout=10.0) -> bool:
+        """Delivers the update and waits for the bot to answer with a keyboard"""
+        if update is None:
+            return False
+        answered = self.api.answered[uid]
+        answered.clear()
+        await self.api.push(update)
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(answered.wait(), timeout)
+            return True
+        return False
+
+    async def user(self, uid):
+        await self._step(uid, self.users.command(uid, '/menu'))
+        while self.running:
+            if not await self._step(uid, self.users.text(uid, f'пост от {uid}, {time.time()}')):
+                continue
+            answered = self.api.answered[uid]
+            if await self._step(uid, self.users.click(uid, 'Отправляем')):
+                self.posts += 1
+                # the keyboard changes once more when the post is out
+                answered.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(answered.wait(), 10)
+
+    async def run(self, redis, warmup: float, duration: float) -> float:
+        users = [asyncio.create_task(self.user(uid)) for uid in range(10000, 10000 + self.count)]
+        await asyncio.sleep(warmup)
+        handled, posts = await redis.llen(HANDLED_KEY), self.posts
+        await asyncio.sleep(duration)
+        handled, posts = await redis.llen(HANDLED_KEY) - handled, self.posts - posts
+        self.running = False
+        await asyncio.gather(*users)
+        return handled / duration, posts / duration
+
+
+async def start_bot(args, api: WorkersAPI, shards: int, role: str, shard: int = 0):
+    env = dict(os.environ, BOT_TOKEN='42:BENCH', TELEGRAM_API_URL=api.url, CHAT_ID=str(CHAT_ID),
+               CHAT_NAME='bench', BOT_NAME='anon_bench_bot', REDIS_URL=args.redis_url,
+               PROCESS_ROLE=role, SHARDS=str(shards), SHARD_INDEX=str(shard),
+               WORKER_CONCURRENCY=str(args.worker_concurrency),
+               SEND_RATE_PER_MINUTE='1000000', SEND_BURST='1000', DEDUP_WINDOW='0', POLLING_TIMEOUT='1',
+               SWEEP_INTERVAL='0', METRICS_PORT='0', LOG_LEVEL='ERROR', PYTHONPATH=str(ROOT))
+    env.pop('SENTRY_DSN', None)
+    env.pop('DYNO', None)
+    return await asyncio.create_subprocess_exec(sys.executable, '-m', 'bench.workers', '--child', cwd=ROOT, env=env)
+
+
+async def run(args, redis, workers: int):
+    await redis.flushdb()
+    api = WorkersAPI(port=args.api_port, latency=args.api_latency)
+    await api.start()
+    processes = [await start_bot(args, api, workers, 'ingress')]
+    processes += [await start_bot(args, api, workers, 'worker', shard) for shard in range(workers)]
+    try:
+        updates, posts = await Load(api, args.users).run(redis, args.warmup, args.duration)
+    finally:
+        for process in processes:
+            process.terminate()
+        await asyncio.gather(*(process.wait() for process in processes))
+        await api.stop()
+    return updates, posts
+
+
+async def main(args):
+    from redis.asyncio import Redis
+    redis = Redis.from_url(args.redis_url)
+    print(f"users={args.users} api_latency={args.api_latency * 1000:.0f}ms "
+          f"worker_concurrency={args.worker_concurrency} cpus={os.cpu_count()}")
+    first = None
+    for workers in args.workers:
+        updates, posts = await run(args, redis, workers)
+        first = first or updates
+        print(f"{workers} workers: {updates:7.1f} updates/s ({updates / first:.2f}x), {posts:6.1f} posts/s")
+    await redis.flushdb()
+    await redis.close()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child:
+        child()
+    else:
+        asyncio.run(main(arguments))